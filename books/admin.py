@@ -1,12 +1,27 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
 from django.utils import timezone
-from .models import Author, Book, Category, Loan
+from . import events, fines
+from .models import (
+    Author, Book, BorrowerBalance, Branch, Category, Copy, EventCursor, Fine, Job, Loan, LoanEvent, LoanNotification,
+)
+from .services import return_loans
 
 # Register your models here.
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     search_fields = ["name"]
-    list_display = ["name", "description"]
+    list_display = ["name", "description", "fine_daily_rate", "fine_max_amount"]
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and {"fine_daily_rate", "fine_max_amount"} & set(form.changed_data):
+            # le journal ne trace pas ce changement : seul un recalcul complet l'applique aux retours passés
+            messages.warning(
+                request,
+                "Barème modifié : lancez « manage.py compute_fines --full » pour l'appliquer "
+                "aux emprunts déjà retournés.",
+            )
 
 @admin.register(Author)
 class AuthorAdmin(admin.ModelAdmin):
@@ -19,15 +34,102 @@ class LoanAdmin(admin.ModelAdmin):
     list_display = ["book", "borrower_name", "borrowed_at", "due_at", "status"]
     list_filter = ["status", "borrowed_at", "due_at"]
     search_fields = ["borrower_name", "borrower_email", "borrower_card_number"]
-    actions = ["mark_as_returned"]
+    raw_id_fields = ["copy"]
+    actions = ["mark_as_returned", "mark_as_late"]
+
+    def save_model(self, request, obj, form, change):
+        # l'enregistrement de l'admin est déjà dans une transaction
+        old = Loan.objects.filter(pk=obj.pk).first() if change else None
+        super().save_model(request, obj, form, change)
+        if old is None:
+            events.record(obj, events.opening_kind(obj.status), at=obj.borrowed_at)
+        else:
+            events.record_changes(old, obj)
 
     def mark_as_returned(self, request, queryset):
-        for loan in queryset:
-            loan.status = Loan.STATUS_RETURNED
-            loan.returned_at = timezone.now()
-            loan.save()
+        # les emprunts déjà retournés sont ignorés ; les exemplaires sont libérés
+        loan_ids = list(queryset.exclude(status=Loan.STATUS_RETURNED).values_list("pk", flat=True))
+        if loan_ids:
+            return_loans(loan_ids=loan_ids)
     mark_as_returned.short_description = "Marquer comme retourné"
 
+    def mark_as_late(self, request, queryset):
+        now = timezone.now()
+        with transaction.atomic():
+            loans = list(queryset.select_for_update().filter(status=Loan.STATUS_ACTIVE, due_at__lt=now))
+            Loan.objects.filter(pk__in=[loan.pk for loan in loans]).update(status=Loan.STATUS_LATE)
+            events.record_many(loans, LoanEvent.KIND_LATE, at=now)
+    mark_as_late.short_description = "Marquer en retard (échéance dépassée)"
+
+@admin.register(LoanEvent)
+class LoanEventAdmin(admin.ModelAdmin):
+    list_display = ["id", "kind", "loan", "book", "at", "due_at"]
+    list_filter = ["kind", "at"]
+    raw_id_fields = ["loan", "book"]
+
+    # journal en ajout seul
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(EventCursor)
+class EventCursorAdmin(admin.ModelAdmin):
+    list_display = ["name", "position", "updated_at"]
+
+@admin.register(LoanNotification)
+class LoanNotificationAdmin(admin.ModelAdmin):
+    list_display = ["loan", "kind", "sent_at"]
+    list_filter = ["kind", "sent_at"]
+    raw_id_fields = ["loan"]
+
+
+@admin.register(Fine)
+class FineAdmin(admin.ModelAdmin):
+    list_display = ["loan", "borrower_card_number", "days", "amount", "paid", "updated_at"]
+    search_fields = ["borrower_card_number", "loan__borrower_name"]
+    raw_id_fields = ["loan"]
+    readonly_fields = ["loan", "borrower_card_number", "days", "amount", "paid", "updated_at"]
+    actions = ["record_payment"]
+
+    # montants calculés par compute_fines ; seuls les paiements passent par l'admin
+    def has_add_permission(self, request):
+        return False
+
+    def record_payment(self, request, queryset):
+        fines.record_payment(list(queryset.values_list("pk", flat=True)))
+    record_payment.short_description = "Enregistrer le paiement intégral"
+
+@admin.register(BorrowerBalance)
+class BorrowerBalanceAdmin(admin.ModelAdmin):
+    list_display = ["card_number", "balance", "updated_at"]
+    search_fields = ["card_number"]
+    readonly_fields = ["card_number", "balance", "updated_at"]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Branch)
+class BranchAdmin(admin.ModelAdmin):
+    list_display = ["name", "code"]
+    search_fields = ["name", "code"]
+
+@admin.register(Copy)
+class CopyAdmin(admin.ModelAdmin):
+    list_display = ["barcode", "book", "branch", "state", "added_at"]
+    list_filter = ["state", "branch"]
+    search_fields = ["barcode", "book__title", "book__isbn"]
+    raw_id_fields = ["book"]
+
+class CopyInline(admin.TabularInline):
+    model = Copy
+    extra = 0
+    fields = ["barcode", "branch", "state"]
 
 class LoanInline(admin.TabularInline):
     model = Loan
@@ -48,8 +150,9 @@ class BookAdmin(admin.ModelAdmin):
     ]
     list_filter = ["category", "author", "publication_year"]
     search_fields = ["title", "isbn", "author__first_name", "author__last_name"]
-    readonly_fields = ["added_at"]
-    inlines = [LoanInline]
+    # stock calculé à partir des exemplaires
+    readonly_fields = ["added_at", "copies_total", "copies_available"]
+    inlines = [CopyInline, LoanInline]
 
     fieldsets = (
         ("Informations générales", {
@@ -68,3 +171,10 @@ class BookAdmin(admin.ModelAdmin):
             "fields": ("added_at",),
         }),
     )
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ["name", "status", "priority", "attempts", "run_after", "created_at", "finished_at"]
+    list_filter = ["status", "name"]
+    search_fields = ["name", "dedup_key"]
+    readonly_fields = ["created_at", "finished_at", "last_error"]
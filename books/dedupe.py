@@ -0,0 +1,191 @@
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, When
+from django.utils import timezone
+
+from .models import Author, Book
+
+NON_ALNUM = re.compile(r'[^a-z0-9]+')
+LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae', 'ø': 'o', 'ł': 'l', 'đ': 'd'})
+
+# champs recopiés sur l'auteur conservé quand ils y sont vides
+MERGED_FIELDS = ['birth_date', 'death_date', 'nationality', 'biography', 'website', 'photo']
+
+
+# Normalisation et similarité
+
+def normalize_name(value):
+    """Minuscules, sans accents ni ponctuation : « Éluard-Grindel » → « eluard grindel »"""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKD', value.casefold().translate(LIGATURES))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return NON_ALNUM.sub(' ', value).strip()
+
+
+def blocking_key(first_name, last_name):
+    """
+    Clé de bloc : nom de famille normalisé (espaces compris) et initiale du
+    prénom. Seuls les auteurs d'un même bloc sont comparés entre eux.
+    """
+    last = normalize_name(last_name).replace(' ', '')
+    if not last:
+        return None
+    return last, normalize_name(first_name)[:1]
+
+
+def trigrams(value):
+    padded = f'  {value} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Similarité de Jaccard des trigrammes (0 à 1), comme pg_trgm"""
+    if a == b:
+        return 1.0
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb)
+
+
+def is_initial(first):
+    return len(first.replace(' ', '')) <= 1
+
+
+# Détection
+
+@dataclass
+class Report:
+    authors: int = 0
+    blocks: int = 0
+    comparisons: int = 0
+    skipped_blocks: list = field(default_factory=list)     # (clé, taille) des blocs trop grands
+    ambiguous: list = field(default_factory=list)          # auteurs réduits à une initiale, plusieurs candidats
+    clusters: list = field(default_factory=list)           # listes d'identifiants d'auteurs
+
+    @property
+    def duplicates(self):
+        return sum(len(cluster) - 1 for cluster in self.clusters)
+
+
+def find_duplicates(threshold=0.8, max_block=1000, chunk_size=10000):
+    """
+    Regroupe les auteurs quasi identiques (accents, casse, initiales).
+
+    Un seul parcours de la table pour former les blocs, puis comparaison
+    deux à deux dans chaque bloc : le coût reste proche du linéaire tant que
+    les blocs sont petits ; les blocs de plus de `max_block` auteurs sont
+    ignorés et signalés. Un prénom réduit à une initiale n'est rattaché que
+    s'il ne correspond qu'à un seul groupe du bloc.
+    """
+    report = Report()
+    blocks = defaultdict(list)
+    for pk, first_name, last_name in (
+        Author.objects.order_by().values_list('pk', 'first_name', 'last_name').iterator(chunk_size=chunk_size)
+    ):
+        report.authors += 1
+        key = blocking_key(first_name, last_name)
+        if key is not None:
+            blocks[key].append((pk, normalize_name(first_name)))
+
+    for key, entries in blocks.items():
+        if len(entries) < 2:
+            continue
+        report.blocks += 1
+        if len(entries) > max_block:
+            report.skipped_blocks.append((key, len(entries)))
+            continue
+        report.clusters += cluster_block(entries, threshold, report)
+    return report
+
+
+def cluster_block(entries, threshold, report):
+    parent = {pk: pk for pk, _ in entries}
+
+    def find(pk):
+        while parent[pk] != pk:
+            parent[pk] = parent[parent[pk]]
+            pk = parent[pk]
+        return pk
+
+    full = [(pk, first) for pk, first in entries if not is_initial(first)]
+    initials = [(pk, first) for pk, first in entries if is_initial(first)]
+
+    for i, (pk_a, first_a) in enumerate(full):
+        for pk_b, first_b in full[i + 1:]:
+            report.comparisons += 1
+            if similarity(first_a, first_b) >= threshold:
+                parent[find(pk_b)] = find(pk_a)
+
+    # les initiales ensemble, puis avec l'unique groupe de prénoms complets compatible
+    groups = {find(pk) for pk, _ in full}
+    for pk, first in initials[1:]:
+        parent[find(pk)] = find(initials[0][0])
+    if initials:
+        if len(groups) <= 1:
+            for group in groups:
+                parent[find(initials[0][0])] = group
+        else:
+            report.ambiguous += [pk for pk, _ in initials]
+            for pk, _ in initials:
+                parent[pk] = pk
+
+    clusters = defaultdict(list)
+    for pk, _ in entries:
+        clusters[find(pk)].append(pk)
+    return [sorted(cluster) for cluster in clusters.values() if len(cluster) > 1]
+
+
+# Fusion
+
+def merge_duplicates(clusters, batch_size=500):
+    """
+    Fusionne chaque groupe sur l'auteur ayant le plus de livres (le plus
+    ancien à égalité), par lots de `batch_size` groupes, une transaction par
+    lot : livres rattachés à l'auteur conservé (un seul UPDATE), champs vides
+    complétés, doublons supprimés. Retourne (auteurs supprimés, livres déplacés).
+    """
+    deleted = moved = 0
+    for start in range(0, len(clusters), batch_size):
+        batch = clusters[start:start + batch_size]
+        with transaction.atomic():
+            authors = Author.objects.select_for_update().in_bulk([pk for cluster in batch for pk in cluster])
+            counts = dict(
+                Book.objects.filter(author_id__in=authors).values_list('author_id')
+                .annotate(n=Count('pk')).order_by()
+            )
+            target = {}
+            survivors = []
+            for cluster in batch:
+                cluster = [pk for pk in cluster if pk in authors]   # supprimés entre-temps
+                if len(cluster) < 2:
+                    continue
+                keep = min(cluster, key=lambda pk: (-counts.get(pk, 0), pk))
+                survivor = authors[keep]
+                for pk in cluster:
+                    if pk != keep:
+                        target[pk] = keep
+                        fill_blank_fields(survivor, authors[pk])
+                survivors.append(survivor)
+            if not target:
+                continue
+
+            moved += Book.objects.filter(author_id__in=target).update(
+                author_id=Case(
+                    *[When(author_id=pk, then=keep) for pk, keep in target.items()],
+                    output_field=IntegerField(),
+                ),
+                updated_at=timezone.now(),     # cartes, facettes et pages pré-rendues
+            )
+            Author.objects.bulk_update(survivors, MERGED_FIELDS)
+            deleted += Author.objects.filter(pk__in=target).delete()[0]
+    return deleted, moved
+
+
+def fill_blank_fields(survivor, duplicate):
+    for name in MERGED_FIELDS:
+        if not getattr(survivor, name) and getattr(duplicate, name):
+            setattr(survivor, name, getattr(duplicate, name))
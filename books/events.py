@@ -0,0 +1,262 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import live
+from .models import EventCursor, Loan, LoanEvent
+
+# état d'un emprunt après chaque type d'événement
+STATUS_AFTER = {
+    LoanEvent.KIND_PENDING: Loan.STATUS_PENDING,
+    LoanEvent.KIND_CREATED: Loan.STATUS_ACTIVE,
+    LoanEvent.KIND_RETURNED: Loan.STATUS_RETURNED,
+    LoanEvent.KIND_LATE: Loan.STATUS_LATE,
+    LoanEvent.KIND_EXTENDED: Loan.STATUS_ACTIVE,
+}
+
+
+# Écriture (dans la transaction de la modification)
+
+def notify(book_ids):
+    # kiosques abonnés (live.py), une fois la modification validée
+    book_ids = set(book_ids)
+    transaction.on_commit(lambda: live.publish(book_ids), robust=True)
+
+
+def record(loan, kind, at=None):
+    notify([loan.book_id])
+    return LoanEvent.objects.create(
+        loan_id=loan.pk,
+        book_id=loan.book_id,
+        kind=kind,
+        at=at or timezone.now(),
+        due_at=loan.due_at,
+    )
+
+
+def record_many(loans, kind, at=None):
+    """Un événement par emprunt, en un seul INSERT (opérations groupées)"""
+    at = at or timezone.now()
+    notify(loan.book_id for loan in loans)
+    return LoanEvent.objects.bulk_create([
+        LoanEvent(loan_id=loan.pk, book_id=loan.book_id, kind=kind, at=at, due_at=loan.due_at)
+        for loan in loans
+    ])
+
+
+def opening_kind(status):
+    """Premier événement d'un emprunt : une demande en attente n'est pas encore un emprunt"""
+    return LoanEvent.KIND_PENDING if status == Loan.STATUS_PENDING else LoanEvent.KIND_CREATED
+
+
+def record_changes(old, loan, at=None):
+    """
+    Événements correspondant à la modification d'un emprunt existant (admin).
+
+    `old` est l'état en base avant l'enregistrement de `loan`.
+    """
+    if old.status != loan.status and loan.status in (Loan.STATUS_RETURNED, Loan.STATUS_LATE, Loan.STATUS_PENDING):
+        record(loan, loan.status, at=at)
+    elif old.status == Loan.STATUS_PENDING and loan.status == Loan.STATUS_ACTIVE:
+        record(loan, LoanEvent.KIND_CREATED, at=at)
+    elif old.due_at and loan.due_at and loan.due_at > old.due_at:
+        record(loan, LoanEvent.KIND_EXTENDED, at=at)
+
+
+# Lecture
+#
+# Les numéros sont attribués à l'insertion, pas à la validation : sur
+# PostgreSQL, deux transactions concurrentes peuvent valider leurs événements
+# dans le désordre (n° 11 visible avant le n° 10). Un consommateur qui aurait
+# déjà avancé son curseur à 11 ne verrait jamais le 10. La lecture s'arrête
+# donc au premier numéro manquant, tant que l'événement qui le suit a moins de
+# LOAN_EVENTS_SETTLE_SECONDS : passé ce délai, le numéro est considéré comme
+# perdu (transaction annulée, compaction) et la lecture continue.
+
+def settle_delay():
+    return timedelta(seconds=getattr(settings, 'LOAN_EVENTS_SETTLE_SECONDS', 60))
+
+
+def settled(events, after, now=None):
+    """Début de `events` (triés par numéro, après `after`) qui ne saute aucun numéro récent"""
+    settled_before = (now or timezone.now()) - settle_delay()
+    ready = []
+    for event in events:
+        if event.pk != after + 1 and event.recorded_at > settled_before:
+            break
+        ready.append(event)
+        after = event.pk
+    return ready
+
+
+def changes(after=0, limit=500, now=None):
+    """
+    Événements postérieurs au curseur `after`, dans l'ordre de la séquence.
+
+    Retourne (événements, nouveau curseur). Le curseur est le numéro du
+    dernier événement lu : le consommateur le conserve et le repasse à
+    l'appel suivant. La page peut être plus courte que `limit` alors que
+    des événements suivent : un numéro manquant récent est attendu avant
+    d'aller au-delà (voir plus haut).
+    """
+    events = settled(LoanEvent.objects.filter(pk__gt=after).order_by('pk')[:limit], after, now)
+    return events, events[-1].pk if events else after
+
+
+def position(after=0, now=None, chunk_size=5000):
+    """Curseur le plus avancé que `changes` atteindrait depuis `after` (numéros seuls)"""
+    while True:
+        page = (
+            LoanEvent.objects.filter(pk__gt=after)
+            .order_by('pk')
+            .only('pk', 'recorded_at')[:chunk_size]
+        )
+        ready = settled(page, after, now)
+        if ready:
+            after = ready[-1].pk
+        if len(ready) < chunk_size:
+            return after
+
+
+def head(now=None):
+    """
+    Position courante du journal, pour un consommateur qui ne veut que la suite.
+
+    Les événements plus anciens que le délai de garde sont tous visibles : on
+    part du dernier d'entre eux (quelques lignes lues depuis la fin de la
+    séquence) et on avance sur les plus récents sans sauter de numéro.
+    """
+    now = now or timezone.now()
+    start = (
+        LoanEvent.objects.filter(recorded_at__lte=now - settle_delay())
+        .order_by('-pk')
+        .values_list('pk', flat=True)
+        .first()
+    )
+    return position(start or 0, now)
+
+
+def stream(after=0, until=None, chunk_size=2000):
+    """
+    Parcourt le journal par pages de `chunk_size` (pagination par clé).
+
+    La mémoire utilisée ne dépend pas de la taille du journal : c'est le
+    parcours à utiliser pour rejouer ou exporter une année d'événements.
+    Comme `changes`, il s'arrête avant un numéro manquant récent.
+    """
+    while True:
+        page, after = changes(after, chunk_size)
+        yield from (event for event in page if until is None or event.at < until)
+        if len(page) < chunk_size:
+            return
+
+
+def fold(events, state=None):
+    """
+    Rejoue des événements : état de chaque emprunt, indexé par son id.
+
+    `state` permet de reprendre un rejeu précédent avec les événements suivants.
+    """
+    state = {} if state is None else state
+    for event in events:
+        loan = state.setdefault(event.loan_id, {'book_id': event.book_id, 'borrowed_at': None})
+        loan['status'] = STATUS_AFTER[event.kind]
+        loan['due_at'] = event.due_at
+        loan['sequence'] = event.pk
+        if event.kind == LoanEvent.KIND_CREATED:
+            loan['borrowed_at'] = event.at
+        elif event.kind == LoanEvent.KIND_RETURNED:
+            loan['returned_at'] = event.at
+    return state
+
+
+def catch_up(name, handler, limit=500):
+    """
+    Transmet à `handler` les événements que le consommateur `name` n'a pas vus.
+
+    Le curseur avance dans la même transaction que le traitement : si
+    `handler` échoue, la page sera présentée de nouveau. Retourne le nombre
+    d'événements traités.
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            cursor, _ = EventCursor.objects.select_for_update().get_or_create(name=name)
+            events, position = changes(cursor.position, limit)
+            if not events:
+                return total
+            handler(events)
+            cursor.position = position
+            cursor.save(update_fields=['position', 'updated_at'])
+        total += len(events)
+
+
+# Compaction
+
+def compact(before, chunk_size=1000):
+    """
+    Ne garde, pour chaque emprunt, que son dernier événement antérieur à `before`.
+
+    Les emprunts sont traités par tranches d'identifiants, chacune dans sa
+    propre transaction. Le rejeu d'un journal compacté donne le même état
+    final (statut, échéance, date de retour) ; seules les dates d'emprunt
+    des emprunts compactés sont perdues. Retourne le nombre d'événements
+    supprimés.
+    """
+    deleted = 0
+    last_loan = 0
+    old_events = LoanEvent.objects.filter(at__lt=before)
+    while True:
+        loan_ids = list(
+            old_events.filter(loan_id__gt=last_loan)
+            .order_by('loan_id')
+            .values_list('loan_id', flat=True)
+            .distinct()[:chunk_size]
+        )
+        if not loan_ids:
+            return deleted
+        with transaction.atomic():
+            latest = (
+                old_events.filter(loan_id__in=loan_ids)
+                .values('loan_id')
+                .annotate(last=Max('pk'))
+                .values_list('last', flat=True)
+            )
+            deleted += (
+                old_events.filter(loan_id__in=loan_ids)
+                .exclude(pk__in=list(latest))
+                .delete()[0]
+            )
+        last_loan = loan_ids[-1]
+
+
+# Reprise de l'existant (migration)
+
+def backfill(loan_model, event_model, batch_size=1000):
+    """Crée les événements déductibles des emprunts déjà enregistrés, par lots"""
+    created = 0
+    batch = []
+    for loan in loan_model.objects.order_by('borrowed_at', 'pk').iterator(chunk_size=batch_size):
+        batch.append(event_model(
+            loan_id=loan.pk, book_id=loan.book_id, kind=opening_kind(loan.status),
+            at=loan.borrowed_at, due_at=loan.due_at,
+        ))
+        if loan.status == 'late':
+            batch.append(event_model(
+                loan_id=loan.pk, book_id=loan.book_id, kind='late',
+                at=loan.due_at, due_at=loan.due_at,
+            ))
+        elif loan.status == 'returned':
+            batch.append(event_model(
+                loan_id=loan.pk, book_id=loan.book_id, kind='returned',
+                at=loan.returned_at or loan.due_at, due_at=loan.due_at,
+            ))
+        if len(batch) >= batch_size:
+            created += len(event_model.objects.bulk_create(batch))
+            batch = []
+    if batch:
+        created += len(event_model.objects.bulk_create(batch))
+    return created
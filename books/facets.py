@@ -0,0 +1,340 @@
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from django.conf import settings
+from django.db.models import Case, Count, F, Value, When
+from django.db.models.functions import Trim
+
+from .models import Book, Category
+
+FACETS = ('category', 'language', 'decade', 'publisher', 'availability')
+
+AVAILABILITY_LABELS = {1: 'Disponible', 0: 'Indisponible'}
+
+# marge de relecture : une transaction validée tard peut porter un updated_at
+# légèrement antérieur au dernier relevé
+WATERMARK_OVERLAP = timedelta(seconds=30)
+
+
+def normalise(value):
+    """Valeur d'une facette texte, telle que la calcule TRIM() en SQL (espaces seulement)"""
+    return (value or '').strip(' ')
+
+
+def facet_expressions():
+    """Valeur de chaque facette en SQL, identique à celle rangée dans l'instantané"""
+    return {
+        'category': F('category_id'),
+        'language': Trim('language'),
+        'decade': F('publication_year') / 10 * 10,
+        'publisher': Trim('publisher'),
+        'availability': Case(When(copies_available__gt=0, then=Value(1)), default=Value(0)),
+    }
+
+
+def filter_facet(books, facet, value):
+    """Filtre les livres sur la valeur normalisée d'une facette (celle des liens du panneau)"""
+    key = f'facet_{facet}'
+    return books.alias(**{key: facet_expressions()[facet]}).filter(**{key: value})
+
+
+class ValueCodes:
+    """Dictionnaire valeur ↔ code entier d'une colonne de facette"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class CatalogueSnapshot:
+    """
+    Copie en mémoire, par colonnes NumPy, des champs de `Book` utiles aux facettes.
+
+    Chaque facette est stockée sous forme de codes entiers : filtrer revient à
+    combiner des masques booléens et compter à un `np.bincount`, sans requête
+    SQL. Les livres modifiés sont appliqués ligne à ligne (signaux `Book` et
+    relecture périodique des livres dont `updated_at` a avancé).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.built = False
+        self.built_at = 0
+        self.checked_at = 0
+        self.watermark = None
+
+    # Construction et mises à jour
+
+    def build(self):
+        rows = list(
+            Book.objects.order_by('id')
+            .values_list(*self.row_fields())
+            .iterator(chunk_size=10000)
+        )
+        with self.lock:
+            self.dictionaries = {facet: ValueCodes() for facet in FACETS}
+            self.positions = {}
+            size = len(rows)
+            self.ids = np.zeros(size, dtype=np.int64)
+            self.years = np.zeros(size, dtype=np.int32)
+            self.alive = np.zeros(size, dtype=bool)
+            self.columns = {facet: np.zeros(size, dtype=np.int32) for facet in FACETS}
+            self.watermark = None
+            for row in rows:
+                self.store(row)
+            self.built = True
+            self.built_at = self.checked_at = time.monotonic()
+
+    def row_fields(self):
+        return (
+            'id', 'category_id', 'language', 'publication_year',
+            'publisher', 'copies_available', 'updated_at',
+        )
+
+    def row_from_book(self, book):
+        return (
+            book.pk, book.category_id, book.language, book.publication_year,
+            book.publisher, book.copies_available, book.updated_at,
+        )
+
+    def store(self, row, advance=True):
+        """Écrit (ou réécrit) une ligne ; agrandit les colonnes si le livre est nouveau"""
+        book_id, category_id, language, year, publisher, available, updated_at = row
+        position = self.positions.get(book_id)
+        if position is None:
+            position = self.positions[book_id] = len(self.positions)
+            if position >= len(self.ids):
+                self.grow(max(16, len(self.ids)))
+
+        self.ids[position] = book_id
+        self.years[position] = year
+        self.alive[position] = True
+        values = {
+            'category': category_id,
+            'language': normalise(language),
+            'decade': year // 10 * 10,
+            'publisher': normalise(publisher),
+            'availability': int(available > 0),
+        }
+        for facet, value in values.items():
+            self.columns[facet][position] = self.dictionaries[facet].code(value)
+
+        if advance and updated_at and (self.watermark is None or updated_at > self.watermark):
+            self.watermark = updated_at
+
+    def grow(self, extra):
+        self.ids = np.concatenate([self.ids, np.zeros(extra, dtype=np.int64)])
+        self.years = np.concatenate([self.years, np.zeros(extra, dtype=np.int32)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        for facet in FACETS:
+            self.columns[facet] = np.concatenate(
+                [self.columns[facet], np.zeros(extra, dtype=np.int32)]
+            )
+
+    def apply_book(self, book):
+        with self.lock:
+            if self.built:
+                # le relevé n'avance qu'avec les lectures en base : les
+                # modifications des autres processus ne sont pas sautées
+                self.store(self.row_from_book(book), advance=False)
+
+    def remove_book(self, book_id):
+        with self.lock:
+            if self.built and book_id in self.positions:
+                self.alive[self.positions[book_id]] = False
+
+    def refresh(self):
+        """
+        Relit uniquement les livres modifiés depuis le dernier passage.
+
+        Une reconstruction complète a lieu toutes les FACET_SNAPSHOT_REBUILD_SECONDS
+        pour rattraper les suppressions faites par d'autres processus.
+        """
+        now = time.monotonic()
+        rebuild_every = getattr(settings, 'FACET_SNAPSHOT_REBUILD_SECONDS', 3600)
+        if not self.built or now - self.built_at > rebuild_every:
+            self.build()
+            return
+
+        changed = Book.objects.order_by()
+        if self.watermark is not None:
+            changed = changed.filter(updated_at__gt=self.watermark - WATERMARK_OVERLAP)
+        with self.lock:
+            for row in changed.values_list(*self.row_fields()):
+                self.store(row)
+            self.checked_at = now
+
+    def ensure_fresh(self):
+        max_age = getattr(settings, 'FACET_SNAPSHOT_MAX_AGE', 5)
+        if not self.built or time.monotonic() - self.checked_at > max_age:
+            self.refresh()
+
+    # Filtrage et comptage
+
+    def masks(self, filters, ids=None):
+        """Un masque booléen par facette filtrée, plus le masque commun (années, ids)"""
+        size = len(self.positions)
+        base = self.alive[:size].copy()
+        if filters.get('year_min'):
+            base &= self.years[:size] >= filters['year_min']
+        if filters.get('year_max'):
+            base &= self.years[:size] <= filters['year_max']
+        if ids is not None:
+            base &= np.isin(self.ids[:size], np.fromiter(ids, dtype=np.int64))
+
+        masks = {}
+        for facet in FACETS:
+            value = filters.get(facet)
+            if value in (None, ''):
+                continue
+            code = self.dictionaries[facet].codes.get(value)
+            if code is None:
+                masks[facet] = np.zeros(size, dtype=bool)
+            else:
+                masks[facet] = self.columns[facet][:size] == code
+        return base, masks
+
+    def counts(self, filters, ids=None):
+        """
+        Nombre de livres par valeur de chaque facette.
+
+        Les comptes d'une facette tiennent compte de tous les autres filtres
+        mais pas du sien, pour montrer ce que donnerait chaque autre valeur.
+        """
+        with self.lock:
+            size = len(self.positions)
+            base, masks = self.masks(filters, ids)
+            result = {}
+            for facet in FACETS:
+                mask = base.copy()
+                for other, other_mask in masks.items():
+                    if other != facet:
+                        mask &= other_mask
+                counts = np.bincount(
+                    self.columns[facet][:size][mask],
+                    minlength=len(self.dictionaries[facet]),
+                )
+                values = self.dictionaries[facet].values
+                result[facet] = {values[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+            return result
+
+
+snapshot = CatalogueSnapshot()
+
+
+def sql_counts(books, filters):
+    """
+    Mêmes comptes que `CatalogueSnapshot.counts`, par un GROUP BY par facette.
+
+    Sert aux recherches textuelles trop larges pour passer leurs ids à
+    l'instantané : rien n'est chargé en mémoire côté Python.
+    """
+    books = books.order_by()
+    if filters.get('year_min'):
+        books = books.filter(publication_year__gte=filters['year_min'])
+    if filters.get('year_max'):
+        books = books.filter(publication_year__lte=filters['year_max'])
+    selected = {facet: filters[facet] for facet in FACETS if filters.get(facet) not in (None, '')}
+
+    result = {}
+    for facet, expression in facet_expressions().items():
+        rows = books
+        for other, value in selected.items():
+            if other != facet:
+                rows = filter_facet(rows, other, value)
+        result[facet] = dict(
+            rows.annotate(facet_value=expression)
+            .values('facet_value')
+            .annotate(n=Count('id'))
+            .values_list('facet_value', 'n')
+        )
+    return result
+
+
+def facet_counts(filters, books=None, limit=10):
+    """
+    Facettes prêtes pour le template : liste de dicts (value, label, count, selected).
+
+    `filters` reprend les champs nettoyés de BookSearchForm ; `books` restreint
+    les comptes aux livres retenus par une recherche textuelle. Au plus
+    FACET_MAX_IDS de leurs ids sont lus pour filtrer l'instantané ; au-delà,
+    les comptes sont faits en SQL.
+    """
+    filters = dict(filters)
+    if filters.get('category') is not None and hasattr(filters['category'], 'pk'):
+        filters['category'] = filters['category'].pk
+    if filters.get('available_only'):
+        filters['availability'] = 1
+
+    if books is None:
+        snapshot.ensure_fresh()
+        counts = snapshot.counts(filters)
+    else:
+        max_ids = getattr(settings, 'FACET_MAX_IDS', 5000)
+        ids = list(books.order_by().values_list('id', flat=True)[:max_ids + 1])
+        if len(ids) > max_ids:
+            counts = sql_counts(books, filters)
+        else:
+            snapshot.ensure_fresh()
+            counts = snapshot.counts(filters, ids)
+
+    category_names = dict(
+        Category.objects.filter(pk__in=[pk for pk in counts['category'] if pk])
+        .values_list('pk', 'name')
+    )
+    labels = {
+        'category': lambda value: category_names.get(value, 'Sans catégorie'),
+        'language': lambda value: value or 'Non renseignée',
+        'decade': lambda value: f'Années {value}',
+        'publisher': lambda value: value or 'Non renseigné',
+        'availability': AVAILABILITY_LABELS.get,
+    }
+
+    facets = {}
+    for facet in FACETS:
+        items = sorted(counts[facet].items(), key=lambda item: (-item[1], str(item[0])))
+        if facet == 'decade':
+            items.sort(key=lambda item: item[0], reverse=True)
+        facets[facet] = [
+            {
+                'value': '' if value is None else value,
+                'label': labels[facet](value),
+                'count': count,
+                'selected': filters.get(facet) not in (None, '') and filters.get(facet) == value,
+            }
+            for value, count in items[:limit]
+        ]
+    return facets
+
+
+def add_facet_links(facets, query):
+    """Ajoute à chaque valeur l'URL qui l'active (ou la désactive si elle l'est déjà)"""
+    parameters = {'availability': 'available_only'}
+    for facet, items in facets.items():
+        parameter = parameters.get(facet, facet)
+        for item in items:
+            params = query.copy()
+            params.pop('page', None)
+            if item['selected']:
+                params.pop(parameter, None)
+            elif item['value'] in ('', 0):
+                # « sans catégorie », « indisponible »… : pas de filtre associé
+                item['url'] = None
+                continue
+            else:
+                params[parameter] = 'on' if facet == 'availability' else item['value']
+            item['url'] = '?' + params.urlencode()
+    return facets
@@ -0,0 +1,229 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    DateTimeField, DecimalField, Exists, F, Func, IntegerField, OuterRef, Q, Subquery, Sum, Value,
+)
+from django.db.models.functions import Coalesce, Greatest, Least, Round
+from django.utils import timezone
+
+from . import events
+from .models import BorrowerBalance, EventCursor, Fine, Loan, LoanEvent
+
+CURSOR = 'fines'
+CENT = Decimal('0.01')
+
+
+# Barème
+
+def default_rate():
+    return Decimal(str(getattr(settings, 'FINE_DAILY_RATE', '0.50')))
+
+
+def default_cap():
+    return Decimal(str(getattr(settings, 'FINE_MAX_AMOUNT', '10.00')))
+
+
+def rate_for(category):
+    """(tarif journalier, plafond) d'une catégorie, ou le barème par défaut"""
+    rate = category.fine_daily_rate if category and category.fine_daily_rate is not None else default_rate()
+    cap = category.fine_max_amount if category and category.fine_max_amount is not None else default_cap()
+    return rate, cap
+
+
+def penalty(days, category=None):
+    rate, cap = rate_for(category)
+    return min(days * rate, cap).quantize(CENT)
+
+
+# Calcul par lots
+
+BATCH_SIZE = 1000
+
+
+class WholeDays(Func):
+    """WholeDays(fin, début) : jours entiers écoulés (jours de retard), selon la base"""
+
+    output_field = IntegerField()
+    arity = 2
+    template = 'CAST(FLOOR(EXTRACT(EPOCH FROM (%(expressions)s)) / 86400) AS integer)'
+    arg_joiner = ' - '
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)', arg_joiner=') - julianday(',
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        end, start = self.get_source_expressions()
+        clone = self.copy()
+        clone.set_source_expressions([start, end])
+        return super(WholeDays, clone).as_sql(
+            compiler, connection,
+            template='CAST(FLOOR(TIMESTAMPDIFF(SECOND, %(expressions)s) / 86400) AS SIGNED)', arg_joiner=', ',
+            **extra_context,
+        )
+
+
+def computed_fines(loans, now):
+    """
+    Jours de retard et montant de chaque emprunt de `loans`, calculés par la
+    base pour tout l'ensemble (même règle que `penalty`).
+    """
+    money = DecimalField(max_digits=8, decimal_places=2)
+    days = Greatest(
+        WholeDays(Coalesce('returned_at', Value(now, output_field=DateTimeField())), 'due_at'),
+        Value(0),
+    )
+    return loans.annotate(
+        days=days,
+        rate=Coalesce('book__category__fine_daily_rate', Value(default_rate(), output_field=money)),
+        cap=Coalesce('book__category__fine_max_amount', Value(default_cap(), output_field=money)),
+    ).annotate(
+        amount=Round(Least(F('days') * F('rate'), F('cap'), output_field=money), 2, output_field=money),
+    )
+
+
+def compute_fines(full=False, now=None):
+    """
+    Met à jour le registre des amendes et les soldes des usagers.
+
+    Seuls sont recalculés les emprunts encore en retard (leur amende
+    augmente chaque jour) et ceux qui apparaissent dans le journal depuis le
+    dernier passage (retour, prolongation) ; `full` reprend tout le journal.
+    Un changement de tarif d'une catégorie n'apparaît pas dans le journal :
+    les emprunts déjà retournés ne le voient qu'avec `full` (compute_fines --full).
+    Les amendes dont l'emprunt a changé de carte passent sur la nouvelle
+    carte, les deux soldes sont recalculés et ceux qui n'ont plus d'amende
+    sont supprimés.
+    Jours et montants sont calculés par la base pour tout l'ensemble ; seules
+    les amendes nouvelles ou modifiées sont lues puis enregistrées (upsert
+    par lots), et seuls les soldes de leurs cartes sont recalculés.
+    Une seule transaction : le curseur n'avance que si tout est enregistré.
+    Retourne (amendes modifiées, soldes mis à jour).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        cursor, _ = EventCursor.objects.select_for_update().get_or_create(name=CURSOR)
+        after = 0 if full else cursor.position
+        # jamais au-delà d'un numéro manquant récent (événement pas encore validé)
+        until = events.position(after, now)
+
+        # amendes dont l'emprunt a changé de carte (numéro corrigé dans l'admin)
+        moved = Fine.objects.exclude(borrower_card_number=F('loan__borrower_card_number'))
+        cards = set()
+        for old, new in moved.values_list('borrower_card_number', 'loan__borrower_card_number').distinct():
+            cards |= {old, new}
+        fines = Fine.objects.filter(pk__in=moved.values('pk')).update(
+            borrower_card_number=Subquery(
+                Loan.objects.filter(pk=OuterRef('loan_id')).values('borrower_card_number')[:1]
+            ),
+            updated_at=now,
+        ) if cards else 0
+
+        # en retard à ce jour, ou modifiés (journal) depuis le dernier passage
+        targets = Loan.objects.filter(
+            Q(status__in=[Loan.STATUS_ACTIVE, Loan.STATUS_LATE], due_at__lt=now)
+            | Q(pk__in=LoanEvent.objects.filter(pk__gt=after, pk__lte=until).values('loan_id'))
+        )
+        changed = computed_fines(targets, now).filter(
+            Q(fine__isnull=True, days__gt=0)
+            | Q(fine__isnull=False) & (~Q(fine__days=F('days')) | ~Q(fine__amount=F('amount')))
+        )
+        batch = []
+        for loan_id, card, days, amount in changed.values_list(
+            'pk', 'borrower_card_number', 'days', 'amount',
+        ).iterator(chunk_size=BATCH_SIZE):
+            batch.append(Fine(loan_id=loan_id, borrower_card_number=card, days=days, amount=amount, updated_at=now))
+            cards.add(card)
+            if len(batch) >= BATCH_SIZE:
+                fines += upsert_fines(batch)
+                batch = []
+        fines += upsert_fines(batch)
+
+        balances = refresh_balances(cards, now)
+        cursor.position = until
+        cursor.save(update_fields=['position', 'updated_at'])
+    return fines, balances
+
+
+def upsert_fines(batch):
+    Fine.objects.bulk_create(
+        batch,
+        update_conflicts=True,
+        unique_fields=['loan'],
+        update_fields=['borrower_card_number', 'days', 'amount', 'updated_at'],
+    )
+    return len(batch)
+
+
+def refresh_balances(cards, now=None):
+    """
+    Recalcule les soldes des cartes `cards` à partir de leurs amendes et
+    supprime ceux qui n'ont plus d'amende. Retourne le nombre de soldes
+    enregistrés ou supprimés.
+    """
+    now = now or timezone.now()
+    cards = sorted(set(cards))
+    total = 0
+    for start in range(0, len(cards), BATCH_SIZE):
+        chunk = cards[start:start + BATCH_SIZE]
+        balances = [
+            BorrowerBalance(card_number=card, balance=balance, updated_at=now)
+            for card, balance in (
+                Fine.objects.filter(borrower_card_number__in=chunk)
+                .values('borrower_card_number')
+                .annotate(balance=Sum(
+                    F('amount') - F('paid'),
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                ))
+                .values_list('borrower_card_number', 'balance')
+                .order_by()
+            )
+        ]
+        BorrowerBalance.objects.bulk_create(
+            balances,
+            update_conflicts=True,
+            unique_fields=['card_number'],
+            update_fields=['balance', 'updated_at'],
+        )
+        # usagers qui n'ont plus aucune amende (emprunt supprimé, carte corrigée)
+        deleted, _ = BorrowerBalance.objects.filter(card_number__in=chunk).exclude(
+            Exists(Fine.objects.filter(borrower_card_number=OuterRef('card_number')))
+        ).delete()
+        total += len(balances) + deleted
+    return total
+
+
+def refresh_cards(cards, now=None):
+    """Recalcule les soldes des cartes données (amende supprimée avec son emprunt)"""
+    return refresh_balances(cards, now)
+
+
+def record_payment(fine_ids, now=None):
+    """Solde les amendes indiquées (paiement intégral) et met à jour les soldes"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        fines = Fine.objects.filter(pk__in=fine_ids)
+        cards = set(fines.values_list('borrower_card_number', flat=True))
+        paid = fines.update(paid=F('amount'), updated_at=now)
+        refresh_balances(cards, now)
+    return paid
+
+
+# Contrôle à l'emprunt
+
+def unpaid_balance(card_number):
+    """Solde impayé au dernier calcul (une lecture sur l'index unique de la carte)"""
+    balance = BorrowerBalance.objects.filter(card_number=card_number).values_list('balance', flat=True).first()
+    return balance or Decimal('0')
+
+
+def blocking_balance(card_number):
+    """Le solde s'il atteint FINE_BLOCK_THRESHOLD (emprunt refusé), sinon None"""
+    threshold = Decimal(str(getattr(settings, 'FINE_BLOCK_THRESHOLD', '5.00')))
+    balance = unpaid_balance(card_number)
+    return balance if balance >= threshold else None
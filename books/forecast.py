@@ -0,0 +1,28 @@
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Book, Loan
+
+OPEN_STATUSES = [Loan.STATUS_ACTIVE, Loan.STATUS_LATE]
+
+
+def next_return_subquery():
+    """Date limite la plus proche parmi les emprunts en cours d'un livre"""
+    return (
+        Loan.objects.filter(book=OuterRef('pk'), status__in=OPEN_STATUSES)
+        .order_by('due_at')
+        .values('due_at')[:1]
+    )
+
+
+def update_available_from(book_ids):
+    """
+    Recalcule `Book.available_from` pour les livres donnés, en une seule requête.
+
+    `updated_at` avance aussi, pour que les cartes en cache affichent la
+    nouvelle date.
+    """
+    return Book.objects.filter(pk__in=book_ids).update(
+        available_from=Subquery(next_return_subquery()),
+        updated_at=timezone.now(),
+    )
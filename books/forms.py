@@ -2,7 +2,10 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from datetime import date
-from .models import Loan, Book, Category
+from .models import Loan, Book, Branch, BranchStock, Category
+from .fines import blocking_balance
+from .popularity import SORT_CHOICES
+from .services import LIMIT_STATUSES, MAX_ACTIVE_LOANS
 import re
 
 
@@ -26,6 +29,17 @@ def validate_library_card(value):
 class LoanForm(forms.ModelForm):
     """Formulaire pour créer un nouvel emprunt"""
     
+    branch = forms.ModelChoiceField(
+        required=False,
+        label='Bibliothèque',
+        queryset=Branch.objects.all(),
+        empty_label='Toutes les bibliothèques',
+        help_text='Bibliothèque où l\'exemplaire est retiré',
+        widget=forms.Select(attrs={
+            'class': 'form-select'
+        })
+    )
+    
     class Meta:
         model = Loan
         fields = ['book', 'borrower_name', 'borrower_email', 'borrower_card_number', 'comments']
@@ -98,18 +112,32 @@ class LoanForm(forms.ModelForm):
         if book and book.copies_available <= 0:
             raise ValidationError(f'Le livre "{book.title}" n\'est plus disponible.')
         
-        # Vérification de la limite de 5 emprunts par usager
+        branch = cleaned_data.get('branch')
+        if book and branch and not BranchStock.objects.filter(
+            book=book, branch=branch, copies_available__gt=0
+        ).exists():
+            raise ValidationError(f'Le livre "{book.title}" n\'est pas disponible à {branch}.')
+        
+        # Vérification de la limite d'emprunts par usager
         if card_number:
             active_loans = Loan.objects.filter(
                 borrower_card_number=card_number,
-                status__in=[Loan.STATUS_ACTIVE, Loan.STATUS_PENDING]
+                status__in=LIMIT_STATUSES
             ).count()
             
-            if active_loans >= 5:
+            if active_loans >= MAX_ACTIVE_LOANS:
                 raise ValidationError(
-                    f'L\'usager avec la carte {card_number} a déjà 5 emprunts actifs. '
+                    f'L\'usager avec la carte {card_number} a déjà {MAX_ACTIVE_LOANS} emprunts actifs. '
                     'La limite maximale est atteinte.'
                 )
+            
+            # Vérification des amendes impayées
+            balance = blocking_balance(card_number)
+            if balance is not None:
+                raise ValidationError(
+                    f'L\'usager avec la carte {card_number} a {balance} € d\'amendes impayées. '
+                    'Les emprunts sont bloqués jusqu\'au règlement.'
+                )
         
         return cleaned_data
 
@@ -164,6 +192,16 @@ class BookSearchForm(forms.Form):
         })
     )
     
+    branch = forms.ModelChoiceField(
+        required=False,
+        label='Disponible à',
+        queryset=Branch.objects.all(),
+        empty_label='Toutes les bibliothèques',
+        widget=forms.Select(attrs={
+            'class': 'form-select'
+        })
+    )
+    
     year_min = forms.IntegerField(
         required=False,
         label='Année min',
@@ -186,6 +224,21 @@ class BookSearchForm(forms.Form):
         })
     )
     
+    # Facettes (liens du panneau latéral)
+    # valeurs déjà normalisées par facets.normalise : pas de second nettoyage
+    language = forms.CharField(required=False, strip=False, widget=forms.HiddenInput())
+    decade = forms.IntegerField(required=False, widget=forms.HiddenInput())
+    publisher = forms.CharField(required=False, strip=False, widget=forms.HiddenInput())
+    
+    sort = forms.ChoiceField(
+        required=False,
+        label='Trier par',
+        choices=SORT_CHOICES,
+        widget=forms.Select(attrs={
+            'class': 'form-select'
+        })
+    )
+    
     def clean(self):
         """Validation des années"""
         cleaned_data = super().clean()
@@ -275,3 +328,151 @@ class ReturnBookForm(forms.Form):
         except Loan.DoesNotExist:
             raise ValidationError('Cet emprunt n\'existe pas.')
         return loan_id
+
+
+# Emprunts et retours groupés
+
+def split_lines(value):
+    """Une saisie par ligne (douchette ou clavier), lignes vides ignorées"""
+    return [line.strip() for line in value.splitlines() if line.strip()]
+
+
+class BulkCheckoutForm(forms.Form):
+    """Formulaire d'emprunt de plusieurs livres en une fois"""
+    
+    borrower_name = forms.CharField(
+        max_length=200,
+        label='Nom de l\'emprunteur',
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Nom complet de l\'emprunteur'
+        })
+    )
+    
+    borrower_email = forms.EmailField(
+        label='Email de l\'emprunteur',
+        widget=forms.EmailInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'email@exemple.fr'
+        })
+    )
+    
+    borrower_card_number = forms.CharField(
+        max_length=8,
+        label='Numéro de carte de bibliothèque',
+        validators=[validate_library_card],
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': '12345678',
+            'maxlength': 8
+        })
+    )
+    
+    branch = forms.ModelChoiceField(
+        required=False,
+        label='Bibliothèque',
+        queryset=Branch.objects.all(),
+        empty_label='Toutes les bibliothèques',
+        widget=forms.Select(attrs={
+            'class': 'form-select'
+        })
+    )
+    
+    isbns = forms.CharField(
+        label='ISBN des livres',
+        help_text='Un ISBN par ligne',
+        widget=forms.Textarea(attrs={
+            'class': 'form-control font-monospace',
+            'rows': 8,
+            'placeholder': '9782070368228\n978-2-07-036002-4'
+        })
+    )
+    
+    comments = forms.CharField(
+        required=False,
+        label='Commentaires',
+        widget=forms.Textarea(attrs={
+            'class': 'form-control',
+            'rows': 2,
+            'placeholder': 'Commentaires optionnels...'
+        })
+    )
+    
+    def clean_borrower_email(self):
+        """Même règle que pour un emprunt simple"""
+        email = self.cleaned_data.get('borrower_email')
+        if email and not email.endswith(('.fr', '.com', '.org')):
+            raise ValidationError('L\'email doit se terminer par .fr, .com ou .org')
+        return email
+    
+    def clean_isbns(self):
+        isbns = split_lines(self.cleaned_data.get('isbns', ''))
+        if not isbns:
+            raise ValidationError('Saisissez au moins un ISBN.')
+        return isbns
+
+
+class BulkReturnForm(forms.Form):
+    """Formulaire de retour de plusieurs livres en une fois"""
+    
+    borrower_card_number = forms.CharField(
+        required=False,
+        max_length=8,
+        label='Numéro de carte de bibliothèque',
+        help_text='Requis pour un retour par ISBN',
+        validators=[validate_library_card],
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': '12345678',
+            'maxlength': 8
+        })
+    )
+    
+    isbns = forms.CharField(
+        required=False,
+        label='ISBN des livres rendus',
+        help_text='Un ISBN par ligne',
+        widget=forms.Textarea(attrs={
+            'class': 'form-control font-monospace',
+            'rows': 6
+        })
+    )
+    
+    loan_ids = forms.CharField(
+        required=False,
+        label='Numéros d\'emprunt',
+        help_text='Un numéro par ligne',
+        widget=forms.Textarea(attrs={
+            'class': 'form-control font-monospace',
+            'rows': 3
+        })
+    )
+    
+    comments = forms.CharField(
+        required=False,
+        label='Commentaires de retour',
+        widget=forms.Textarea(attrs={
+            'class': 'form-control',
+            'rows': 2,
+            'placeholder': 'État des livres, remarques...'
+        })
+    )
+    
+    def clean_isbns(self):
+        return split_lines(self.cleaned_data.get('isbns', ''))
+    
+    def clean_loan_ids(self):
+        loan_ids = split_lines(self.cleaned_data.get('loan_ids', ''))
+        invalid = [loan_id for loan_id in loan_ids if not loan_id.isdigit()]
+        if invalid:
+            raise ValidationError(f'Numéros d\'emprunt invalides : {", ".join(invalid)}')
+        return loan_ids
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        isbns = cleaned_data.get('isbns')
+        if not isbns and not cleaned_data.get('loan_ids') and not self.errors:
+            raise ValidationError('Saisissez au moins un ISBN ou un numéro d\'emprunt.')
+        if isbns and not cleaned_data.get('borrower_card_number') and 'borrower_card_number' not in self.errors:
+            self.add_error('borrower_card_number', 'Le numéro de carte est requis pour un retour par ISBN.')
+        return cleaned_data
@@ -0,0 +1,256 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, Exists, F, IntegerField, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Book, BranchStock, Copy
+
+OPEN_LOAN_STATUSES = ('active', 'late')
+
+
+# Exemplaires en rayon
+
+def available_copies(book_ids, branch=None):
+    """
+    Exemplaires en rayon des livres demandés, verrouillés, groupés par livre.
+
+    Une seule requête quel que soit le nombre de livres ; `branch` limite
+    le choix aux exemplaires d'une bibliothèque.
+    """
+    copies = Copy.objects.select_for_update().filter(book_id__in=book_ids, state=Copy.STATE_AVAILABLE)
+    if branch is not None:
+        copies = copies.filter(branch=branch)
+    grouped = defaultdict(list)
+    for copy in copies.order_by('book_id', 'branch_id', 'pk'):
+        grouped[copy.book_id].append(copy)
+    return grouped
+
+
+def without_copies(book_ids):
+    """
+    Livres sans aucun exemplaire enregistré, parmi `book_ids`.
+
+    Leurs compteurs font foi : ils sont prêtés sans exemplaire, hors de toute
+    bibliothèque, comme avant l'ajout des exemplaires.
+    """
+    if not book_ids:
+        return set()
+    return set(
+        Book.objects.filter(pk__in=book_ids)
+        .exclude(Exists(Copy.objects.filter(book=OuterRef('pk'))))
+        .values_list('pk', flat=True)
+    )
+
+
+def available_at(branch):
+    """Livres ayant au moins un exemplaire en rayon dans `branch` (index partiel de BranchStock)"""
+    return BranchStock.objects.filter(branch=branch, copies_available__gt=0).values('book_id')
+
+
+# Mises à jour incrémentales du stock
+
+def adjust_book_stock(deltas, now=None):
+    """Ajoute `deltas[book_id]` aux exemplaires disponibles des livres, en un seul UPDATE"""
+    if not deltas:
+        return
+    Book.objects.filter(pk__in=deltas).update(
+        copies_available=F('copies_available') + Case(
+            *[When(pk=book_id, then=delta) for book_id, delta in deltas.items()],
+            default=0,
+            output_field=IntegerField(),
+        ),
+        updated_at=now or timezone.now(),
+    )
+
+
+def adjust_branch_stock(deltas):
+    """Ajoute `deltas[(branch_id, book_id)]` aux exemplaires disponibles par bibliothèque"""
+    if not deltas:
+        return
+    rows = Q()
+    whens = []
+    for (branch_id, book_id), delta in deltas.items():
+        rows |= Q(branch_id=branch_id, book_id=book_id)
+        whens.append(When(branch_id=branch_id, book_id=book_id, then=delta))
+    BranchStock.objects.filter(rows).update(
+        copies_available=F('copies_available') + Case(*whens, default=0, output_field=IntegerField()),
+    )
+
+
+def set_state(copies, state, now=None):
+    """
+    Change l'état d'exemplaires et reporte l'écart sur les stocks.
+
+    Trois UPDATE au plus (exemplaires, stock par bibliothèque, totaux des
+    livres), quel que soit le nombre d'exemplaires.
+    """
+    branch_deltas = Counter()
+    book_deltas = Counter()
+    for copy in copies:
+        delta = (state == Copy.STATE_AVAILABLE) - (copy.state == Copy.STATE_AVAILABLE)
+        if delta:
+            branch_deltas[copy.branch_id, copy.book_id] += delta
+            book_deltas[copy.book_id] += delta
+        copy.state = state
+    if not copies:
+        return
+    Copy.objects.filter(pk__in=[copy.pk for copy in copies]).update(state=state)
+    adjust_branch_stock({key: delta for key, delta in branch_deltas.items() if delta})
+    adjust_book_stock({key: delta for key, delta in book_deltas.items() if delta}, now)
+
+
+def check_out(copies, now=None):
+    set_state(copies, Copy.STATE_ON_LOAN, now)
+
+
+def lend(loans, now=None):
+    """Sort du rayon les exemplaires de nouveaux emprunts ; sans exemplaire, décrémente le livre"""
+    check_out([loan.copy for loan in loans if loan.copy_id], now)
+    counted = Counter(loan.book_id for loan in loans if not loan.copy_id)
+    adjust_book_stock({book_id: -count for book_id, count in counted.items()}, now)
+
+
+def give_back(loans, now=None):
+    """Remet en rayon les exemplaires des emprunts retournés (copy chargé via select_related)"""
+    set_state([loan.copy for loan in loans if loan.copy_id], Copy.STATE_AVAILABLE, now)
+    # emprunts sans exemplaire : seuls les compteurs du livre bougent, tant
+    # qu'il n'a pas d'exemplaires ; sinon ce sont eux qui font foi
+    counted = Counter(loan.book_id for loan in loans if not loan.copy_id)
+    copyless = without_copies(list(counted))
+    adjust_book_stock({book_id: count for book_id, count in counted.items() if book_id in copyless}, now)
+    refresh_stock(set(counted) - copyless)
+
+
+# Recalcul complet (modification des exemplaires dans l'admin)
+
+def refresh_stock(book_ids):
+    """
+    Recalcule BranchStock et les totaux des livres à partir des exemplaires.
+
+    Les lignes de BranchStock sont mises à jour sur place (upsert), jamais
+    supprimées puis recréées ; les exemplaires sont verrouillés d'abord, si
+    bien qu'un emprunt ou un retour concurrent (`set_state`) attend la fin du
+    recalcul au lieu d'ajuster une ligne en cours de remplacement.
+    """
+    book_ids = list(book_ids)
+    if not book_ids:
+        return
+    with transaction.atomic():
+        list(Copy.objects.select_for_update().filter(book_id__in=book_ids).values_list('pk', flat=True))
+        counts = (
+            Copy.objects.filter(book_id__in=book_ids)
+            .values('book_id', 'branch_id')
+            .annotate(
+                total=Count('pk'),
+                available=Count('pk', filter=Q(state=Copy.STATE_AVAILABLE)),
+            )
+            .order_by()
+        )
+        BranchStock.objects.bulk_create(
+            [
+                BranchStock(
+                    book_id=row['book_id'],
+                    branch_id=row['branch_id'],
+                    copies_total=row['total'],
+                    copies_available=row['available'],
+                )
+                for row in counts
+            ],
+            update_conflicts=True,
+            unique_fields=['book', 'branch'],
+            update_fields=['copies_total', 'copies_available'],
+        )
+        # bibliothèques qui n'ont plus d'exemplaire du livre
+        BranchStock.objects.filter(book_id__in=book_ids).exclude(
+            Exists(Copy.objects.filter(book=OuterRef('book'), branch=OuterRef('branch')))
+        ).delete()
+        totals = BranchStock.objects.filter(book=OuterRef('pk')).order_by().values('book')
+        Book.objects.filter(pk__in=book_ids).update(
+            copies_total=Coalesce(Subquery(totals.annotate(n=Sum('copies_total')).values('n')), 0),
+            copies_available=Coalesce(Subquery(totals.annotate(n=Sum('copies_available')).values('n')), 0),
+            updated_at=timezone.now(),
+        )
+
+
+# Reprise des compteurs existants (migration)
+
+def populate_from_counters(apps, batch_size=1000):
+    """
+    Crée les exemplaires correspondant aux compteurs de chaque livre, par lots.
+
+    Tous les exemplaires sont rattachés à une bibliothèque « centrale ». Les
+    exemplaires manquants d'après les compteurs sont attribués aux emprunts
+    en cours (les plus anciennes échéances d'abord) ; ceux qui ne
+    correspondent à aucun emprunt sont marqués indisponibles. Chaque lot est
+    validé séparément ; les livres qui ont déjà des exemplaires sont sautés,
+    si bien qu'une reprise interrompue peut être relancée sans rien recréer.
+    """
+    Book = apps.get_model('books', 'Book')
+    Branch = apps.get_model('books', 'Branch')
+    Copy = apps.get_model('books', 'Copy')
+    BranchStock = apps.get_model('books', 'BranchStock')
+    Loan = apps.get_model('books', 'Loan')
+
+    branch, _ = Branch.objects.get_or_create(code='CENTRALE', defaults={'name': 'Bibliothèque centrale'})
+    last = 0
+    while True:
+        books = list(
+            Book.objects.filter(pk__gt=last)
+            .exclude(Exists(Copy.objects.filter(book=OuterRef('pk'))))
+            .order_by('pk')
+            .values_list('pk', 'copies_total', 'copies_available')[:batch_size]
+        )
+        if not books:
+            return
+        last = books[-1][0]
+
+        open_loans = defaultdict(list)
+        for loan_id, book_id in (
+            Loan.objects.filter(
+                book_id__in=[book[0] for book in books],
+                status__in=OPEN_LOAN_STATUSES,
+                copy__isnull=True,
+            )
+            .order_by('due_at', 'pk')
+            .values_list('pk', 'book_id')
+        ):
+            open_loans[book_id].append(loan_id)
+
+        with transaction.atomic():
+            copies = []
+            stock = []
+            owners = []     # emprunt de chaque exemplaire créé (ou None)
+            for book_id, total, available in books:
+                total = max(total, available)
+                loans = open_loans[book_id][:total - available]
+                states = (
+                    ['available'] * available
+                    + ['on_loan'] * len(loans)
+                    + ['unavailable'] * (total - available - len(loans))
+                )
+                for number, state in enumerate(states, start=1):
+                    copies.append(Copy(
+                        book_id=book_id,
+                        branch=branch,
+                        barcode=f'{branch.code}-{book_id:08d}-{number:03d}',
+                        state=state,
+                    ))
+                owners += [None] * available + loans + [None] * (total - available - len(loans))
+                if total:
+                    stock.append(BranchStock(
+                        book_id=book_id, branch=branch,
+                        copies_total=total, copies_available=available,
+                    ))
+            Copy.objects.bulk_create(copies, batch_size=batch_size)
+            BranchStock.objects.bulk_create(stock, batch_size=batch_size)
+            Loan.objects.bulk_update(
+                [
+                    Loan(pk=loan_id, copy_id=copy.pk)
+                    for copy, loan_id in zip(copies, owners)
+                    if loan_id is not None
+                ],
+                ['copy'],
+                batch_size=batch_size,
+            )
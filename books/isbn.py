@@ -0,0 +1,77 @@
+import re
+
+ISBN_SEPARATORS = re.compile(r'[\s-]')
+
+
+def isbn13_check_digit(first12):
+    total = sum(int(digit) * (1 if i % 2 == 0 else 3) for i, digit in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+
+def isbn10_is_valid(isbn):
+    total = sum((10 - i) * (10 if char == 'X' else int(char)) for i, char in enumerate(isbn))
+    return total % 11 == 0
+
+
+def normalize_isbn(value):
+    """
+    Forme canonique ISBN-13 (13 chiffres, sans tirets) d'un ISBN saisi ou scanné.
+
+    Les ISBN-10 sont convertis (préfixe 978). Retourne None si le code n'est
+    pas un ISBN valide (longueur, caractères ou clé de contrôle).
+    """
+    if not value:
+        return None
+    isbn = ISBN_SEPARATORS.sub('', str(value)).upper()
+
+    if re.fullmatch(r'\d{9}[\dX]', isbn):
+        if not isbn10_is_valid(isbn):
+            return None
+        first12 = '978' + isbn[:9]
+        return first12 + isbn13_check_digit(first12)
+
+    if re.fullmatch(r'\d{13}', isbn):
+        if isbn13_check_digit(isbn[:12]) != isbn[12]:
+            return None
+        return isbn
+
+    return None
+
+
+def backfill_isbn13(book_model, batch_size=1000):
+    """
+    Renseigne `isbn13` par lots (pagination par clé primaire).
+
+    Les ISBN invalides, ou dont la forme normalisée est déjà prise par un
+    autre livre, restent à NULL. Retourne (livres traités, conflits).
+    """
+    done, conflicts = 0, []
+    last_pk = 0
+    while True:
+        batch = list(
+            book_model.objects.filter(pk__gt=last_pk, isbn13__isnull=True)
+            .order_by('pk')
+            .only('pk', 'isbn')[:batch_size]
+        )
+        if not batch:
+            return done, conflicts
+        last_pk = batch[-1].pk
+
+        normalized = {book.pk: normalize_isbn(book.isbn) for book in batch}
+        taken = set(
+            book_model.objects.filter(isbn13__in=[v for v in normalized.values() if v])
+            .values_list('isbn13', flat=True)
+        )
+        updates = []
+        for book in batch:
+            value = normalized[book.pk]
+            if value is None:
+                continue
+            if value in taken:
+                conflicts.append((book.pk, book.isbn))
+                continue
+            taken.add(value)
+            book.isbn13 = value
+            updates.append(book)
+        book_model.objects.bulk_update(updates, ['isbn13'])
+        done += len(batch)
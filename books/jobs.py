@@ -0,0 +1,244 @@
+import random
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django import db
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+
+# Registre des tâches
+
+@dataclass
+class TaskSpec:
+    func: object
+    name: str
+    cpu_bound: bool = False
+    max_attempts: int = 5
+    timeout: int = 300          # délai de visibilité, en secondes
+
+
+registry = {}
+
+
+def task(name=None, cpu_bound=False, max_attempts=5, timeout=300):
+    """
+    Déclare une fonction exécutable par les workers.
+
+    `cpu_bound=True` l'envoie dans le pool de processus, sinon elle tourne
+    dans le pool de threads (tâches d'entrées/sorties : SQL, SMTP, fichiers).
+    """
+    def decorator(func):
+        spec = TaskSpec(
+            func=func,
+            name=name or f'{func.__module__}.{func.__name__}',
+            cpu_bound=cpu_bound,
+            max_attempts=max_attempts,
+            timeout=timeout,
+        )
+        registry[spec.name] = spec
+        func.task_name = spec.name
+        return func
+    return decorator
+
+
+def get_spec(name):
+    try:
+        return registry[name]
+    except KeyError:
+        raise LookupError(f'Tâche inconnue : {name}')
+
+
+# Mise en file
+
+def enqueue(func_or_name, *args, priority=0, dedup_key=None, delay=None, **kwargs):
+    """
+    Ajoute une tâche à la file et la retourne.
+
+    Si `dedup_key` est donnée et qu'une tâche en attente porte déjà cette clé,
+    aucune nouvelle tâche n'est créée : la tâche existante est retournée.
+    Avec JOBS_EAGER, la tâche est exécutée aussitôt et `dedup_key` est sans
+    effet : rien n'attend, il n'y a donc rien à fusionner.
+    """
+    name = getattr(func_or_name, 'task_name', func_or_name)
+    spec = get_spec(name)
+
+    if getattr(settings, 'JOBS_EAGER', True):
+        spec.func(*args, **kwargs)
+        return None
+
+    job = Job(
+        name=name,
+        args=list(args),
+        kwargs=kwargs,
+        priority=priority,
+        dedup_key=dedup_key,
+        max_attempts=spec.max_attempts,
+        run_after=timezone.now() + (delay or timedelta(0)),
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if dedup_key is None:
+            raise
+        return Job.objects.filter(dedup_key=dedup_key, status=Job.STATUS_QUEUED).first()
+    return job
+
+
+def enqueue_on_commit(func_or_name, *args, **kwargs):
+    """Met la tâche en file une fois la transaction courante validée"""
+    transaction.on_commit(lambda: enqueue(func_or_name, *args, **kwargs))
+
+
+def enqueue_many(func_or_name, args_list, priority=0):
+    """Met en file une même tâche pour chaque jeu d'arguments, en un seul INSERT"""
+    name = getattr(func_or_name, 'task_name', func_or_name)
+    spec = get_spec(name)
+
+    if getattr(settings, 'JOBS_EAGER', True):
+        for args in args_list:
+            spec.func(*args)
+        return []
+
+    now = timezone.now()
+    return Job.objects.bulk_create([
+        Job(name=name, args=list(args), priority=priority, max_attempts=spec.max_attempts, run_after=now)
+        for args in args_list
+    ])
+
+
+def enqueue_many_on_commit(func_or_name, args_list, **kwargs):
+    transaction.on_commit(lambda: enqueue_many(func_or_name, args_list, **kwargs))
+
+
+# Réservation et suivi (côté worker)
+
+def claim(limit, now=None):
+    """
+    Réserve jusqu'à `limit` tâches prêtes, par priorité décroissante.
+
+    La réservation est un UPDATE conditionnel sur l'état lu : deux workers
+    ne peuvent pas prendre la même tâche, sur SQLite comme sur PostgreSQL.
+    """
+    now = now or timezone.now()
+    # tâche qui a tué ou bloqué son worker à chacun de ses essais : abandonnée
+    Job.objects.filter(
+        status=Job.STATUS_RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts'),
+    ).update(
+        status=Job.STATUS_FAILED,
+        locked_until=None,
+        finished_at=now,
+        last_error='Délai dépassé au dernier essai (worker arrêté ou bloqué).',
+    )
+    candidates = list(
+        Job.objects.filter(status=Job.STATUS_RUNNING, locked_until__lt=now)
+        .order_by('-priority', 'id')[:limit]
+    )
+    candidates += list(
+        Job.objects.filter(status=Job.STATUS_QUEUED, run_after__lte=now)
+        .order_by('-priority', 'run_after', 'id')[:limit - len(candidates)]
+    )
+
+    claimed = []
+    for job in candidates:
+        spec = registry.get(job.name)
+        locked_until = now + timedelta(seconds=spec.timeout if spec else 300)
+        updated = Job.objects.filter(
+            pk=job.pk, status=job.status, attempts=job.attempts,
+        ).update(
+            status=Job.STATUS_RUNNING,
+            locked_until=locked_until,
+            attempts=job.attempts + 1,
+        )
+        if updated:
+            job.status = Job.STATUS_RUNNING
+            job.locked_until = locked_until
+            job.attempts += 1
+            claimed.append(job)
+    return claimed
+
+
+def backoff(attempts):
+    """Délai avant nouvel essai : exponentiel, plafonné, avec un peu d'aléa"""
+    base = getattr(settings, 'JOBS_RETRY_BASE_SECONDS', 10)
+    delay = min(base * 2 ** (attempts - 1), 3600)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def owned(job):
+    """
+    La tâche telle que ce worker l'a réservée : si son délai a expiré et
+    qu'un autre worker l'a reprise, `attempts` a changé et plus rien ne correspond.
+    """
+    return Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING, attempts=job.attempts)
+
+
+def mark_done(job):
+    """Retourne False si la tâche a été reprise entre-temps par un autre worker"""
+    return bool(owned(job).update(
+        status=Job.STATUS_DONE,
+        locked_until=None,
+        finished_at=timezone.now(),
+    ))
+
+
+def mark_failed(job, error):
+    """
+    Replanifie la tâche, ou la passe en échec définitif après `max_attempts` essais.
+
+    Comme `mark_done`, ne touche pas une tâche reprise par un autre worker.
+    """
+    now = timezone.now()
+    message = ''.join(traceback.format_exception(error))[-5000:]
+    if job.attempts >= job.max_attempts:
+        return bool(owned(job).update(
+            status=Job.STATUS_FAILED,
+            locked_until=None,
+            finished_at=now,
+            last_error=message,
+        ))
+    try:
+        with transaction.atomic():
+            return bool(owned(job).update(
+                status=Job.STATUS_QUEUED,
+                locked_until=None,
+                run_after=now + backoff(job.attempts),
+                last_error=message,
+            ))
+    except IntegrityError:
+        # une tâche identique (même dedup_key) attend déjà : elle fera le travail
+        return bool(owned(job).update(
+            status=Job.STATUS_DONE,
+            locked_until=None,
+            finished_at=now,
+            last_error=message,
+        ))
+
+
+def purge_finished(older_than):
+    return Job.objects.filter(
+        status__in=[Job.STATUS_DONE, Job.STATUS_FAILED],
+        finished_at__lt=timezone.now() - older_than,
+    ).delete()[0]
+
+
+# Exécution
+
+def run_task(name, args, kwargs):
+    """Exécute une tâche dans un thread ou un processus du pool"""
+    try:
+        return get_spec(name).func(*args, **kwargs)
+    finally:
+        db.connections.close_all()
+
+
+def init_worker_process():
+    """Initialisation des processus du pool : configuration Django et tâches"""
+    import django
+    django.setup()
@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import events
+from .models import Book
+
+
+def availability(book_ids):
+    """État publié pour chaque livre : exemplaires en rayon et date de retour attendue"""
+    return {
+        row['pk']: {
+            'book': row['pk'],
+            'copies_available': row['copies_available'],
+            'copies_total': row['copies_total'],
+            'available_from': row['available_from'].isoformat() if row['available_from'] else None,
+        }
+        for row in Book.objects.filter(pk__in=book_ids).values(
+            'pk', 'copies_available', 'copies_total', 'available_from',
+        )
+    }
+
+
+class Subscription:
+    """
+    Abonnement d'une connexion SSE à une liste de livres.
+
+    Seul le dernier état de chaque livre est conservé jusqu'à l'envoi : un
+    client lent ne fait pas grossir de file d'attente.
+    """
+
+    def __init__(self, book_ids, loop):
+        self.book_ids = frozenset(book_ids)
+        self.loop = loop
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def deliver(self, payloads):
+        # appelée dans la boucle d'événements de la connexion
+        self.pending.update(payloads)
+        self.ready.set()
+
+    async def next(self, timeout):
+        """États modifiés depuis le dernier appel ; {} si rien avant `timeout` secondes"""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self.ready.clear()
+        payloads, self.pending = self.pending, {}
+        return payloads
+
+
+# Diffusion
+
+class LocalBroker:
+    """
+    Diffusion dans le processus : les emprunts et retours validés dans ce
+    processus sont poussés à ses connexions. Suffit avec un seul processus
+    ASGI ; un processus sans abonné au livre ne fait aucune requête.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_book = defaultdict(set)
+
+    def subscribe(self, book_ids):
+        subscription = Subscription(book_ids, asyncio.get_running_loop())
+        with self.lock:
+            for book_id in subscription.book_ids:
+                self.by_book[book_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for book_id in subscription.book_ids:
+                subscribers = self.by_book.get(book_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.by_book[book_id]
+
+    def watched(self, book_ids):
+        with self.lock:
+            return {book_id for book_id in book_ids if book_id in self.by_book}
+
+    def connections(self):
+        with self.lock:
+            return len({subscription for subscribers in self.by_book.values() for subscription in subscribers})
+
+    def fan_out(self, payloads):
+        """Remet les états aux abonnés, depuis n'importe quel thread"""
+        per_subscription = defaultdict(dict)
+        with self.lock:
+            for book_id, payload in payloads.items():
+                for subscription in self.by_book.get(book_id, ()):
+                    per_subscription[subscription][book_id] = payload
+        for subscription, batch in per_subscription.items():
+            subscription.loop.call_soon_threadsafe(subscription.deliver, batch)
+
+    def publish(self, book_ids):
+        """Appelée après validation d'un emprunt ou d'un retour (code synchrone)"""
+        watched = self.watched(book_ids)
+        if watched:
+            self.fan_out(availability(watched))
+
+
+class EventLogBroker(LocalBroker):
+    """
+    Diffusion entre processus par le journal des emprunts (LoanEvent).
+
+    Chaque processus ASGI lit la suite du journal toutes les
+    LIVE_POLL_SECONDS, tant qu'il a des abonnés, et pousse l'état des livres
+    concernés à ses connexions : une seule requête par processus, quel que
+    soit le nombre de clients. Aucune publication directe n'est faite.
+    """
+
+    def __init__(self, poll_seconds=1.0):
+        super().__init__()
+        self.poll_seconds = poll_seconds
+        self.poller = None
+
+    def subscribe(self, book_ids):
+        subscription = super().subscribe(book_ids)
+        if self.poller is None or self.poller.done():
+            self.poller = asyncio.get_running_loop().create_task(self.poll())
+        return subscription
+
+    def publish(self, book_ids):
+        pass
+
+    async def poll(self):
+        cursor = await sync_to_async(last_event)()
+        while self.connections():
+            await asyncio.sleep(self.poll_seconds)
+            cursor = await sync_to_async(self.forward)(cursor)
+
+    def forward(self, cursor):
+        while True:
+            page, cursor = events.changes(cursor, limit=1000)
+            watched = self.watched({event.book_id for event in page})
+            if watched:
+                self.fan_out(availability(watched))
+            if len(page) < 1000:
+                return cursor
+
+
+def last_event():
+    return events.head()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        if getattr(settings, 'LIVE_BROKER', 'local') == 'events':
+            _broker = EventLogBroker(getattr(settings, 'LIVE_POLL_SECONDS', 1.0))
+        else:
+            _broker = LocalBroker()
+    return _broker
+
+
+def publish(book_ids):
+    get_broker().publish(set(book_ids))
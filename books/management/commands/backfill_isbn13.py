@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from books.isbn import backfill_isbn13
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = "Renseigne l'ISBN-13 normalisé des livres qui n'en ont pas encore, par lots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        done, conflicts = backfill_isbn13(Book, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{done} livre(s) examiné(s)'))
+        for pk, isbn in conflicts:
+            self.stdout.write(self.style.WARNING(f'Livre #{pk} : ISBN {isbn} en double, non renseigné'))
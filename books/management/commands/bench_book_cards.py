@@ -0,0 +1,90 @@
+import timeit
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.utils import timezone
+
+from books.models import Author, Book, Category
+from books.templatetags.book_cards import card_cache_key, render_book_cards
+
+# Balisage répété dans chaque template avant l'introduction de {% book_cards %}
+INLINE_CARDS = """
+{% for book in books %}
+<div class="col-md-3 col-sm-6 mb-4">
+    <div class="card h-100">
+        {% if book.cover_image %}
+            <img src="{{ book.cover_image.url }}" class="card-img-top" alt="{{ book.title }}" style="height: 250px; object-fit: cover;">
+        {% else %}
+            <div class="card-img-top bg-secondary d-flex align-items-center justify-content-center" style="height: 250px;">
+                <i class="bi bi-book fs-1 text-white"></i>
+            </div>
+        {% endif %}
+        <div class="card-body d-flex flex-column">
+            <h6 class="card-title">{{ book.title|truncatewords:5 }}</h6>
+            <p class="card-text text-muted small">{{ book.author }}</p>
+            <p class="card-text small">
+                {% if book.copies_available > 0 %}
+                    <span class="badge bg-success">Disponible</span>
+                {% else %}
+                    <span class="badge bg-danger">Indisponible</span>
+                {% endif %}
+            </p>
+            <a href="{% url 'books:book_detail' book.pk %}" class="btn btn-sm btn-primary mt-auto">Détails</a>
+        </div>
+    </div>
+</div>
+{% endfor %}
+"""
+
+
+class Command(BaseCommand):
+    help = "Mesure le temps de rendu d'une page de 12/48/100 cartes de livres (avant/après)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[12, 48, 100])
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        inline = engines['django'].from_string(INLINE_CARDS)
+        repeat = options['repeat']
+
+        self.stdout.write(f"{'cartes':>8} {'inline':>12} {'sans cache':>12} {'avec cache':>12}")
+        for size in options['sizes']:
+            books = self.fake_books(size)
+            keys = [card_cache_key(book, 'author') for book in books]
+
+            def cold():
+                cache.delete_many(keys)
+                render_book_cards(books)
+
+            timings = [
+                timeit.timeit(lambda: inline.render({'books': books}), number=repeat),
+                timeit.timeit(cold, number=repeat),
+                timeit.timeit(lambda: render_book_cards(books), number=repeat),
+            ]
+            cache.delete_many(keys)
+            self.stdout.write(
+                f'{size:>8} ' + ' '.join(f'{t / repeat * 1000:>9.3f} ms' for t in timings)
+            )
+
+    def fake_books(self, size):
+        """Livres non enregistrés : le benchmark ne touche pas à la base"""
+        author = Author(pk=1, first_name='Victor', last_name='Hugo')
+        category = Category(pk=1, name='Roman')
+        now = timezone.now()
+        return [
+            Book(
+                pk=i + 1,
+                title=f'Les Misérables, tome {i + 1} : une longue histoire',
+                isbn=f'{9780000000000 + i}',
+                publication_year=1862,
+                author=author,
+                category=category,
+                copies_available=i % 3,
+                copies_total=2,
+                updated_at=now - timedelta(seconds=i),
+            )
+            for i in range(size)
+        ]
@@ -0,0 +1,139 @@
+import random
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from books import inventory
+from books.isbn import isbn13_check_digit
+from books.models import Author, Book, Branch, BranchStock, Copy, Loan
+from books.services import checkout_books, return_loans
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure l'inventaire par exemplaire sur un réseau synthétique "
+        "(chargement, filtre « disponible à », emprunts et retours groupés)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branches', type=int, default=100)
+        parser.add_argument('--books', type=int, default=20000)
+        parser.add_argument('--copies', type=int, default=1000000)
+        parser.add_argument('--checkouts', type=int, default=500, help='Emprunts groupés (5 livres) à mesurer')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--keep', action='store_true', help='Conserve les données créées (annulées par défaut)')
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        with transaction.atomic():
+            self.load(options)
+            self.measure_filter(options)
+            self.measure_loans(options)
+            if not options['keep']:
+                transaction.set_rollback(True)
+                self.stdout.write('Données de test annulées (--keep pour les conserver)')
+
+    def timed(self, label, func, count=None):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        rate = f' ({count / elapsed:,.0f}/s)' if count else ''
+        self.stdout.write(f'{label:<48} {elapsed * 1000:>10.1f} ms{rate}')
+        return result
+
+    # Chargement
+
+    def load(self, options):
+        batch_size = options['batch_size']
+        author = Author.objects.create(first_name='Bench', last_name='Inventaire')
+        run = random.randrange(10 ** 6)
+
+        def isbn(i):
+            first12 = f'979{run % 1000:03d}{i:06d}'
+            return first12 + isbn13_check_digit(first12)
+
+        self.branches = self.timed('bibliothèques', lambda: Branch.objects.bulk_create([
+            Branch(name=f'Bibliothèque {i:03d}', code=f'B{run}-{i}') for i in range(options['branches'])
+        ]), options['branches'])
+        self.books = self.timed('livres', lambda: Book.objects.bulk_create([
+            Book(title=f'Livre {i}', isbn=isbn(i), isbn13=isbn(i), author=author, publication_year=2000)
+            for i in range(options['books'])
+        ], batch_size=batch_size), options['books'])
+
+        def copies():
+            for start in range(0, options['copies'], batch_size):
+                Copy.objects.bulk_create([
+                    Copy(
+                        book=random.choice(self.books),
+                        branch=random.choice(self.branches),
+                        barcode=f'{run}-{i}',
+                    )
+                    for i in range(start, min(start + batch_size, options['copies']))
+                ])
+        self.timed('exemplaires', copies, options['copies'])
+
+        def stock():
+            book_ids = [book.pk for book in self.books]
+            for start in range(0, len(book_ids), batch_size):
+                inventory.refresh_stock(book_ids[start:start + batch_size])
+        self.timed('stock par bibliothèque (recalcul complet)', stock, options['books'])
+
+    # Filtre « disponible à la bibliothèque X »
+
+    def measure_filter(self, options):
+        branch = random.choice(self.branches)
+        with_stock = Book.objects.filter(pk__in=inventory.available_at(branch)).order_by('id')
+        # même filtre sans BranchStock : recherche d'un exemplaire en rayon
+        with_copies = Book.objects.filter(Exists(
+            Copy.objects.filter(book=OuterRef('pk'), branch=branch, state=Copy.STATE_AVAILABLE)
+        )).order_by('id')
+
+        repeat = options['repeat']
+        self.stdout.write('')
+        for label, queryset in (('BranchStock', with_stock), ('exemplaires (EXISTS)', with_copies)):
+            self.timed(f'disponible à, {label} : compte ×{repeat}', lambda: [queryset.count() for _ in range(repeat)])
+            self.timed(f'disponible à, {label} : 1re page ×{repeat}', lambda: [list(queryset[:12]) for _ in range(repeat)])
+        if connection.vendor == 'sqlite':
+            self.stdout.write('\nPlan (BranchStock) :')
+            self.stdout.write(with_stock[:12].explain())
+
+    # Emprunts et retours groupés
+
+    def measure_loans(self, options):
+        # livres en rayon par bibliothèque, pour composer des piles empruntables
+        shelves = defaultdict(list)
+        for branch_id, isbn in (
+            BranchStock.objects.filter(branch__in=self.branches, copies_available__gt=0)
+            .values_list('branch_id', 'book__isbn')
+        ):
+            shelves[branch_id].append(isbn)
+        branches = [branch for branch in self.branches if len(shelves[branch.pk]) >= 5]
+        count = options['checkouts']
+        loans = []
+        failures = []
+
+        def checkouts():
+            for i in range(count):
+                branch = random.choice(branches)
+                result = checkout_books(
+                    f'{i:08d}', 'Bench', 'bench@exemple.fr',
+                    random.sample(shelves[branch.pk], 5), branch=branch,
+                )
+                loans.extend(result.loans)
+                if not result.ok:
+                    failures.append(result)
+
+        def returns():
+            for start in range(0, len(loans), 5):
+                return_loans(loan_ids=[loan.pk for loan in loans[start:start + 5]])
+
+        self.stdout.write('')
+        self.timed(f'emprunts groupés ×{count} (5 livres)', checkouts, count * 5)
+        self.stdout.write(f'  {len(loans)} emprunt(s) créé(s), {len(failures)} pile(s) refusée(s)')
+        self.timed('retours groupés (5 livres)', returns, len(loans))
+        open_loans = Loan.objects.filter(pk__in=[loan.pk for loan in loans]).exclude(status=Loan.STATUS_RETURNED)
+        self.stdout.write(f'  {open_loans.count()} emprunt(s) non retourné(s)')
@@ -0,0 +1,54 @@
+import timeit
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from books.throttling import CacheStore, MemoryStore, search_cost, throttle
+
+# limite assez haute pour ne jamais répondre 429 pendant la mesure
+UNLIMITED = {'bench': (10 ** 9, 10 ** 9)}
+
+
+class Command(BaseCommand):
+    help = "Mesure le surcoût par requête de la limitation de débit (seaux à jetons)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=100000)
+        parser.add_argument('--clients', type=int, default=10000, help='Nombre de clients distincts simulés')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        clients = [f'bench:ip:10.0.{i // 256}.{i % 256}' for i in range(options['clients'])]
+
+        def per_call(func):
+            return timeit.timeit(func, number=number) / number * 1e6
+
+        self.stdout.write(f"{'opération':<44} {'µs/requête':>10}")
+        for label, store in (('mémoire', MemoryStore()), ('cache Django (CACHES)', CacheStore())):
+            counter = iter(range(10 ** 12))
+            results = {
+                'un client': per_call(lambda: store.consume('bench:ip:1', 1, 1e9, 1e9)),
+                f'{len(clients)} clients': per_call(
+                    lambda: store.consume(clients[next(counter) % len(clients)], 1, 1e9, 1e9)
+                ),
+            }
+            for case, micros in results.items():
+                self.stdout.write(f'{f"seau, {label}, {case}":<44} {micros:>10.2f}')
+
+        factory = RequestFactory()
+        request = factory.get('/books/search/', {'title': 'ab', 'page': '12'})
+        request.user = AnonymousUser()
+        self.stdout.write(f'{"coût de la requête (search_cost)":<44} {per_call(lambda: search_cost(request)):>10.2f}')
+
+        def view(request):
+            return HttpResponse()
+
+        throttled_view = throttle('bench', cost=search_cost)(view)
+        with override_settings(THROTTLE_RATES=UNLIMITED, THROTTLE_STORE='memory'):
+            bare = per_call(lambda: view(request))
+            decorated = per_call(lambda: throttled_view(request))
+        self.stdout.write(f'{"vue vide":<44} {bare:>10.2f}')
+        self.stdout.write(f'{"vue vide + @throttle":<44} {decorated:>10.2f}')
+        self.stdout.write(self.style.SUCCESS(f'Surcoût du décorateur : {decorated - bare:.2f} µs par requête'))
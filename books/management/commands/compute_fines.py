@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from books import fines
+
+
+class Command(BaseCommand):
+    help = (
+        "Calcule les amendes de retard (emprunts en retard et emprunts modifiés "
+        "depuis le dernier passage) et met à jour les soldes des usagers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help=(
+                'Recalcule les amendes de tous les emprunts du journal '
+                "(nécessaire après avoir modifié le tarif ou le plafond d'une catégorie)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        updated, balances = fines.compute_fines(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'{updated} amende(s) mise(s) à jour, {balances} solde(s) recalculé(s)'))
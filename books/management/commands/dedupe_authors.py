@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.dedupe import find_duplicates, merge_duplicates
+from books.models import Author
+
+
+class Command(BaseCommand):
+    help = (
+        "Détecte les auteurs en double (accents, casse, initiales) par blocs "
+        "nom + initiale et similarité de trigrammes ; --merge les fusionne"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=0.8, help='Similarité minimale des prénoms (0 à 1)')
+        parser.add_argument('--max-block', type=int, default=1000, help='Taille au-delà de laquelle un bloc est ignoré')
+        parser.add_argument('--merge', action='store_true', help='Fusionne les doublons (sinon simple rapport)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Groupes fusionnés par transaction')
+        parser.add_argument('--show', type=int, default=20, help='Nombre de groupes affichés')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        report = find_duplicates(threshold=options['threshold'], max_block=options['max_block'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{report.authors} auteur(s) lu(s), {report.blocks} bloc(s) à comparer, '
+            f'{report.comparisons} comparaison(s) en {elapsed:.2f} s'
+        )
+        self.stdout.write(f'{len(report.clusters)} groupe(s), {report.duplicates} doublon(s)')
+
+        shown = report.clusters[:options['show']]
+        names = Author.objects.in_bulk([pk for cluster in shown for pk in cluster])
+        for cluster in shown:
+            self.stdout.write('  ' + ' | '.join(f'{names[pk]} (#{pk})' for pk in cluster if pk in names))
+        for key, size in report.skipped_blocks:
+            self.stdout.write(self.style.WARNING(f'Bloc {key} ignoré : {size} auteurs (--max-block)'))
+        if report.ambiguous:
+            self.stdout.write(self.style.WARNING(
+                f'{len(report.ambiguous)} auteur(s) réduit(s) à une initiale laissé(s) de côté : plusieurs candidats'
+            ))
+
+        if not options['merge']:
+            return
+        start = time.perf_counter()
+        deleted, moved = merge_duplicates(report.clusters, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{deleted} auteur(s) fusionné(s), {moved} livre(s) rattaché(s) '
+            f'en {time.perf_counter() - start:.2f} s'
+        ))
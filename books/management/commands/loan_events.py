@@ -0,0 +1,64 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from books import events
+from books.models import Loan
+
+
+class Command(BaseCommand):
+    help = "Journal des emprunts : export du flux, vérification par rejeu, compaction"
+
+    def add_arguments(self, parser):
+        subcommands = parser.add_subparsers(dest='action', required=True)
+
+        export = subcommands.add_parser('export', help='Écrit les événements en JSON, une ligne par événement')
+        export.add_argument('--after', type=int, default=0, help='Curseur de départ (exclu)')
+
+        subcommands.add_parser('verify', help="Rejoue tout le journal et le compare aux emprunts")
+
+        compact = subcommands.add_parser('compact', help="Ne garde que le dernier événement des emprunts anciens")
+        compact.add_argument('--older-than-days', type=int, default=365)
+        compact.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        getattr(self, options['action'])(options)
+
+    def export(self, options):
+        for event in events.stream(after=options['after']):
+            self.stdout.write(json.dumps({
+                'sequence': event.pk,
+                'kind': event.kind,
+                'loan': event.loan_id,
+                'book': event.book_id,
+                'at': event.at,
+                'due_at': event.due_at,
+            }, cls=DjangoJSONEncoder))
+
+    def verify(self, options):
+        state = events.fold(events.stream())
+        mismatches = 0
+        loans = Loan.objects.order_by('pk').values_list('pk', 'status', 'due_at')
+        for pk, status, due_at in loans.iterator(chunk_size=2000):
+            replayed = state.pop(pk, None)
+            if replayed is None:
+                self.stdout.write(self.style.WARNING(f'Emprunt #{pk} : aucun événement'))
+                mismatches += 1
+            elif (replayed['status'], replayed['due_at']) != (status, due_at):
+                self.stdout.write(self.style.WARNING(
+                    f"Emprunt #{pk} : {status} dans la table, {replayed['status']} d'après le journal"
+                ))
+                mismatches += 1
+        if mismatches:
+            raise CommandError(f'{mismatches} emprunt(s) divergent(s)')
+        self.stdout.write(self.style.SUCCESS(
+            f'Journal cohérent avec les emprunts ({len(state)} emprunt(s) supprimé(s) depuis)'
+        ))
+
+    def compact(self, options):
+        before = timezone.now() - timedelta(days=options['older_than_days'])
+        deleted = events.compact(before, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} événement(s) supprimé(s)'))
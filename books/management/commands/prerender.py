@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from books import prerender
+
+
+class Command(BaseCommand):
+    help = (
+        "Pré-rend en HTML statique les fiches livre, les pages auteur et les pages "
+        "catégorie ; seules les pages touchées depuis le dernier passage sont reconstruites"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Reconstruit toutes les pages')
+        parser.add_argument('--processes', type=int, default=None, help='Processus de rendu (nombre de CPU par défaut)')
+        parser.add_argument('--chunk-size', type=int, default=50, help='Pages rendues par tâche')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(done, total):
+            if verbosity > 1:
+                self.stdout.write(f'  {done}/{total}')
+
+        report = prerender.build(
+            full=options['full'],
+            processes=options['processes'],
+            chunk_size=options['chunk_size'],
+            progress=progress,
+        )
+        planned = report['planned']
+        seconds = report['seconds']
+        self.stdout.write(
+            f"{planned['book']} livre(s), {planned['author']} auteur(s), "
+            f"{planned['category']} catégorie(s) à rendre ; {report['removed']} page(s) supprimée(s)"
+        )
+        self.stdout.write(
+            f"{report['written']} page(s) écrite(s) en {seconds:.2f} s "
+            f"({report['written'] / seconds:,.0f} pages/s, {report['bytes'] / seconds / 1e6:.1f} Mo/s) "
+            f"dans {prerender.output_root()}"
+        )
+        for kind, pk, error in report['errors']:
+            self.stderr.write(f'{kind} {pk} : {error}')
+        if report['errors']:
+            self.stdout.write(self.style.WARNING(
+                f"{len(report['errors'])} page(s) en erreur, retentée(s) au prochain passage"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('Pré-rendu terminé'))
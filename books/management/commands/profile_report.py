@@ -0,0 +1,84 @@
+import io
+import json
+import pstats
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from books.profiling import layer_of, profile_root
+
+
+class Command(BaseCommand):
+    help = "Agrège les profils de requêtes capturés (PROFILING_ROOT) : vues, couches et fonctions les plus coûteuses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', help="Nom de vue (ex. books:book_search)")
+        parser.add_argument('--since-hours', type=float, help='Seulement les profils récents')
+        parser.add_argument('--sort', choices=['tottime', 'cumulative', 'ncalls'], default='tottime')
+        parser.add_argument('--limit', type=int, default=30, help='Fonctions affichées')
+        parser.add_argument('--delete-older-than-days', type=float, help='Supprime les profils plus anciens, sans rapport')
+
+    def handle(self, *args, **options):
+        root = profile_root()
+        entries = []
+        for path in sorted(root.glob('*.json')):
+            with open(path) as f:
+                entries.append((path, json.load(f)))
+
+        if options['delete_older_than_days'] is not None:
+            limit = timezone.now() - timedelta(days=options['delete_older_than_days'])
+            old = [path for path, meta in entries if parse_datetime(meta['at']) < limit]
+            for path in old:
+                path.with_suffix('.prof').unlink(missing_ok=True)
+                path.unlink()
+            self.stdout.write(self.style.SUCCESS(f'{len(old)} profil(s) supprimé(s)'))
+            return
+
+        if options['view']:
+            entries = [(path, meta) for path, meta in entries if meta['view'] == options['view']]
+        if options['since_hours'] is not None:
+            since = timezone.now() - timedelta(hours=options['since_hours'])
+            entries = [(path, meta) for path, meta in entries if parse_datetime(meta['at']) >= since]
+        entries = [(path, meta) for path, meta in entries if path.with_suffix('.prof').exists()]
+        if not entries:
+            self.stdout.write(f'Aucun profil dans {root}')
+            return
+
+        self.report_views([meta for _, meta in entries])
+        stats = pstats.Stats(*[str(path.with_suffix('.prof')) for path, _ in entries], stream=io.StringIO())
+        self.report_layers(stats)
+
+        buffer = io.StringIO()
+        stats.stream = buffer
+        stats.files = []    # sinon une ligne d'en-tête par profil
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(buffer.getvalue())
+
+    def report_views(self, entries):
+        by_view = defaultdict(list)
+        for meta in entries:
+            by_view[meta['view']].append(meta)
+        self.stdout.write(f"{'vue':<32} {'n':>5} {'moy. ms':>9} {'p95 ms':>9} {'SQL':>6} {'SQL ms':>8}")
+        for view, metas in sorted(by_view.items(), key=lambda item: -sum(m['duration_ms'] for m in item[1])):
+            durations = sorted(m['duration_ms'] for m in metas)
+            n = len(metas)
+            self.stdout.write(
+                f"{view:<32} {n:>5} {sum(durations) / n:>9.1f} "
+                f"{durations[min(n - 1, int(n * 0.95))]:>9.1f} "
+                f"{sum(m['queries'] for m in metas) / n:>6.1f} {sum(m['db_ms'] for m in metas) / n:>8.1f}"
+            )
+
+    def report_layers(self, stats):
+        # temps propre (hors appels) de chaque fonction, rangé par couche
+        layers = Counter()
+        for (filename, _, function), (_, _, tottime, _, _) in stats.stats.items():
+            # fonctions natives (« ~ ») : le nom mentionne le module, ex. sqlite3.Cursor
+            layers[layer_of(function if filename == '~' else filename)] += tottime
+        total = sum(layers.values()) or 1
+        self.stdout.write('\nTemps par couche :')
+        for name, seconds in layers.most_common():
+            self.stdout.write(f'  {name:<18} {seconds * 1000:>10.1f} ms {seconds / total:>6.1%}')
+        self.stdout.write('')
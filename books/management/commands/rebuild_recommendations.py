@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from books.recommendations import rebuild_recommendations
+
+
+class Command(BaseCommand):
+    help = "Recalcule les recommandations « les lecteurs ont aussi emprunté » depuis l'historique des emprunts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=None, help='Voisins conservés par livre (RECOMMENDATIONS_TOP_K)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        count = rebuild_recommendations(k=options['top_k'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{count} recommandation(s) enregistrée(s)'))
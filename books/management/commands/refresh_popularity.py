@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from books import popularity
+
+
+class Command(BaseCommand):
+    help = "Renormalise les scores de popularité des livres (ou les recalcule depuis les emprunts)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help="Recalcule tous les scores depuis l'historique des emprunts",
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = popularity.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'{count} livre(s) avec un score recalculé'))
+        else:
+            factor = popularity.renormalise(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Scores renormalisés (facteur {factor:.6f})'))
@@ -0,0 +1,85 @@
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from books import jobs
+
+
+class Command(BaseCommand):
+    help = "Exécute les tâches de fond de la file en base (pool de threads + pool de processus)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Threads pour les tâches d'entrées/sorties")
+        parser.add_argument('--processes', type=int, default=1, help='Processus pour les tâches de calcul (0 : aucun)')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Attente entre deux lectures de la file (s)')
+        parser.add_argument('--keep-days', type=int, default=7, help='Durée de conservation des tâches terminées')
+        parser.add_argument('--once', action='store_true', help="S'arrête dès que la file est vide")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        # les processus du pool ne doivent pas hériter des connexions ouvertes
+        db.connections.close_all()
+        threads = ThreadPoolExecutor(max_workers=options['threads'], thread_name_prefix='job')
+        processes = None
+        if options['processes']:
+            processes = ProcessPoolExecutor(
+                max_workers=options['processes'],
+                initializer=jobs.init_worker_process,
+            )
+        capacity = options['threads'] + options['processes']
+        keep = timedelta(days=options['keep_days'])
+        purged_at = 0
+        in_flight = {}
+
+        self.stdout.write(
+            f"Workers démarrés : {options['threads']} thread(s), {options['processes']} processus"
+        )
+        try:
+            while not self.stopping:
+                if time.monotonic() - purged_at > 3600:
+                    jobs.purge_finished(keep)
+                    purged_at = time.monotonic()
+
+                free = capacity - len(in_flight)
+                for job in jobs.claim(free) if free > 0 else []:
+                    spec = jobs.registry.get(job.name)
+                    pool = processes if spec and spec.cpu_bound and processes else threads
+                    future = pool.submit(jobs.run_task, job.name, job.args, job.kwargs)
+                    in_flight[future] = job
+
+                if not in_flight:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(in_flight.pop(future), future)
+        finally:
+            for future in wait(in_flight).done:
+                self.finish(in_flight.pop(future), future)
+            threads.shutdown()
+            if processes:
+                processes.shutdown()
+
+    def finish(self, job, future):
+        error = future.exception()
+        if error is None:
+            recorded = jobs.mark_done(job)
+            self.stdout.write(f'{job.name} #{job.pk} : terminée')
+        else:
+            recorded = jobs.mark_failed(job, error)
+            self.stderr.write(f'{job.name} #{job.pk} : échec (essai {job.attempts}/{job.max_attempts}) : {error!r}')
+        if not recorded:
+            self.stderr.write(f'{job.name} #{job.pk} : délai dépassé, reprise par un autre worker')
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from books.models import LoanNotification
+from books.notifications import send_loan_notifications
+
+
+class Command(BaseCommand):
+    help = "Envoie les rappels d'échéance proche et de retard aux emprunteurs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            choices=[LoanNotification.KIND_DUE_SOON, LoanNotification.KIND_OVERDUE, 'all'],
+            default='all',
+            help='Type de rappel à envoyer (par défaut : tous)',
+        )
+        parser.add_argument(
+            '--days-before',
+            type=int,
+            default=None,
+            help='Nombre de jours avant échéance pour le rappel (LOAN_REMINDER_DAYS_BEFORE)',
+        )
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Compte les messages sans rien envoyer ni enregistrer',
+        )
+
+    def handle(self, *args, **options):
+        if options['kind'] == 'all':
+            kinds = [LoanNotification.KIND_DUE_SOON, LoanNotification.KIND_OVERDUE]
+        else:
+            kinds = [options['kind']]
+
+        for kind in kinds:
+            sent = send_loan_notifications(
+                kind,
+                days_before=options['days_before'],
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'{kind} : {sent} message(s) envoyé(s)'))
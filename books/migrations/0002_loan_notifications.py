@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-18 22:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('due_soon', 'Échéance proche'), ('overdue', 'En retard')], max_length=20)),
+                ('sent_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['status', 'due_at'], name='loan_status_due_idx'),
+        ),
+        migrations.AddField(
+            model_name='loannotification',
+            name='loan',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='books.loan'),
+        ),
+        migrations.AddConstraint(
+            model_name='loannotification',
+            constraint=models.UniqueConstraint(fields=('loan', 'kind'), name='unique_loan_notification'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 22:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['borrower_card_number', 'book'], name='loan_card_book_idx'),
+        ),
+        migrations.AddField(
+            model_name='bookrecommendation',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='books.book'),
+        ),
+        migrations.AddField(
+            model_name='bookrecommendation',
+            name='recommended',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.book'),
+        ),
+        migrations.AddIndex(
+            model_name='bookrecommendation',
+            index=models.Index(fields=['book', '-score'], name='recommendation_book_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookrecommendation',
+            constraint=models.UniqueConstraint(fields=('book', 'recommended'), name='unique_book_recommendation'),
+        ),
+    ]
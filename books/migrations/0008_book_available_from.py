@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-18 22:47
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_available_from(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Loan = apps.get_model('books', 'Loan')
+    next_return = (
+        Loan.objects.filter(book=OuterRef('pk'), status__in=['active', 'late'])
+        .order_by('due_at')
+        .values('due_at')[:1]
+    )
+    Book.objects.filter(loans__status__in=['active', 'late']).update(available_from=Subquery(next_return))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_from',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['book', 'status', 'due_at'], name='loan_book_status_due_idx'),
+        ),
+        migrations.RunPython(backfill_available_from, migrations.RunPython.noop),
+    ]
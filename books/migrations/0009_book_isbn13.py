@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 22:48
+
+from django.db import migrations, models
+
+from books.isbn import backfill_isbn13
+
+
+def backfill(apps, schema_editor):
+    backfill_isbn13(apps.get_model('books', 'Book'), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_book_available_from'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='isbn13',
+            field=models.CharField(blank=True, editable=False, max_length=13, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
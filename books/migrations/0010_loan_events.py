@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-18 22:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+from books.events import backfill as backfill_events
+
+
+def backfill(apps, schema_editor):
+    backfill_events(apps.get_model('books', 'Loan'), apps.get_model('books', 'LoanEvent'), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_isbn13'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoanEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('created', 'Emprunt'), ('returned', 'Retour'), ('late', 'Mise en retard'), ('extended', 'Prolongation')], max_length=10)),
+                ('at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('due_at', models.DateTimeField(blank=True, null=True)),
+                ('book', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='books.book')),
+                ('loan', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='books.loan')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['loan', 'at'], name='loanevent_loan_at_idx')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 6.0 on 2026-10-18 22:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_loan_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('code', models.CharField(max_length=20, unique=True)),
+                ('address', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Copy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('barcode', models.CharField(max_length=32, unique=True)),
+                ('state', models.CharField(choices=[('available', 'En rayon'), ('on_loan', 'Emprunté'), ('unavailable', 'Indisponible (réparation, perdu…)')], default='available', max_length=12)),
+                ('added_at', models.DateTimeField(auto_now_add=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='copies', to='books.book')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='copies', to='books.branch')),
+            ],
+            options={
+                'verbose_name_plural': 'copies',
+            },
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='copy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='loans', to='books.copy'),
+        ),
+        migrations.CreateModel(
+            name='BranchStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('copies_available', models.PositiveIntegerField(default=0)),
+                ('copies_total', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='branch_stock', to='books.book')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='books.branch')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('copies_available__gt', 0)), fields=['branch', 'book'], name='branchstock_available_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'branch'), name='unique_branch_stock')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='copy',
+            index=models.Index(fields=['book', 'state', 'branch'], name='copy_book_state_branch_idx'),
+        ),
+    ]
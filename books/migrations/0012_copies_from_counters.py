@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 23:20
+
+from django.db import migrations
+
+from books.inventory import populate_from_counters
+
+
+def populate(apps, schema_editor):
+    populate_from_counters(apps, batch_size=1000)
+
+
+def unpopulate(apps, schema_editor):
+    apps.get_model('books', 'Loan').objects.update(copy=None)
+    apps.get_model('books', 'BranchStock').objects.all().delete()
+    apps.get_model('books', 'Copy').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    # un lot par transaction : les catalogues de plusieurs millions
+    # d'exemplaires ne tiennent pas dans une seule
+    atomic = False
+
+    dependencies = [
+        ('books', '0011_branches_and_copies'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate, unpopulate),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def create_epoch(apps, schema_editor):
+    PopularityEpoch = apps.get_model('books', 'PopularityEpoch')
+    PopularityEpoch.objects.get_or_create(pk=1, defaults={'epoch': timezone.now()})
+
+
+class Migration(migrations.Migration):
+    """Crée la ligne unique de l'epoch : les emprunts la verrouillent sans avoir à la créer"""
+
+    dependencies = [
+        ('books', '0013_fines'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_epoch, migrations.RunPython.noop),
+    ]
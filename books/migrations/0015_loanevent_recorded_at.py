@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 23:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_popularity_epoch_row'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loanevent',
+            name='recorded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-18 23:47
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+
+def mark_pending(apps, schema_editor):
+    """
+    Emprunts en attente repris par 0010 avec un événement « created » : un
+    événement « pending » est ajouté (le journal est en ajout seul) pour que
+    leur rejeu donne de nouveau leur statut.
+    """
+    Loan = apps.get_model('books', 'Loan')
+    LoanEvent = apps.get_model('books', 'LoanEvent')
+    last_kind = LoanEvent.objects.filter(loan_id=OuterRef('pk')).order_by('-pk').values('kind')[:1]
+    loans = (
+        Loan.objects.filter(status='pending')
+        .annotate(last_kind=Subquery(last_kind))
+        .filter(last_kind='created')
+        .order_by('pk')
+    )
+    now = timezone.now()
+    LoanEvent.objects.bulk_create(
+        [
+            LoanEvent(loan_id=loan.pk, book_id=loan.book_id, kind='pending', at=now, due_at=loan.due_at)
+            for loan in loans.iterator(chunk_size=1000)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0015_loanevent_recorded_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loanevent',
+            name='kind',
+            field=models.CharField(choices=[('pending', 'Demande'), ('created', 'Emprunt'), ('returned', 'Retour'), ('late', 'Mise en retard'), ('extended', 'Prolongation')], max_length=10),
+        ),
+        migrations.RunPython(mark_pending, migrations.RunPython.noop),
+    ]
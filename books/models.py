@@ -2,6 +2,8 @@ from django.db import models
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .isbn import normalize_isbn
+
 def validate_publication_year(year: int):
     current_year = timezone.now().year
     if year < 1450 or year > current_year:
@@ -18,6 +20,8 @@ class Author(models.Model):
     death_date = models.DateField(null=True, blank=True)
     website = models.URLField(blank=True)
     photo = models.ImageField(upload_to="authors/", blank=True, null=True)
+    # version de la page de l'auteur (pages pré-rendues, voir prerender.py)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("first_name", "last_name")
@@ -29,6 +33,10 @@ class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to="categories/", blank=True, null=True)
+    # amendes de retard propres à la catégorie (vide : FINE_DAILY_RATE / FINE_MAX_AMOUNT)
+    fine_daily_rate = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    fine_max_amount = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["name"]
@@ -40,6 +48,8 @@ class Category(models.Model):
 class Book(models.Model):
     title = models.CharField(max_length=255)
     isbn = models.CharField(max_length=13, unique=True)
+    # ISBN-13 normalisé (sans tirets, ISBN-10 converti) : recherche exacte / lecteur de codes-barres
+    isbn13 = models.CharField(max_length=13, unique=True, null=True, blank=True, editable=False)
     publication_year = models.IntegerField(validators=[validate_publication_year])
     author = models.ForeignKey(
         Author,
@@ -53,6 +63,7 @@ class Book(models.Model):
         blank=True,
         related_name="books",
     )
+    # totaux sur le réseau, tenus à jour avec BranchStock (voir inventory.py)
     copies_available = models.PositiveIntegerField(default=0)
     copies_total = models.PositiveIntegerField(default=0)
     description = models.TextField(blank=True)
@@ -61,16 +72,129 @@ class Book(models.Model):
     publisher = models.CharField(max_length=255, blank=True)
     cover_image = models.ImageField(upload_to="books/", blank=True, null=True)
     added_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)    # version du livre (cache des cartes)
+    # score d'emprunts avec décroissance exponentielle, relatif à PopularityEpoch
+    popularity = models.FloatField(default=0, editable=False)
+    # date de retour la plus proche parmi les emprunts en cours (voir forecast.py)
+    available_from = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # tri « les plus populaires » : parcours d'index, sans agrégat sur Loan
+            models.Index(fields=["-popularity", "id"], name="book_popularity_idx"),
+            models.Index(fields=["category", "-popularity", "id"], name="book_category_popularity_idx"),
+            # relecture incrémentale des livres modifiés (facettes)
+            models.Index(fields=["updated_at"], name="book_updated_at_idx"),
+        ]
 
     def clean(self):
         if self.copies_available > self.copies_total:
             raise ValidationError(
                 "Les exemplaires disponibles ne peuvent pas dépasser le total."
             )
+        isbn13 = normalize_isbn(self.isbn)
+        if isbn13 and Book.objects.filter(isbn13=isbn13).exclude(pk=self.pk).exists():
+            raise ValidationError({"isbn": "Un livre avec cet ISBN existe déjà."})
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        book._loaded_isbn = book.__dict__.get("isbn")
+        return book
+
+    def save(self, *args, **kwargs):
+        # isbn13 n'est recalculé que si l'ISBN change : un livre laissé à NULL
+        # par backfill_isbn13 (conflit) reste enregistrable
+        if "isbn" not in self.get_deferred_fields() and (
+            self._state.adding or self.isbn != getattr(self, "_loaded_isbn", None)
+        ):
+            self.isbn13 = normalize_isbn(self.isbn)
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "isbn" in update_fields:
+                kwargs["update_fields"] = {*update_fields, "isbn13"}
+        super().save(*args, **kwargs)
+        if "isbn" not in self.get_deferred_fields():
+            self._loaded_isbn = self.isbn
 
     def __str__(self):
         return self.title
 
+class Branch(models.Model):
+    """Bibliothèque du réseau (site de prêt)"""
+
+    name = models.CharField(max_length=200)
+    code = models.CharField(max_length=20, unique=True)
+    address = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["name"]
+
+    def __str__(self):
+        return self.name
+
+
+class Copy(models.Model):
+    """Exemplaire physique d'un livre, rattaché à une bibliothèque"""
+
+    STATE_AVAILABLE = "available"
+    STATE_ON_LOAN = "on_loan"
+    STATE_UNAVAILABLE = "unavailable"
+
+    STATE_CHOICES = [
+        (STATE_AVAILABLE, "En rayon"),
+        (STATE_ON_LOAN, "Emprunté"),
+        (STATE_UNAVAILABLE, "Indisponible (réparation, perdu…)"),
+    ]
+
+    book = models.ForeignKey(Book, on_delete=models.PROTECT, related_name="copies")
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT, related_name="copies")
+    barcode = models.CharField(max_length=32, unique=True)
+    state = models.CharField(max_length=12, choices=STATE_CHOICES, default=STATE_AVAILABLE)
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "copies"
+        indexes = [
+            # choix d'un exemplaire en rayon au moment de l'emprunt
+            models.Index(fields=["book", "state", "branch"], name="copy_book_state_branch_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.barcode} ({self.book.title})"
+
+
+class BranchStock(models.Model):
+    """
+    Nombre d'exemplaires d'un livre dans une bibliothèque.
+
+    Tenu à jour par incréments lors des emprunts et retours (books/inventory.py) :
+    le filtre « disponible à la bibliothèque X » est une recherche indexée sur
+    cette table, sans compter les exemplaires. Les champs de même nom de
+    `Book` sont les totaux sur le réseau.
+    """
+
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name="stock")
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="branch_stock")
+    copies_available = models.PositiveIntegerField(default=0)
+    copies_total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["book", "branch"], name="unique_branch_stock"),
+        ]
+        indexes = [
+            # livres disponibles dans une bibliothèque
+            models.Index(
+                fields=["branch", "book"],
+                condition=models.Q(copies_available__gt=0),
+                name="branchstock_available_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.book.title} @ {self.branch} : {self.copies_available}/{self.copies_total}"
+
+
 class Loan(models.Model):
     STATUS_PENDING = "pending"
     STATUS_ACTIVE = "active"
@@ -89,6 +213,13 @@ class Loan(models.Model):
         on_delete=models.PROTECT,
         related_name="loans",
     )
+    copy = models.ForeignKey(
+        Copy,
+        on_delete=models.PROTECT,
+        related_name="loans",
+        null=True,
+        blank=True,
+    )
     borrower_name = models.CharField(max_length=255)
     borrower_email = models.EmailField()
     borrower_card_number = models.CharField(max_length=50)
@@ -102,6 +233,16 @@ class Loan(models.Model):
     )
     comments = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # sélection par lots des emprunts à échéance / en retard
+            models.Index(fields=["status", "due_at"], name="loan_status_due_idx"),
+            # historique d'un usager (limite d'emprunts, recommandations)
+            models.Index(fields=["borrower_card_number", "book"], name="loan_card_book_idx"),
+            # prochaine date de retour d'un livre
+            models.Index(fields=["book", "status", "due_at"], name="loan_book_status_due_idx"),
+        ]
+
     def __str__(self):
         return f"{self.book.title} → {self.borrower_name}"
 
@@ -112,4 +253,257 @@ class Loan(models.Model):
             and self.due_at < timezone.now()
         )
 
+    @property
+    def days_overdue(self):
+        """Jours de retard entiers, à la date de retour ou à ce jour"""
+        end = self.returned_at or timezone.now()
+        return max((end - self.due_at).days, 0)
+
+    def calculate_penalty(self):
+        """Amende due pour ce retard (même règle que le calcul par lots de fines.py)"""
+        from .fines import penalty
+        return penalty(self.days_overdue, self.book.category)
+
+
+class LoanNotification(models.Model):
+    """Trace des rappels envoyés, pour qu'un nouveau passage ne renvoie rien."""
+
+    KIND_DUE_SOON = "due_soon"
+    KIND_OVERDUE = "overdue"
+
+    KIND_CHOICES = [
+        (KIND_DUE_SOON, "Échéance proche"),
+        (KIND_OVERDUE, "En retard"),
+    ]
+
+    loan = models.ForeignKey(
+        Loan,
+        on_delete=models.CASCADE,
+        related_name="notifications",
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["loan", "kind"], name="unique_loan_notification"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} – {self.loan_id}"
+
+
+class LoanEvent(models.Model):
+    """
+    Journal en ajout seul des changements d'état des emprunts.
+
+    Chaque événement est écrit dans la même transaction que la modification
+    de l'emprunt. L'identifiant sert de numéro de séquence : un consommateur
+    retient le dernier numéro lu et demande la suite (voir books/events.py).
+    `recorded_at` est l'heure d'insertion : elle sert à décider quand un
+    numéro manquant peut être sauté.
+    """
+
+    KIND_PENDING = "pending"
+    KIND_CREATED = "created"
+    KIND_RETURNED = "returned"
+    KIND_LATE = "late"
+    KIND_EXTENDED = "extended"
+
+    KIND_CHOICES = [
+        (KIND_PENDING, "Demande"),
+        (KIND_CREATED, "Emprunt"),
+        (KIND_RETURNED, "Retour"),
+        (KIND_LATE, "Mise en retard"),
+        (KIND_EXTENDED, "Prolongation"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    # sans contrainte : le journal survit à la suppression d'un emprunt
+    loan = models.ForeignKey(
+        Loan,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="events",
+    )
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    at = models.DateTimeField(default=timezone.now)
+    due_at = models.DateTimeField(null=True, blank=True)    # échéance après l'événement
+    recorded_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # compaction : événements d'un emprunt antérieurs à une date
+            models.Index(fields=["loan", "at"], name="loanevent_loan_at_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Le journal des emprunts est en ajout seul.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"#{self.pk} {self.get_kind_display()} de l'emprunt {self.loan_id}"
+
+
+class EventCursor(models.Model):
+    """Position d'un consommateur dans le journal des emprunts"""
+
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} : #{self.position}"
+
+
+class Fine(models.Model):
+    """
+    Amende de retard d'un emprunt, tenue à jour par `fines.compute_fines`.
+
+    Le montant augmente chaque jour tant que l'emprunt est en retard et se
+    fige à son retour ; `paid` cumule les paiements enregistrés.
+    """
+
+    loan = models.OneToOneField(Loan, on_delete=models.CASCADE, related_name="fine")
+    borrower_card_number = models.CharField(max_length=50, db_index=True)
+    days = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    paid = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # dernières amendes modifiées
+            models.Index(fields=["updated_at"], name="fine_updated_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.loan} : {self.amount} €"
+
+    @property
+    def due(self):
+        return self.amount - self.paid
+
+
+class BorrowerBalance(models.Model):
+    """Solde des amendes impayées d'un usager, lu à chaque emprunt (clé unique indexée)"""
+
+    card_number = models.CharField(max_length=50, unique=True)
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.card_number} : {self.balance} €"
+
+
+class BookRecommendation(models.Model):
+    """
+    Voisins d'un livre (« les lecteurs ont aussi emprunté »).
+
+    Seuls les K meilleurs voisins de chaque livre sont conservés ; `score` est
+    le nombre d'usagers ayant emprunté les deux livres.
+    """
 
+    book = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name="recommendations",
+    )
+    recommended = models.ForeignKey(
+        Book,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["book", "recommended"], name="unique_book_recommendation"),
+        ]
+        indexes = [
+            models.Index(fields=["book", "-score"], name="recommendation_book_score_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} → {self.recommended_id} ({self.score})"
+
+
+class PopularityEpoch(models.Model):
+    """
+    Date de référence des scores de popularité (ligne unique).
+
+    Un emprunt à la date t ajoute exp(λ·(t − epoch)) au score du livre : le
+    classement est celui des scores décroissants sans avoir à les réécrire.
+    La commande refresh_popularity ramène l'epoch à maintenant pour que les
+    valeurs stockées restent dans un intervalle raisonnable.
+    """
+
+    epoch = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Epoch de popularité : {self.epoch:%d/%m/%Y %H:%M}"
+
+
+class Job(models.Model):
+    """
+    Tâche de fond en attente d'exécution (file d'attente en base, sans broker).
+
+    Un worker réserve une tâche en la passant à l'état « en cours » jusqu'à
+    `locked_until` : si elle n'est pas terminée à cette échéance (worker
+    arrêté), elle redevient visible pour les autres workers.
+    """
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "En attente"),
+        (STATUS_RUNNING, "En cours"),
+        (STATUS_DONE, "Terminée"),
+        (STATUS_FAILED, "En échec"),
+    ]
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)     # les plus grandes d'abord
+    dedup_key = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "-priority", "run_after"], name="job_claim_idx"),
+            models.Index(fields=["status", "locked_until"], name="job_visibility_idx"),
+        ]
+        constraints = [
+            # une seule tâche en attente par clé de déduplication ; une tâche
+            # déjà en cours n'empêche pas d'en programmer une nouvelle
+            models.UniqueConstraint(
+                fields=["dedup_key"],
+                condition=models.Q(status="queued"),
+                name="unique_active_job_dedup_key",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.get_status_display()})"
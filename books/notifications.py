@@ -0,0 +1,129 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Loan, LoanNotification
+
+
+# Sélection des emprunts
+
+def pending_loans(kind, now=None, days_before=None):
+    """Emprunts en cours concernés par un rappel `kind` et pas encore notifiés"""
+    now = now or timezone.now()
+    loans = Loan.objects.filter(
+        status__in=[Loan.STATUS_ACTIVE, Loan.STATUS_LATE],
+    )
+    if kind == LoanNotification.KIND_DUE_SOON:
+        if days_before is None:
+            days_before = getattr(settings, 'LOAN_REMINDER_DAYS_BEFORE', 2)
+        loans = loans.filter(due_at__gte=now, due_at__lt=now + timedelta(days=days_before))
+    else:
+        loans = loans.filter(due_at__lt=now)
+    return loans.exclude(notifications__kind=kind)
+
+
+def iter_borrower_batches(loans, batch_size=200):
+    """
+    Découpe les emprunts en lots de `batch_size` emprunteurs.
+
+    La pagination se fait par clé (email) et non par OFFSET, et chaque lot
+    contient tous les emprunts d'un même emprunteur pour n'envoyer qu'un
+    seul message par usager.
+    """
+    last_email = ''
+    while True:
+        emails = list(
+            loans.filter(borrower_email__gt=last_email)
+            .order_by('borrower_email')
+            .values_list('borrower_email', flat=True)
+            .distinct()[:batch_size]
+        )
+        if not emails:
+            return
+        batch = {}
+        for loan in (
+            loans.filter(borrower_email__in=emails)
+            .select_related('book', 'book__author')
+            .order_by('borrower_email', 'due_at')
+        ):
+            batch.setdefault(loan.borrower_email, []).append(loan)
+        yield batch
+        last_email = emails[-1]
+
+
+# Construction et envoi des messages
+
+def build_message(kind, email, loans, connection=None):
+    """Un seul message récapitulatif par emprunteur"""
+    context = {
+        'kind': kind,
+        'borrower_name': loans[0].borrower_name,
+        'loans': loans,
+    }
+    if kind == LoanNotification.KIND_DUE_SOON:
+        subject = 'Rappel : date de retour proche'
+    else:
+        subject = 'Emprunt en retard'
+    body = render_to_string('emails/loan_reminder.txt', context)
+    return EmailMessage(
+        subject=subject,
+        body=body,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[email],
+        connection=connection,
+    )
+
+
+def send_loan_notifications(kind, now=None, days_before=None, batch_size=200,
+                            dry_run=False):
+    """
+    Envoie les rappels `kind` (échéance proche ou retard) par lots.
+
+    Une seule connexion SMTP est ouverte par lot et les envois sont tracés
+    dans `LoanNotification` : relancer la commande n'envoie rien de nouveau.
+    Si l'envoi échoue au milieu d'un lot, les messages déjà partis sont tout
+    de même tracés avant que l'erreur ne remonte.
+    Retourne le nombre de messages envoyés.
+    """
+    now = now or timezone.now()
+    loans = pending_loans(kind, now=now, days_before=days_before)
+    sent = 0
+
+    for batch in iter_borrower_batches(loans, batch_size=batch_size):
+        if dry_run:
+            sent += len(batch)
+            continue
+
+        connection = get_connection()
+        delivered = []
+        try:
+            sent += connection.send_messages(
+                track_delivery(kind, batch, connection, delivered)
+            ) or 0
+        finally:
+            record_notifications(kind, delivered, now)
+
+    return sent
+
+
+def track_delivery(kind, batch, connection, delivered):
+    """
+    Fournit les messages d'un lot au backend un par un.
+
+    Les backends parcourent les messages dans l'ordre et lèvent une exception
+    au premier échec : quand le suivant est demandé, le précédent est parti,
+    et ses emprunts sont ajoutés à `delivered`.
+    """
+    for email, borrower_loans in batch.items():
+        yield build_message(kind, email, borrower_loans, connection=connection)
+        delivered.extend(borrower_loans)
+
+
+def record_notifications(kind, loans, now):
+    LoanNotification.objects.bulk_create(
+        [LoanNotification(loan=loan, kind=kind, sent_at=now) for loan in loans],
+        ignore_conflicts=True,
+    )
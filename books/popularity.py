@@ -0,0 +1,102 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Book, Loan, PopularityEpoch
+
+# Tris proposés sur les listes de livres (paramètre GET `sort`)
+SORT_POPULAR = 'popular'
+SORT_CHOICES = [
+    ('', 'Par défaut'),
+    (SORT_POPULAR, 'Les plus populaires'),
+]
+
+
+def decay_rate():
+    """λ en s⁻¹, à partir de la demi-vie POPULARITY_HALF_LIFE_DAYS"""
+    half_life = getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', 30)
+    return math.log(2) / (half_life * 86400)
+
+
+def locked_epoch():
+    """
+    Ligne unique de l'epoch (créée par la migration 0014), verrouillée jusqu'à
+    la fin de la transaction : un emprunt ne peut pas lire l'ancienne epoch
+    pendant que `renormalise` divise les scores.
+    """
+    return PopularityEpoch.objects.select_for_update().get(pk=1)
+
+
+def loan_weight(borrowed_at, epoch):
+    return math.exp(decay_rate() * (borrowed_at - epoch).total_seconds())
+
+
+def sort_books(books, sort):
+    """Applique le tri demandé ; l'ordre par id garde une pagination stable"""
+    if sort == SORT_POPULAR:
+        return books.order_by('-popularity', 'id')
+    return books.order_by('id')
+
+
+# Mise à jour incrémentale
+
+def record_loan(loan):
+    """Ajoute le poids d'un nouvel emprunt au score de son livre (une requête UPDATE)"""
+    with transaction.atomic():
+        epoch = locked_epoch().epoch
+        weight = loan_weight(loan.borrowed_at or timezone.now(), epoch)
+        Book.objects.filter(pk=loan.book_id).update(popularity=F('popularity') + weight)
+
+
+# Traitements par lots
+
+def renormalise(now=None, batch_size=10000):
+    """
+    Avance l'epoch à `now` et divise tous les scores d'autant.
+
+    Le classement ne change pas ; seules les valeurs stockées sont ramenées
+    près de 1 pour éviter tout débordement.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        state = locked_epoch()
+        factor = math.exp(-decay_rate() * (now - state.epoch).total_seconds())
+        last_id = 0
+        while True:
+            ids = list(
+                Book.objects.filter(pk__gt=last_id, popularity__gt=0)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            Book.objects.filter(pk__in=ids).update(popularity=F('popularity') * factor)
+            last_id = ids[-1]
+        state.epoch = now
+        state.save(update_fields=['epoch'])
+    return factor
+
+
+def rebuild(now=None, batch_size=10000):
+    """Recalcule tous les scores depuis l'historique des emprunts (lecture en flux)"""
+    now = now or timezone.now()
+    rate = decay_rate()
+    scores = defaultdict(float)
+    for book_id, borrowed_at in (
+        Loan.objects.order_by().values_list('book_id', 'borrowed_at').iterator(chunk_size=batch_size)
+    ):
+        scores[book_id] += math.exp(rate * (borrowed_at - now).total_seconds())
+
+    with transaction.atomic():
+        PopularityEpoch.objects.update_or_create(pk=1, defaults={'epoch': now})
+        Book.objects.exclude(popularity=0).update(popularity=0)
+        Book.objects.bulk_update(
+            [Book(pk=book_id, popularity=score) for book_id, score in scores.items()],
+            ['popularity'],
+            batch_size=batch_size,
+        )
+    return len(scores)
@@ -0,0 +1,228 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django import db
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from . import jobs
+from .models import Author, Book, Category
+
+# type de page → nom d'URL
+PAGES = {
+    'book': 'books:book_detail',
+    'author': 'books:author_detail',
+    'category': 'books:category_books',
+}
+
+MANIFEST = '.manifest.json'
+
+
+def output_root():
+    return Path(getattr(settings, 'PRERENDER_ROOT', settings.BASE_DIR / 'prerendered'))
+
+
+def page_path(kind, pk):
+    """Fichier servi pour l'URL de la page : /books/12/ → books/12/index.html"""
+    return output_root() / reverse(PAGES[kind], args=[pk]).strip('/') / 'index.html'
+
+
+# Plan : pages à (re)construire et à supprimer
+
+def load_manifest():
+    try:
+        with open(output_root() / MANIFEST) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_manifest(manifest):
+    path = output_root() / MANIFEST
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def versions(model):
+    """Version (`updated_at`) de chaque objet, indexée par identifiant (clés JSON)"""
+    return {str(pk): updated_at.isoformat() for pk, updated_at in model.objects.values_list('pk', 'updated_at')}
+
+
+def old_versions(manifest, key):
+    # manifestes antérieurs aux versions : une simple liste d'identifiants
+    old = manifest.get(key, {})
+    return {str(pk): None for pk in old} if isinstance(old, list) else old
+
+
+def plan(manifest=None, full=False):
+    """
+    Retourne (pages à rendre, pages à supprimer, nouveau manifeste).
+
+    Le manifeste retient, pour chaque livre, son auteur, sa catégorie et sa
+    version (`updated_at`) : la page d'un livre dont la version a changé est
+    reconstruite avec celles de son auteur et de sa catégorie, anciens et
+    nouveaux (livre déplacé). Il retient aussi la version de chaque auteur et
+    de chaque catégorie : leur page est reconstruite quand ils sont modifiés,
+    même sans livre.
+    """
+    books = {
+        str(pk): [author_id, category_id, updated_at.isoformat()]
+        for pk, author_id, category_id, updated_at in Book.objects.values_list(
+            'pk', 'author_id', 'category_id', 'updated_at',
+        )
+    }
+    author_versions = versions(Author)
+    category_versions = versions(Category)
+    authors = {int(pk) for pk in author_versions}
+    categories = {int(pk) for pk in category_versions}
+    new_manifest = {
+        'books': books,
+        'authors': author_versions,
+        'categories': category_versions,
+    }
+
+    if full or manifest is None:
+        render = (
+            [('book', int(pk)) for pk in books]
+            + [('author', pk) for pk in authors]
+            + [('category', pk) for pk in categories]
+        )
+        return render, stale_pages(manifest, books, authors, categories), new_manifest
+
+    pending = {'book': set(), 'author': set(), 'category': set()}
+    old_books = manifest['books']
+
+    def depends_on(entry):
+        author_id, category_id, _ = entry
+        pending['author'].add(author_id)
+        if category_id:
+            pending['category'].add(category_id)
+
+    for pk, entry in books.items():
+        old = old_books.get(pk)
+        if old == entry:
+            continue
+        pending['book'].add(int(pk))
+        depends_on(entry)
+        if old:
+            depends_on(old)
+    for pk in old_books.keys() - books.keys():
+        # livre supprimé : ses pages de dépendance changent
+        depends_on(old_books[pk])
+    for kind, key, current in (('author', 'authors', author_versions), ('category', 'categories', category_versions)):
+        old = old_versions(manifest, key)
+        # nouveaux ou modifiés
+        pending[kind] |= {int(pk) for pk, version in current.items() if old.get(pk) != version}
+    for kind, pk in manifest.get('failed', []):
+        pending[kind].add(pk)
+
+    render = [
+        (kind, pk)
+        for kind, existing in (('book', {int(pk) for pk in books}), ('author', authors), ('category', categories))
+        for pk in sorted(pending[kind] & existing)
+    ]
+    return render, stale_pages(manifest, books, authors, categories), new_manifest
+
+
+def stale_pages(manifest, books, authors, categories):
+    """Pages dont l'objet a été supprimé depuis le dernier passage"""
+    if manifest is None:
+        return []
+    return (
+        [('book', int(pk)) for pk in manifest['books'].keys() - books.keys()]
+        + [('author', int(pk)) for pk in old_versions(manifest, 'authors').keys() - {str(pk) for pk in authors}]
+        + [('category', int(pk)) for pk in old_versions(manifest, 'categories').keys() - {str(pk) for pk in categories}]
+    )
+
+
+# Rendu (dans les processus du pool)
+
+def render_pages(pages):
+    """Rend une tranche de pages ; retourne (pages écrites, octets, erreurs)"""
+    factory = RequestFactory()
+    written = size = 0
+    errors = []
+    try:
+        for kind, pk in pages:
+            url = reverse(PAGES[kind], args=[pk])
+            request = factory.get(url)
+            request.user = AnonymousUser()
+            match = resolve(url)
+            try:
+                response = match.func(request, *match.args, **match.kwargs)
+                if hasattr(response, 'render'):
+                    response.render()
+            except Exception as error:
+                errors.append((kind, pk, repr(error)))
+                continue
+            if response.status_code != 200:
+                errors.append((kind, pk, f'HTTP {response.status_code}'))
+                continue
+            path = page_path(kind, pk)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix('.tmp')
+            tmp.write_bytes(response.content)
+            os.replace(tmp, path)   # jamais de page à moitié écrite pour le serveur
+            written += 1
+            size += len(response.content)
+    finally:
+        db.connections.close_all()
+    return written, size, errors
+
+
+def remove_pages(pages):
+    for kind, pk in pages:
+        page_path(kind, pk).unlink(missing_ok=True)
+
+
+def chunks(pages, size):
+    for start in range(0, len(pages), size):
+        yield pages[start:start + size]
+
+
+def build(full=False, processes=None, chunk_size=50, progress=None):
+    """
+    Construit les pages à rendre en parallèle et met à jour le manifeste.
+
+    Retourne un rapport : nombre de pages par type, pages écrites et
+    supprimées, octets, durée, erreurs.
+    """
+    started = time.perf_counter()
+    output_root().mkdir(parents=True, exist_ok=True)
+    render, remove, manifest = plan(load_manifest(), full=full)
+    remove_pages(remove)
+
+    report = {
+        'planned': {kind: sum(1 for k, _ in render if k == kind) for kind in PAGES},
+        'removed': len(remove),
+        'written': 0,
+        'bytes': 0,
+        'errors': [],
+    }
+    if render:
+        # les processus du pool ne doivent pas hériter des connexions ouvertes
+        db.connections.close_all()
+        with ProcessPoolExecutor(max_workers=processes, initializer=jobs.init_worker_process) as pool:
+            futures = [pool.submit(render_pages, chunk) for chunk in chunks(render, chunk_size)]
+            for future in as_completed(futures):
+                written, size, errors = future.result()
+                report['written'] += written
+                report['bytes'] += size
+                report['errors'] += errors
+                if progress:
+                    progress(report['written'], len(render))
+
+    # les pages en erreur seront retentées au prochain passage
+    manifest['failed'] = [(kind, pk) for kind, pk, _ in report['errors']]
+    manifest['built_at'] = timezone.now().isoformat()
+    save_manifest(manifest)
+    report['seconds'] = time.perf_counter() - started
+    return report
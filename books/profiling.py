@@ -0,0 +1,130 @@
+import cProfile
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+HEADER = 'HTTP_X_PROFILE'
+QUERY_FLAG = '_profile'
+
+# rangement des fonctions par couche, d'après leur fichier source
+LAYERS = [
+    ('base de données', re.compile(r'sqlite3|psycopg|MySQLdb|[/\\]django[/\\]db[/\\]backends[/\\]')),
+    ('ORM', re.compile(r'[/\\]django[/\\]db[/\\]')),
+    ('gabarits', re.compile(r'[/\\]django[/\\]template[/\\]|[/\\]templatetags[/\\]')),
+    ('Django', re.compile(r'[/\\]django[/\\]')),
+]
+
+
+def profile_root():
+    return Path(getattr(settings, 'PROFILING_ROOT', settings.BASE_DIR / 'profiles'))
+
+
+def layer_of(filename):
+    for name, pattern in LAYERS:
+        if pattern.search(filename):
+            return name
+    return 'Python'
+
+
+class QueryTimer:
+    """Compte les requêtes SQL et le temps passé dans la base (execute_wrapper)"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class ProfilingMiddleware:
+    """
+    Profil cProfile d'une requête, à la demande ou par échantillonnage.
+
+    Une requête est profilée si elle porte l'en-tête `X-Profile` égal à
+    PROFILING_TOKEN, si un membre du personnel ajoute `?_profile=1`, ou au
+    hasard avec une probabilité de 1/PROFILING_SAMPLE_RATE. Les autres
+    requêtes ne paient qu'un tirage aléatoire. Le profil est écrit au format
+    pstats dans PROFILING_ROOT, accompagné d'un fichier JSON (vue, durées,
+    requêtes SQL) ; `manage.py profile_report` les agrège.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PROFILING_ENABLED', False)
+        self.token = getattr(settings, 'PROFILING_TOKEN', '')
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+
+    def __call__(self, request):
+        reason = self.enabled and self.should_profile(request)
+        if not reason:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ : un seul profileur actif à la fois dans le processus
+            return self.get_response(request)
+        timer = QueryTimer()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        profile_id = save_profile(profiler, request, response, reason, elapsed, timer)
+        response['X-Profile-Id'] = profile_id
+        return response
+
+    def should_profile(self, request):
+        """Retourne la raison du profilage (header, staff, sample) ou None"""
+        if self.token and constant_time_compare(request.META.get(HEADER, ''), self.token):
+            return 'header'
+        if QUERY_FLAG in request.GET:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_staff:
+                return 'staff'
+        if self.sample_rate and random.randrange(self.sample_rate) == 0:
+            return 'sample'
+        return None
+
+
+def save_profile(profiler, request, response, reason, elapsed, timer):
+    """Écrit <id>.prof (pstats) et <id>.json ; retourne l'identifiant"""
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else 'inconnue'
+    now = timezone.now()
+    profile_id = f"{now:%Y%m%d-%H%M%S-%f}-{view.replace(':', '.')}-{os.getpid()}"
+    root = profile_root()
+    root.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(root / f'{profile_id}.prof')
+    with open(root / f'{profile_id}.json', 'w') as f:
+        json.dump({
+            'id': profile_id,
+            'at': now.isoformat(),
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'reason': reason,
+            'duration_ms': round(elapsed * 1000, 2),
+            'queries': timer.count,
+            'db_ms': round(timer.seconds * 1000, 2),
+        }, f)
+    return profile_id
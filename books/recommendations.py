@@ -0,0 +1,173 @@
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import BookRecommendation, Loan
+
+
+def top_k():
+    return getattr(settings, 'RECOMMENDATIONS_TOP_K', 10)
+
+
+# Reconstruction complète
+
+def borrow_matrix(pairs):
+    """
+    Matrice creuse usagers × livres (1 si l'usager a emprunté le livre).
+
+    `pairs` est un itérable de couples (numéro de carte, id du livre).
+    Retourne la matrice et le tableau des ids de livres par colonne.
+    """
+    cards, book_ids = [], []
+    for card, book_id in pairs:
+        cards.append(card)
+        book_ids.append(book_id)
+
+    _, rows = np.unique(np.array(cards, dtype=object), return_inverse=True)
+    columns_ids, cols = np.unique(np.array(book_ids, dtype=np.int64), return_inverse=True)
+    data = np.ones(len(rows), dtype=np.int32)
+    matrix = sparse.csr_matrix(
+        (data, (rows, cols)),
+        shape=(rows.max() + 1 if len(rows) else 0, len(columns_ids)),
+    )
+    # un même livre emprunté plusieurs fois par un usager ne compte qu'une fois
+    matrix.data[:] = 1
+    return matrix, columns_ids
+
+
+def cooccurrence_top_k(matrix, k):
+    """
+    Produit M^T·M (livres × livres) puis garde les k plus forts voisins par ligne.
+
+    Retourne trois tableaux alignés : index source, index voisin, score.
+    """
+    cooc = (matrix.T @ matrix).tocsr()
+    cooc.setdiag(0)
+    cooc.eliminate_zeros()
+
+    sources, neighbours, scores = [], [], []
+    for row in range(cooc.shape[0]):
+        start, end = cooc.indptr[row], cooc.indptr[row + 1]
+        if start == end:
+            continue
+        cols = cooc.indices[start:end]
+        vals = cooc.data[start:end]
+        if len(vals) > k:
+            best = np.argpartition(-vals, k - 1)[:k]
+            cols, vals = cols[best], vals[best]
+        sources.append(np.full(len(cols), row))
+        neighbours.append(cols)
+        scores.append(vals)
+
+    if not sources:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    return np.concatenate(sources), np.concatenate(neighbours), np.concatenate(scores)
+
+
+def rebuild_recommendations(k=None, batch_size=5000):
+    """Recalcule toute la table des recommandations à partir de l'historique des emprunts"""
+    k = k or top_k()
+    pairs = (
+        Loan.objects.order_by()
+        .values_list('borrower_card_number', 'book_id')
+        .distinct()
+        .iterator(chunk_size=batch_size)
+    )
+    matrix, book_ids = borrow_matrix(pairs)
+    sources, neighbours, scores = cooccurrence_top_k(matrix, k)
+
+    with transaction.atomic():
+        BookRecommendation.objects.all().delete()
+        for start in range(0, len(sources), batch_size):
+            end = start + batch_size
+            BookRecommendation.objects.bulk_create([
+                BookRecommendation(book_id=int(book), recommended_id=int(other), score=int(score))
+                for book, other, score in zip(
+                    book_ids[sources[start:end]],
+                    book_ids[neighbours[start:end]],
+                    scores[start:end],
+                )
+            ])
+    return len(sources)
+
+
+# Mise à jour incrémentale
+
+def record_loan(loan, k=None):
+    """
+    Ajoute la contribution d'un nouvel emprunt sans tout recalculer.
+
+    Si l'usager n'avait jamais emprunté ce livre, les paires formées avec
+    chaque autre livre de son historique reçoivent leur nombre exact de
+    co-occurrences (dans les deux sens), puis les listes dépassant k voisins
+    sont tronquées. Le compte est relu dans les emprunts plutôt qu'incrémenté :
+    une paire écartée du top k par une troncature antérieure y revient avec
+    son vrai score, et la table reste celle que produirait `rebuild_recommendations`.
+    """
+    k = k or top_k()
+    history = Loan.objects.filter(
+        borrower_card_number=loan.borrower_card_number,
+    ).exclude(pk=loan.pk)
+    if history.filter(book_id=loan.book_id).exists():
+        return
+
+    others = set(history.values_list('book_id', flat=True).distinct())
+    if not others:
+        return
+
+    # usagers ayant emprunté le livre et chacun des autres (index loan_card_book_idx)
+    readers = Loan.objects.filter(book_id=loan.book_id).values('borrower_card_number')
+    counts = dict(
+        Loan.objects.filter(book_id__in=others, borrower_card_number__in=readers)
+        .order_by()
+        .values('book_id')
+        .annotate(n=Count('borrower_card_number', distinct=True))
+        .values_list('book_id', 'n')
+    )
+    rows = [
+        BookRecommendation(book_id=book, recommended_id=other, score=counts[pair_other])
+        for pair_other in counts
+        for book, other in [(loan.book_id, pair_other), (pair_other, loan.book_id)]
+    ]
+    with transaction.atomic():
+        BookRecommendation.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['book', 'recommended'],
+            update_fields=['score'],
+        )
+        trim_neighbours({loan.book_id} | others, k)
+
+
+def trim_neighbours(book_ids, k):
+    """Ne garde que les k meilleurs voisins des livres donnés"""
+    overfull = (
+        BookRecommendation.objects.filter(book_id__in=book_ids)
+        .values('book_id')
+        .annotate(n=Count('id'))
+        .filter(n__gt=k)
+        .values_list('book_id', flat=True)
+    )
+    for book_id in list(overfull):
+        surplus = list(
+            BookRecommendation.objects.filter(book_id=book_id)
+            .order_by('-score', 'recommended_id')
+            .values_list('pk', flat=True)[k:]
+        )
+        if surplus:
+            BookRecommendation.objects.filter(pk__in=surplus).delete()
+
+
+def recommended_books(book, k=None):
+    """Livres recommandés pour `book`, lus dans la table précalculée (une requête)"""
+    k = k or top_k()
+    return [
+        rec.recommended
+        for rec in BookRecommendation.objects.filter(book=book)
+        .select_related('recommended', 'recommended__author', 'recommended__category')
+        .order_by('-score')[:k]
+    ]
@@ -0,0 +1,200 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import events, fines, forecast, inventory, tasks
+from .isbn import normalize_isbn
+from .jobs import enqueue_many_on_commit
+from .models import Book, Loan, LoanEvent
+
+LOAN_DURATION = timedelta(days=14)
+MAX_ACTIVE_LOANS = 5
+OPEN_STATUSES = [Loan.STATUS_ACTIVE, Loan.STATUS_LATE]
+# statuts comptés dans la limite d'emprunts (mêmes que LoanForm)
+LIMIT_STATUSES = [Loan.STATUS_ACTIVE, Loan.STATUS_PENDING]
+
+
+@dataclass
+class BulkResult:
+    """Résultat d'une opération groupée : tout est enregistré, ou rien"""
+
+    loans: list = field(default_factory=list)
+    errors: dict = field(default_factory=dict)     # élément saisi → message
+    general_errors: list = field(default_factory=list)
+
+    @property
+    def ok(self):
+        return not self.errors and not self.general_errors
+
+
+def after_loans_created(loans):
+    """Effets de bord d'un `post_save` de création, que `bulk_create` ne déclenche pas"""
+    args = [(loan.pk,) for loan in loans]
+    enqueue_many_on_commit(tasks.record_loan_recommendations, args)
+    enqueue_many_on_commit(tasks.record_loan_popularity, args, priority=1)
+
+
+# Emprunts groupés
+
+def checkout_books(card_number, borrower_name, borrower_email, isbns, comments='', branch=None):
+    """
+    Crée en une transaction un emprunt par ISBN de la pile présentée au comptoir.
+
+    Les contrôles (ISBN, disponibilité, limite d'emprunts, amendes) sont faits une seule
+    fois pour toute la pile ; en cas d'erreur sur un seul livre, rien n'est
+    enregistré et chaque erreur est rattachée à l'ISBN concerné. Le nombre de
+    requêtes ne dépend pas du nombre de livres. Chaque emprunt reçoit un
+    exemplaire en rayon, pris dans `branch` si elle est donnée ; un livre
+    sans aucun exemplaire enregistré est prêté sur ses compteurs.
+    """
+    result = BulkResult()
+    normalized = []     # (saisie, ISBN-13) ; un même livre peut être emprunté deux fois
+    for isbn in isbns:
+        isbn13 = normalize_isbn(isbn)
+        if isbn13 is None:
+            result.errors[isbn] = 'ISBN invalide.'
+        else:
+            normalized.append((isbn, isbn13))
+    if not normalized:
+        if not result.errors:
+            result.general_errors.append('Aucun livre à emprunter.')
+        return result
+
+    now = timezone.now()
+    with transaction.atomic():
+        books = {
+            book.isbn13: book
+            for book in Book.objects.select_for_update().filter(isbn13__in={isbn13 for _, isbn13 in normalized})
+        }
+        active = Loan.objects.filter(
+            borrower_card_number=card_number,
+            status__in=LIMIT_STATUSES,
+        ).count()
+
+        copies = inventory.available_copies([book.pk for book in books.values()], branch)
+        # sans exemplaire, hors de toute bibliothèque : prêt sur les compteurs
+        copyless = inventory.without_copies([book.pk for book in books.values()]) if branch is None else set()
+
+        requested = Counter(isbn13 for _, isbn13 in normalized)
+        for isbn, isbn13 in normalized:
+            book = books.get(isbn13)
+            if book is None:
+                result.errors[isbn] = 'Aucun livre pour cet ISBN.'
+            elif book.pk in copyless:
+                if book.copies_available < requested[isbn13]:
+                    result.errors[isbn] = f'« {book.title} » n\'est plus disponible.'
+            elif len(copies[book.pk]) < requested[isbn13]:
+                where = f' à {branch}' if branch is not None else ''
+                result.errors[isbn] = f'« {book.title} » n\'est plus disponible{where}.'
+
+        if active + len(normalized) > MAX_ACTIVE_LOANS:
+            result.general_errors.append(
+                f'L\'usager avec la carte {card_number} a déjà {active} emprunt(s) actif(s) : '
+                f'{len(normalized)} de plus dépasseraient la limite de {MAX_ACTIVE_LOANS}.'
+            )
+        balance = fines.blocking_balance(card_number)
+        if balance is not None:
+            result.general_errors.append(
+                f'L\'usager avec la carte {card_number} a {balance} € d\'amendes impayées : '
+                'les emprunts sont bloqués jusqu\'au règlement.'
+            )
+        if not result.ok:
+            return result
+
+        result.loans = Loan.objects.bulk_create([
+            Loan(
+                book=books[isbn13],
+                copy=copies[books[isbn13].pk].pop(0) if books[isbn13].pk not in copyless else None,
+                borrower_name=borrower_name,
+                borrower_email=borrower_email,
+                borrower_card_number=card_number,
+                due_at=now + LOAN_DURATION,
+                status=Loan.STATUS_ACTIVE,
+                comments=comments,
+            )
+            for _, isbn13 in normalized
+        ])
+        events.record_many(result.loans, LoanEvent.KIND_CREATED, at=now)
+        inventory.lend(result.loans, now)
+        forecast.update_available_from([books[isbn13].pk for isbn13 in requested])
+        after_loans_created(result.loans)
+    return result
+
+
+# Retours groupés
+
+def return_loans(loan_ids=(), card_number=None, isbns=(), comments=''):
+    """
+    Marque comme retournés des emprunts désignés par leur id, ou par ISBN pour une carte.
+
+    Même principe que `checkout_books` : une transaction, tout ou rien, et des
+    erreurs rattachées à chaque élément saisi.
+    """
+    result = BulkResult()
+    items = {str(loan_id): int(loan_id) for loan_id in loan_ids}
+
+    now = timezone.now()
+    with transaction.atomic():
+        loans = {
+            loan.pk: loan
+            for loan in (
+                Loan.objects.select_for_update(of=('self',))
+                .filter(pk__in=items.values())
+                .select_related('copy')
+            )
+        }
+        for item, loan_id in items.items():
+            loan = loans.get(loan_id)
+            if loan is None:
+                result.errors[item] = 'Cet emprunt n\'existe pas.'
+            elif loan.status == Loan.STATUS_RETURNED:
+                result.errors[item] = 'Ce livre a déjà été retourné.'
+
+        if isbns:
+            if not card_number:
+                result.general_errors.append('Le numéro de carte est requis pour un retour par ISBN.')
+                return result
+            normalized = {isbn: normalize_isbn(isbn) for isbn in isbns}
+            open_loans = {}
+            for loan in (
+                Loan.objects.select_for_update(of=('self',))
+                .filter(
+                    borrower_card_number=card_number,
+                    status__in=OPEN_STATUSES,
+                    book__isbn13__in=[v for v in normalized.values() if v],
+                )
+                .select_related('book', 'copy')
+                .order_by('due_at')
+            ):
+                if loan.pk in loans:
+                    continue
+                open_loans.setdefault(loan.book.isbn13, []).append(loan)
+            for isbn, isbn13 in normalized.items():
+                if isbn13 is None:
+                    result.errors[isbn] = 'ISBN invalide.'
+                elif not open_loans.get(isbn13):
+                    result.errors[isbn] = 'Aucun emprunt en cours de ce livre pour cette carte.'
+                else:
+                    loan = open_loans[isbn13].pop(0)
+                    loans[loan.pk] = loan
+
+        if not result.ok:
+            return result
+        if not loans:
+            result.general_errors.append('Aucun emprunt à retourner.')
+            return result
+
+        update = {'status': Loan.STATUS_RETURNED, 'returned_at': now}
+        if comments:
+            update['comments'] = comments
+        Loan.objects.filter(pk__in=loans).update(**update)
+
+        events.record_many(loans.values(), LoanEvent.KIND_RETURNED, at=now)
+
+        inventory.give_back(loans.values(), now)
+        forecast.update_available_from({loan.book_id for loan in loans.values()})
+        result.loans = list(loans.values())
+    return result
@@ -0,0 +1,73 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import fines, forecast, inventory, tasks
+from .facets import snapshot
+from .jobs import enqueue_on_commit
+from .models import Author, Book, Category, Copy, Fine, Loan
+
+
+# Invalidation des cartes de livres : les noms d'auteur et de catégorie
+# y sont affichés, on fait donc avancer la version des livres concernés.
+
+@receiver(post_save, sender=Author)
+def touch_author_books(sender, instance, created, **kwargs):
+    if not created:
+        enqueue_on_commit(tasks.touch_books, author_id=instance.pk, dedup_key=f'touch-books:author:{instance.pk}')
+
+
+@receiver(post_save, sender=Category)
+def touch_category_books(sender, instance, created, **kwargs):
+    if not created:
+        enqueue_on_commit(tasks.touch_books, category_id=instance.pk, dedup_key=f'touch-books:category:{instance.pk}')
+
+
+# Données dérivées des emprunts, calculées par les tâches de fond (voir JOBS_EAGER)
+
+@receiver(post_save, sender=Loan)
+def update_available_from(sender, instance, **kwargs):
+    # dans la même transaction que l'emprunt ou le retour
+    forecast.update_available_from([instance.book_id])
+
+
+@receiver(post_save, sender=Loan)
+def update_recommendations(sender, instance, created, **kwargs):
+    if created:
+        enqueue_on_commit(tasks.record_loan_recommendations, instance.pk)
+
+
+@receiver(post_save, sender=Loan)
+def update_popularity(sender, instance, created, **kwargs):
+    if created:
+        enqueue_on_commit(tasks.record_loan_popularity, instance.pk, priority=1)
+
+
+# Stock par bibliothèque : les emprunts et retours l'ajustent par incréments,
+# les exemplaires ajoutés ou modifiés un par un (admin) le font recalculer
+
+@receiver(post_save, sender=Copy)
+@receiver(post_delete, sender=Copy)
+def refresh_branch_stock(sender, instance, **kwargs):
+    inventory.refresh_stock([instance.book_id])
+
+
+# Amendes supprimées (avec leur emprunt) : le solde de l'usager ne doit pas
+# continuer à bloquer ses emprunts
+
+@receiver(post_delete, sender=Fine)
+def refresh_borrower_balance(sender, instance, **kwargs):
+    fines.refresh_cards([instance.borrower_card_number])
+
+
+# Instantané des facettes : mis à jour une fois la transaction validée
+
+@receiver(post_save, sender=Book)
+def update_facet_snapshot(sender, instance, **kwargs):
+    transaction.on_commit(lambda: snapshot.apply_book(instance))
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_facet_snapshot(sender, instance, **kwargs):
+    book_id = instance.pk
+    transaction.on_commit(lambda: snapshot.remove_book(book_id))
@@ -0,0 +1,55 @@
+from django.utils import timezone
+
+from . import fines, popularity, recommendations
+from .jobs import task
+from .models import Book, Loan
+from .notifications import send_loan_notifications
+
+
+# Emprunts
+
+@task()
+def record_loan_recommendations(loan_id):
+    loan = Loan.objects.filter(pk=loan_id).first()
+    if loan:
+        recommendations.record_loan(loan)
+
+
+@task()
+def record_loan_popularity(loan_id):
+    loan = Loan.objects.filter(pk=loan_id).first()
+    if loan:
+        popularity.record_loan(loan)
+
+
+@task()
+def send_notifications(kind):
+    return send_loan_notifications(kind)
+
+
+@task(max_attempts=3, timeout=3600)
+def compute_fines():
+    return fines.compute_fines()
+
+
+# Catalogue
+
+@task()
+def touch_books(author_id=None, category_id=None):
+    """Fait avancer la version des livres d'un auteur ou d'une catégorie (cache des cartes)"""
+    books = Book.objects.all()
+    if author_id is not None:
+        books = books.filter(author_id=author_id)
+    if category_id is not None:
+        books = books.filter(category_id=category_id)
+    books.update(updated_at=timezone.now())
+
+
+@task(cpu_bound=True, max_attempts=3, timeout=3600)
+def rebuild_recommendations():
+    return recommendations.rebuild_recommendations()
+
+
+@task(max_attempts=3, timeout=3600)
+def refresh_popularity():
+    return popularity.renormalise()
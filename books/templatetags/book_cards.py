@@ -0,0 +1,50 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+CARD_TEMPLATE = 'includes/book_card.html'
+
+
+def card_cache_key(book, variant):
+    """Clé de cache d'une carte : change dès que le livre ou son stock change"""
+    version = book.updated_at.timestamp() if book.updated_at else 0
+    return f'book-card:{variant}:{book.pk}:{version}:{book.copies_available}'
+
+
+def render_book_cards(books, variant='author'):
+    """
+    Rend les cartes d'une page de livres.
+
+    Chaque carte est rendue une seule fois par version du livre puis servie
+    depuis le cache ; une page entière coûte un seul `get_many`.
+    """
+    books = list(books)
+    keys = [card_cache_key(book, variant) for book in books]
+    cards = cache.get_many(keys)
+
+    missing = {}
+    card_template = get_template(CARD_TEMPLATE)
+    for key, book in zip(keys, books):
+        if key not in cards:
+            cards[key] = missing[key] = card_template.render({'book': book, 'variant': variant})
+
+    if missing:
+        cache.set_many(missing, getattr(settings, 'BOOK_CARD_CACHE_TIMEOUT', 3600))
+
+    return mark_safe(''.join(cards[key] for key in keys))
+
+
+@register.simple_tag
+def book_cards(books, variant='author'):
+    """{% book_cards page_obj %} ou {% book_cards books variant="category" %}"""
+    return render_book_cards(books, variant)
+
+
+@register.inclusion_tag('includes/live_availability.html')
+def live_availability():
+    """Script des bornes : disponibilité des [data-live-book] poussée en direct (LIVE_AVAILABILITY_ENABLED)"""
+    return {'enabled': getattr(settings, 'LIVE_AVAILABILITY_ENABLED', False)}
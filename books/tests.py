@@ -1,3 +1,1209 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import (
+    dedupe, events, facets, fines, inventory, jobs, live, popularity, prerender, recommendations, services,
+    throttling,
+)
+from .isbn import backfill_isbn13, normalize_isbn
+from .models import (
+    Author, Book, BookRecommendation, BorrowerBalance, Branch, BranchStock, Category, Copy,
+    EventCursor, Fine, Job, Loan, LoanEvent, LoanNotification, PopularityEpoch,
+)
+from .notifications import send_loan_notifications
+from .templatetags.book_cards import card_cache_key, render_book_cards
+
+
+# les vues sont rendues sans `collectstatic` préalable
+PLAIN_STATIC = override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+
+
+def make_book(title='Livre', isbn='9780000000002', copies=3, **kwargs):
+    author = Author.objects.get_or_create(first_name='Victor', last_name='Hugo')[0]
+    return Book.objects.create(
+        title=title,
+        isbn=isbn,
+        publication_year=1862,
+        author=author,
+        copies_available=copies,
+        copies_total=copies,
+        **kwargs,
+    )
+
+
+def make_copies(book, branch, count, state=Copy.STATE_AVAILABLE):
+    """Exemplaires créés un par un : le signal post_save recalcule les stocks"""
+    for number in range(count):
+        Copy.objects.create(
+            book=book, branch=branch, state=state,
+            barcode=f'{branch.code}-{book.pk}-{Copy.objects.count() + 1}',
+        )
+    book.refresh_from_db()
+    return book
+
+
+def make_loan(book, email='lecteur@exemple.fr', card='C1', due_in=timedelta(days=1), **kwargs):
+    return Loan.objects.create(
+        book=book,
+        borrower_name='Lecteur',
+        borrower_email=email,
+        borrower_card_number=card,
+        due_at=timezone.now() + due_in,
+        **kwargs,
+    )
+
+
+# Rappels d'emprunts
+
+class FailingBackend(LocmemBackend):
+    """Backend de test qui échoue sur le destinataire `fail_to`"""
+
+    fail_to = None
+
+    def send_messages(self, messages):
+        def stop_at_failure():
+            for message in messages:
+                if message.to == [self.fail_to]:
+                    raise OSError('SMTP indisponible')
+                yield message
+        return super().send_messages(stop_at_failure())
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class LoanNotificationTests(TestCase):
+    def setUp(self):
+        self.book = make_book()
+        self.other = make_book(title='Autre', isbn='9780000000019')
+        for email, card in [('a@exemple.fr', 'A'), ('b@exemple.fr', 'B'), ('c@exemple.fr', 'C')]:
+            make_loan(self.book, email=email, card=card, due_in=-timedelta(days=3))
+            make_loan(self.other, email=email, card=card, due_in=-timedelta(days=2))
+
+    def test_one_message_per_borrower(self):
+        sent = send_loan_notifications(LoanNotification.KIND_OVERDUE)
+
+        self.assertEqual(sent, 3)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['a@exemple.fr', 'b@exemple.fr', 'c@exemple.fr'])
+        self.assertIn('Autre', mail.outbox[0].body)
+        self.assertEqual(LoanNotification.objects.count(), 6)
+
+    def test_single_send_messages_call_per_batch(self):
+        with mock.patch.object(LocmemBackend, 'send_messages', autospec=True,
+                               side_effect=LocmemBackend.send_messages) as send_messages:
+            send_loan_notifications(LoanNotification.KIND_OVERDUE, batch_size=2)
+
+        self.assertEqual(send_messages.call_count, 2)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_rerun_sends_nothing(self):
+        send_loan_notifications(LoanNotification.KIND_OVERDUE)
+        mail.outbox.clear()
+
+        self.assertEqual(send_loan_notifications(LoanNotification.KIND_OVERDUE), 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_due_soon_excludes_overdue_loans(self):
+        make_loan(self.book, email='d@exemple.fr', card='D', due_in=timedelta(days=1))
+
+        self.assertEqual(send_loan_notifications(LoanNotification.KIND_DUE_SOON), 1)
+        self.assertEqual(mail.outbox[0].to, ['d@exemple.fr'])
+
+    @override_settings(EMAIL_BACKEND='books.tests.FailingBackend')
+    def test_failure_mid_batch_records_messages_already_sent(self):
+        FailingBackend.fail_to = 'b@exemple.fr'
+        with self.assertRaises(OSError):
+            send_loan_notifications(LoanNotification.KIND_OVERDUE)
+
+        self.assertEqual([m.to for m in mail.outbox], [['a@exemple.fr']])
+        notified = set(LoanNotification.objects.values_list('loan__borrower_email', flat=True))
+        self.assertEqual(notified, {'a@exemple.fr'})
+
+        FailingBackend.fail_to = None
+        mail.outbox.clear()
+        send_loan_notifications(LoanNotification.KIND_OVERDUE)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['b@exemple.fr', 'c@exemple.fr'])
+
+
+# Recommandations « les lecteurs ont aussi emprunté »
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.a = make_book(title='A', isbn='9780000000026')
+        self.b = make_book(title='B', isbn='9780000000033')
+        self.c = make_book(title='C', isbn='9780000000040')
+
+    def borrow(self, card, book):
+        loan = make_loan(book, card=card)
+        recommendations.record_loan(loan, k=1)
+
+    def table(self):
+        return set(BookRecommendation.objects.values_list('book_id', 'recommended_id', 'score'))
+
+    def test_incremental_updates_match_rebuild_after_trimming(self):
+        for card, book in [('1', self.a), ('1', self.b), ('2', self.a), ('2', self.c),
+                           ('3', self.a), ('3', self.c)]:
+            self.borrow(card, book)
+        incremental = self.table()
+
+        # A–C a été écarté du top 1 de A (égalité avec A–B) avant d'atteindre 2
+        self.assertIn((self.a.pk, self.c.pk, 2), incremental)
+
+        recommendations.rebuild_recommendations(k=1)
+        self.assertEqual(incremental, self.table())
+
+    def test_second_loan_of_same_book_is_ignored(self):
+        self.borrow('1', self.a)
+        self.borrow('1', self.b)
+        self.borrow('1', self.a)
+
+        self.assertEqual(self.table(), {(self.a.pk, self.b.pk, 1), (self.b.pk, self.a.pk, 1)})
+
+
+# Popularité
+
+class PopularityTests(TestCase):
+    def test_epoch_row_exists(self):
+        self.assertTrue(PopularityEpoch.objects.filter(pk=1).exists())
+
+    def test_loans_around_renormalisation_match_rebuild(self):
+        book = make_book()
+        popularity.record_loan(make_loan(book, card='1'))
+        popularity.renormalise(now=timezone.now() + timedelta(days=30))
+        popularity.record_loan(make_loan(book, card='2'))
+        book.refresh_from_db()
+        incremental = book.popularity / popularity.loan_weight(
+            timezone.now(), PopularityEpoch.objects.get(pk=1).epoch,
+        )
+
+        popularity.rebuild()
+        book.refresh_from_db()
+        self.assertAlmostEqual(incremental, book.popularity, places=4)
+
+
+# Facettes de la recherche
+
+class FacetTests(TestCase):
+    def setUp(self):
+        roman = Category.objects.create(name='Roman')
+        make_book(title='Les Misérables', isbn='9780000000057', language=' Français ', category=roman)
+        make_book(title='Les Contemplations', isbn='9780000000064', language='Français', publisher='Hetzel ')
+        make_book(title='Notre-Dame', isbn='9780000000071', language='Anglais', copies=0, category=roman)
+        facets.snapshot.build()
+
+    def test_sql_counts_match_snapshot(self):
+        filters = {'language': 'Français', 'year_min': 1800}
+        books = Book.objects.filter(title__icontains='les')
+
+        self.assertEqual(
+            facets.sql_counts(books, filters),
+            facets.snapshot.counts(filters, books.values_list('id', flat=True)),
+        )
+
+    @override_settings(FACET_MAX_IDS=1)
+    def test_broad_text_search_counts_in_sql(self):
+        with mock.patch.object(facets.snapshot, 'counts') as snapshot_counts:
+            result = facets.facet_counts({}, Book.objects.filter(title__icontains='e'))
+
+        snapshot_counts.assert_not_called()
+        self.assertEqual({item['value']: item['count'] for item in result['language']},
+                         {'Français': 2, 'Anglais': 1})
+
+    @PLAIN_STATIC
+    def test_facet_filter_matches_snapshot_value(self):
+        response = self.client.get('/books/search/', {'language': 'Français'})
+
+        self.assertEqual(len(response.context['page_obj']), 2)
+        language = {item['value']: item['count'] for item in response.context['facets']['language']}
+        self.assertEqual(language['Français'], 2)
+
+
+# File de tâches de fond
+
+calls = []
+
+
+@jobs.task(name='tests.record', max_attempts=2)
+def record_call(value):
+    calls.append(value)
+
+
+@override_settings(JOBS_EAGER=False)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_eager_mode_runs_immediately(self):
+        with self.settings(JOBS_EAGER=True):
+            self.assertIsNone(jobs.enqueue(record_call, 1))
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_claim_by_priority_and_only_once(self):
+        low = jobs.enqueue(record_call, 1)
+        high = jobs.enqueue(record_call, 2, priority=5)
+        later = jobs.enqueue(record_call, 3, delay=timedelta(hours=1))
+
+        claimed = jobs.claim(10)
+        self.assertEqual([job.pk for job in claimed], [high.pk, low.pk])
+        self.assertTrue(all(job.status == Job.STATUS_RUNNING and job.attempts == 1 for job in claimed))
+        self.assertEqual(jobs.claim(10), [])
+
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.STATUS_QUEUED)
+
+    def test_expired_lock_makes_job_visible_again(self):
+        jobs.enqueue(record_call, 1)
+        [job] = jobs.claim(1)
+
+        [again] = jobs.claim(1, now=timezone.now() + timedelta(seconds=301))
+        self.assertEqual(again.pk, job.pk)
+        self.assertEqual(again.attempts, 2)
+
+    def test_failure_is_retried_then_marked_failed(self):
+        jobs.enqueue(record_call, 1)
+        [job] = jobs.claim(1)
+        jobs.mark_failed(job, ValueError('boom'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('boom', job.last_error)
+
+        [job] = jobs.claim(1, now=job.run_after)
+        jobs.mark_failed(job, ValueError('boom'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_job_that_kills_its_worker_fails_after_max_attempts(self):
+        jobs.enqueue(record_call, 1)
+        now = timezone.now()
+        for _ in range(2):
+            now += timedelta(seconds=301)
+            [job] = jobs.claim(1, now=now)
+
+        self.assertEqual(jobs.claim(1, now=now + timedelta(seconds=301)), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_slow_worker_does_not_overwrite_reclaimed_job(self):
+        jobs.enqueue(record_call, 1)
+        [slow] = jobs.claim(1)
+        [fast] = jobs.claim(1, now=timezone.now() + timedelta(seconds=301))
+
+        self.assertFalse(jobs.mark_failed(slow, ValueError('trop tard')))
+        self.assertFalse(jobs.mark_done(slow))
+        self.assertTrue(jobs.mark_done(fast))
+        fast.refresh_from_db()
+        self.assertEqual((fast.status, fast.last_error), (Job.STATUS_DONE, ''))
+
+    def test_dedup_key_returns_queued_job(self):
+        first = jobs.enqueue(record_call, 1, dedup_key='k')
+        self.assertEqual(jobs.enqueue(record_call, 1, dedup_key='k').pk, first.pk)
+
+        # une tâche en cours n'empêche pas d'en programmer une nouvelle
+        jobs.claim(1)
+        second = jobs.enqueue(record_call, 1, dedup_key='k')
+        self.assertNotEqual(second.pk, first.pk)
+        self.assertEqual(Job.objects.filter(dedup_key='k').count(), 2)
+
+    def test_retry_collapses_into_queued_duplicate(self):
+        jobs.enqueue(record_call, 1, dedup_key='k')
+        [job] = jobs.claim(1)
+        jobs.enqueue(record_call, 1, dedup_key='k')
+        jobs.mark_failed(job, ValueError('boom'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual(Job.objects.filter(dedup_key='k', status=Job.STATUS_QUEUED).count(), 1)
+
+
+# Emprunts et retours groupés
+
+class BulkLoanTests(TestCase):
+    def setUp(self):
+        self.branch = Branch.objects.create(name='Centre', code='CTR')
+        self.book = make_copies(make_book(isbn='9780000000002', copies=0), self.branch, 2)
+        self.other = make_copies(make_book(title='Autre', isbn='9780000000019', copies=0), self.branch, 1)
+
+    def checkout(self, isbns, card='C1'):
+        return services.checkout_books(card, 'Lecteur', 'lecteur@exemple.fr', isbns)
+
+    def stock(self, book):
+        book.refresh_from_db()
+        branch_stock = BranchStock.objects.get(book=book, branch=self.branch)
+        return book.copies_available, branch_stock.copies_available
+
+    def test_checkout_and_return_adjust_stock(self):
+        result = self.checkout(['978-0-00-000000-2', '9780000000002', '9780000000019'])
+
+        self.assertTrue(result.ok)
+        self.assertEqual(len(result.loans), 3)
+        self.assertEqual(self.stock(self.book), (0, 0))
+        self.assertEqual(self.stock(self.other), (0, 0))
+        self.assertFalse(Copy.objects.filter(state=Copy.STATE_AVAILABLE).exists())
+        self.assertEqual(LoanEvent.objects.filter(kind=LoanEvent.KIND_CREATED).count(), 3)
+
+        returned = services.return_loans(card_number='C1', isbns=['9780000000002'])
+        self.assertTrue(returned.ok)
+        self.assertEqual(self.stock(self.book), (1, 1))
+
+        returned = services.return_loans(loan_ids=[loan.pk for loan in result.loans if loan.book_id == self.other.pk])
+        self.assertTrue(returned.ok)
+        self.assertEqual(self.stock(self.other), (1, 1))
+        self.assertEqual(Loan.objects.filter(status=Loan.STATUS_RETURNED).count(), 2)
+
+    def test_mixed_stack_is_rolled_back(self):
+        result = self.checkout(['9780000000002', '9780000000088', 'pas-un-isbn', '9780000000019', '9780000000019'])
+
+        self.assertFalse(result.ok)
+        self.assertEqual(set(result.errors), {'9780000000088', 'pas-un-isbn', '9780000000019'})
+        self.assertFalse(Loan.objects.exists())
+        self.assertEqual(self.stock(self.book), (2, 2))
+        self.assertEqual(self.stock(self.other), (1, 1))
+
+    def test_return_with_one_bad_item_is_rolled_back(self):
+        [loan] = self.checkout(['9780000000002']).loans
+
+        result = services.return_loans(loan_ids=[loan.pk, 999999])
+        self.assertEqual(set(result.errors), {'999999'})
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, Loan.STATUS_ACTIVE)
+        self.assertEqual(self.stock(self.book), (1, 1))
+
+        self.assertTrue(services.return_loans(loan_ids=[loan.pk]).ok)
+        result = services.return_loans(loan_ids=[loan.pk])
+        self.assertEqual(result.errors, {str(loan.pk): 'Ce livre a déjà été retourné.'})
+
+    def test_active_loan_limit(self):
+        for _ in range(services.MAX_ACTIVE_LOANS - 1):
+            make_loan(self.other, card='C1')
+
+        result = self.checkout(['9780000000002', '9780000000002'])
+        self.assertFalse(result.ok)
+        self.assertIn('limite de 5', result.general_errors[0])
+        self.assertEqual(self.stock(self.book), (2, 2))
+
+    def test_unpaid_fines_block_checkout(self):
+        BorrowerBalance.objects.create(card_number='C1', balance=Decimal('5.00'), updated_at=timezone.now())
+
+        result = self.checkout(['9780000000002'])
+        self.assertFalse(result.ok)
+        self.assertIn('amendes impayées', result.general_errors[0])
+        self.assertTrue(self.checkout(['9780000000002'], card='C2').ok)
+
+
+# Date de retour prévue
+
+class ForecastTests(TestCase):
+    def setUp(self):
+        self.branch = Branch.objects.create(name='Centre', code='CTR')
+        self.book = make_copies(make_book(isbn='9780000000002', copies=0), self.branch, 2)
+
+    def available_from(self):
+        self.book.refresh_from_db()
+        return self.book.available_from
+
+    def test_single_loans_and_returns(self):
+        self.assertIsNone(self.available_from())
+
+        late = make_loan(self.book, card='C1', due_in=timedelta(days=3))
+        self.assertEqual(self.available_from(), late.due_at)
+        early = make_loan(self.book, card='C2', due_in=timedelta(days=1))
+        self.assertEqual(self.available_from(), early.due_at)
+        make_loan(self.book, card='C3', due_in=timedelta(hours=1), status=Loan.STATUS_PENDING)
+        self.assertEqual(self.available_from(), early.due_at)
+
+        early.status = Loan.STATUS_RETURNED
+        early.returned_at = timezone.now()
+        early.save()
+        self.assertEqual(self.available_from(), late.due_at)
+
+        late.status = Loan.STATUS_LATE
+        late.save()
+        self.assertEqual(self.available_from(), late.due_at)
+        late.status = Loan.STATUS_RETURNED
+        late.save()
+        self.assertIsNone(self.available_from())
+
+    def test_bulk_checkout_and_return(self):
+        result = services.checkout_books('C1', 'Lecteur', 'lecteur@exemple.fr', ['9780000000002'])
+        self.assertTrue(result.ok)
+        self.assertEqual(self.available_from(), result.loans[0].due_at)
+
+        other = make_loan(self.book, card='C2', due_in=timedelta(days=30))
+        self.assertTrue(services.return_loans(card_number='C1', isbns=['9780000000002']).ok)
+        self.assertEqual(self.available_from(), other.due_at)
+
+        self.assertTrue(services.return_loans(loan_ids=[other.pk]).ok)
+        self.assertIsNone(self.available_from())
+
+    def test_update_advances_card_version(self):
+        before = Book.objects.get(pk=self.book.pk).updated_at
+        make_loan(self.book)
+        self.assertGreater(Book.objects.get(pk=self.book.pk).updated_at, before)
+
+
+class BookCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = make_book()
+
+    def test_card_is_rerendered_when_book_changes(self):
+        key = card_cache_key(self.book, 'author')
+        self.assertIn('Livre', render_book_cards([self.book]))
+        self.assertIsNotNone(cache.get(key))
+
+        Book.objects.filter(pk=self.book.pk).update(title='Nouveau titre')
+        self.assertIn('Livre', render_book_cards([Book.objects.get(pk=self.book.pk)]))
+
+        book = Book.objects.get(pk=self.book.pk)
+        book.save()
+        self.assertNotEqual(card_cache_key(book, 'author'), key)
+        html = render_book_cards([book])
+        self.assertIn('Nouveau titre', html)
+        self.assertNotIn('>Livre<', html)
+
+
+# ISBN normalisés
+
+class NormalizeIsbnTests(SimpleTestCase):
+    def test_isbn13(self):
+        self.assertEqual(normalize_isbn('9780000000002'), '9780000000002')
+        self.assertEqual(normalize_isbn(' 978-0-00-000000-2 '), '9780000000002')
+        self.assertIsNone(normalize_isbn('9780000000003'))
+
+    def test_isbn10_is_converted(self):
+        self.assertEqual(normalize_isbn('0-00-000000-0'), '9780000000002')
+        self.assertEqual(normalize_isbn('2 07 036822 x'), '9782070368228')
+        self.assertIsNone(normalize_isbn('0000000001'))
+
+    def test_invalid_input(self):
+        for value in ('', None, '978000000000', 'ABCDEFGHIJ', '97800000000021'):
+            self.assertIsNone(normalize_isbn(value), value)
+
+
+class IsbnBackfillTests(TestCase):
+    def setUp(self):
+        self.book = make_book(isbn='9780000000002')
+        # même livre saisi en ISBN-10 avant l'ajout de isbn13
+        self.duplicate = make_book(title='Doublon', isbn='9780000000019')
+        self.invalid = make_book(title='Invalide', isbn='123')
+        Book.objects.filter(pk=self.duplicate.pk).update(isbn='0-00-000000-0')
+        Book.objects.update(isbn13=None)
+
+    def test_conflicts_stay_null_and_can_be_saved(self):
+        done, conflicts = backfill_isbn13(Book, batch_size=2)
+
+        self.assertEqual(done, 3)
+        self.assertEqual(conflicts, [(self.duplicate.pk, '0-00-000000-0')])
+        self.assertEqual(
+            dict(Book.objects.values_list('pk', 'isbn13')),
+            {self.book.pk: '9780000000002', self.duplicate.pk: None, self.invalid.pk: None},
+        )
+
+        duplicate = Book.objects.get(pk=self.duplicate.pk)
+        duplicate.title = 'Doublon corrigé'
+        duplicate.save()
+        self.assertIsNone(Book.objects.get(pk=self.duplicate.pk).isbn13)
+
+        duplicate.isbn = '9780000000019'
+        duplicate.save()
+        self.assertEqual(Book.objects.get(pk=self.duplicate.pk).isbn13, '9780000000019')
+
+    @PLAIN_STATIC
+    def test_search_falls_back_to_raw_isbn(self):
+        backfill_isbn13(Book)
+
+        response = self.client.get('/books/', {'search': '0-00-000000-0'})
+        self.assertEqual(
+            {book.pk for book in response.context['page_obj']},
+            {self.book.pk, self.duplicate.pk},
+        )
+        response = self.client.get('/books/search/', {'isbn': '9780000000002'})
+        self.assertEqual({book.pk for book in response.context['page_obj']}, {self.book.pk})
+
+
+class ScanIsbnTests(TestCase):
+    def test_scan(self):
+        book = make_book(copies=0)
+        make_loan(book, due_in=timedelta(days=2))
+
+        response = self.client.get('/books/scan/0-00-000000-0/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['id'], data['isbn13'], data['is_available']), (book.pk, '9780000000002', False))
+        self.assertIsNotNone(data['available_from'])
+
+        self.assertEqual(self.client.get('/books/scan/9780000000088/').status_code, 404)
+        self.assertEqual(self.client.get('/books/scan/9780000000003/').status_code, 400)
+
+
+# Journal des emprunts
+
+class LoanEventFeedTests(TestCase):
+    def setUp(self):
+        self.loan = make_loan(make_book())
+
+    def event(self, pk, recorded_at=None):
+        return LoanEvent.objects.create(
+            pk=pk, loan_id=self.loan.pk, book_id=self.loan.book_id,
+            kind=LoanEvent.KIND_CREATED, recorded_at=recorded_at or timezone.now(),
+        )
+
+    def test_feed_waits_for_a_recent_missing_number(self):
+        self.event(1)
+        self.event(3)     # le n° 2 n'est pas encore validé
+
+        page, cursor = events.changes(0)
+        self.assertEqual([event.pk for event in page], [1])
+        self.assertEqual(cursor, 1)
+        self.assertEqual(events.position(0), 1)
+
+        # validé plus tard : rien n'est sauté
+        self.event(2)
+        page, cursor = events.changes(cursor)
+        self.assertEqual([event.pk for event in page], [2, 3])
+
+    def test_old_missing_number_is_skipped(self):
+        self.event(1)
+        self.event(3, recorded_at=timezone.now() - timedelta(minutes=5))
+
+        page, cursor = events.changes(0)
+        self.assertEqual([event.pk for event in page], [1, 3])
+        self.assertEqual(list(events.stream()), page)
+        self.assertEqual(events.head(), 3)
+
+    def test_catch_up_does_not_advance_past_a_gap(self):
+        self.event(1)
+        self.event(3)
+        seen = []
+
+        self.assertEqual(events.catch_up('test', seen.extend), 1)
+        self.assertEqual(EventCursor.objects.get(name='test').position, 1)
+
+        self.event(2)
+        events.catch_up('test', seen.extend)
+        self.assertEqual([event.pk for event in seen], [1, 2, 3])
+
+    def test_backfill_replays_to_current_statuses(self):
+        book = self.loan.book
+        make_loan(book, card='C2', status=Loan.STATUS_PENDING)
+        make_loan(book, card='C3', due_in=-timedelta(days=2), status=Loan.STATUS_LATE)
+        make_loan(book, card='C4', status=Loan.STATUS_RETURNED, returned_at=timezone.now())
+
+        self.assertEqual(events.backfill(Loan, LoanEvent), 6)
+        state = events.fold(LoanEvent.objects.order_by('pk'))
+        self.assertEqual(
+            {loan_id: loan['status'] for loan_id, loan in state.items()},
+            dict(Loan.objects.values_list('pk', 'status')),
+        )
+        call_command('loan_events', 'verify', stdout=StringIO())
+
+    def test_pending_loan_becomes_active(self):
+        pending = make_loan(self.loan.book, card='C2', status=Loan.STATUS_PENDING)
+        events.record(pending, events.opening_kind(pending.status))
+        old = Loan.objects.get(pk=pending.pk)
+        pending.status = Loan.STATUS_ACTIVE
+        pending.save()
+        events.record_changes(old, pending)
+
+        loan = events.fold(LoanEvent.objects.filter(loan=pending).order_by('pk'))[pending.pk]
+        self.assertEqual(loan['status'], Loan.STATUS_ACTIVE)
+        self.assertIsNotNone(loan['borrowed_at'])
+
+
+# Stock par exemplaire et par bibliothèque
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.north = Branch.objects.create(name='Nord', code='N')
+        self.south = Branch.objects.create(name='Sud', code='S')
+        self.book = make_book(copies=0)
+        make_copies(self.book, self.north, 2)
+        make_copies(self.book, self.south, 1)
+
+    def stock(self):
+        self.book.refresh_from_db()
+        return (
+            (self.book.copies_available, self.book.copies_total),
+            {
+                row.branch.code: (row.copies_available, row.copies_total)
+                for row in BranchStock.objects.filter(book=self.book).select_related('branch')
+            },
+        )
+
+    def test_refresh_stock_counts_copies(self):
+        Copy.objects.filter(branch=self.south).update(state=Copy.STATE_UNAVAILABLE)
+        inventory.refresh_stock([self.book.pk])
+
+        self.assertEqual(self.stock(), ((2, 3), {'N': (2, 2), 'S': (0, 1)}))
+
+    def test_check_out_and_give_back(self):
+        copies = inventory.available_copies([self.book.pk], self.north)[self.book.pk]
+        inventory.check_out(copies)
+        self.assertEqual(self.stock(), ((1, 3), {'N': (0, 2), 'S': (1, 1)}))
+        self.assertEqual(set(Copy.objects.filter(branch=self.north).values_list('state', flat=True)),
+                         {Copy.STATE_ON_LOAN})
+
+        loans = [make_loan(self.book, copy=copy) for copy in copies]
+        inventory.give_back(Loan.objects.filter(pk__in=[loan.pk for loan in loans]).select_related('copy'))
+        self.assertEqual(self.stock(), ((3, 3), {'N': (2, 2), 'S': (1, 1)}))
+
+    def test_give_back_loan_without_copy_keeps_book_and_branches_in_step(self):
+        # emprunt antérieur aux exemplaires, dont le livre a des exemplaires depuis
+        loan = make_loan(self.book)
+        inventory.check_out(list(Copy.objects.filter(branch=self.south)))
+        inventory.give_back([loan])
+
+        self.assertEqual(self.stock(), ((2, 3), {'N': (2, 2), 'S': (0, 1)}))
+
+    def test_refresh_stock_updates_rows_in_place(self):
+        rows = dict(BranchStock.objects.filter(book=self.book).values_list('branch__code', 'pk'))
+        Copy.objects.filter(branch=self.south).delete()
+        Copy.objects.filter(branch=self.north).update(state=Copy.STATE_UNAVAILABLE)
+        inventory.refresh_stock([self.book.pk])
+
+        self.assertEqual(self.stock(), ((0, 2), {'N': (0, 2)}))
+        self.assertEqual(BranchStock.objects.get(book=self.book).pk, rows['N'])
+
+    def test_book_without_copies_is_lent_on_its_counters(self):
+        counted = make_book(title='Sans exemplaire', isbn='9780000000019', copies=2)
+
+        result = services.checkout_books('C1', 'Lecteur', 'l@exemple.fr', [counted.isbn, self.book.isbn])
+        self.assertTrue(result.ok)
+        self.assertEqual({loan.book_id: loan.copy_id is None for loan in result.loans},
+                         {counted.pk: True, self.book.pk: False})
+        counted.refresh_from_db()
+        self.assertEqual(counted.copies_available, 1)
+
+        result = services.checkout_books('C2', 'Lecteur', 'l@exemple.fr', [counted.isbn] * 2)
+        self.assertIn(counted.isbn, result.errors)
+        result = services.checkout_books('C2', 'Lecteur', 'l@exemple.fr', [counted.isbn], branch=self.north)
+        self.assertIn(counted.isbn, result.errors)
+
+        self.assertTrue(services.return_loans(card_number='C1', isbns=[counted.isbn, self.book.isbn]).ok)
+        counted.refresh_from_db()
+        self.assertEqual((counted.copies_available, counted.copies_total), (2, 2))
+        self.assertEqual(self.stock(), ((3, 3), {'N': (2, 2), 'S': (1, 1)}))
+        self.assertFalse(BranchStock.objects.filter(book=counted).exists())
+
+    @PLAIN_STATIC
+    def test_create_loan_view_lends_book_without_copies(self):
+        counted = make_book(title='Sans exemplaire', isbn='9780000000019', copies=1)
+        response = self.client.post('/loans/create/', {
+            'book': counted.pk, 'borrower_name': 'Lecteur', 'borrower_email': 'lecteur@exemple.fr',
+            'borrower_card_number': '12345678',
+        })
+
+        self.assertRedirects(response, '/loans/', fetch_redirect_response=False)
+        loan = Loan.objects.get(book=counted)
+        self.assertIsNone(loan.copy)
+        counted.refresh_from_db()
+        self.assertEqual(counted.copies_available, 0)
+
+    def test_available_at_branch(self):
+        inventory.check_out(list(Copy.objects.filter(branch=self.south)))
+
+        self.assertEqual(list(inventory.available_at(self.north).values_list('book_id', flat=True)), [self.book.pk])
+        self.assertFalse(inventory.available_at(self.south).exists())
+
+    def test_bulk_return_restores_branch_stock(self):
+        result = services.checkout_books('C1', 'Lecteur', 'l@exemple.fr', [self.book.isbn] * 3)
+        self.assertEqual(self.stock(), ((0, 3), {'N': (0, 2), 'S': (0, 1)}))
+
+        services.return_loans(loan_ids=[loan.pk for loan in result.loans])
+        self.assertEqual(self.stock(), ((3, 3), {'N': (2, 2), 'S': (1, 1)}))
+
+
+class PopulateFromCountersTests(TestCase):
+    def test_backfill_can_be_resumed(self):
+        done = make_book(copies=2)
+        # premier passage interrompu : seul le premier livre a été traité
+        inventory.populate_from_counters(apps, batch_size=1)
+        pending = make_book(title='Autre', isbn='9780000000019', copies=3)
+        Book.objects.filter(pk=pending.pk).update(copies_available=1)
+        loan = make_loan(pending)
+
+        inventory.populate_from_counters(apps, batch_size=1)
+
+        self.assertEqual(Copy.objects.filter(book=done).count(), 2)
+        self.assertEqual(
+            sorted(Copy.objects.filter(book=pending).values_list('state', flat=True)),
+            [Copy.STATE_AVAILABLE, Copy.STATE_ON_LOAN, Copy.STATE_UNAVAILABLE],
+        )
+        loan.refresh_from_db()
+        self.assertEqual(loan.copy.state, Copy.STATE_ON_LOAN)
+
+
+# Limitation du débit
+
+class MemoryStoreTests(SimpleTestCase):
+    def test_limit_then_wait(self):
+        store = throttling.MemoryStore()
+        self.assertEqual(store.consume('a', 2, 1, 3), 0)
+        self.assertAlmostEqual(store.consume('a', 2, 1, 3), 1, places=2)
+        self.assertEqual(store.consume('b', 2, 1, 3), 0)
+
+    def test_least_recently_used_buckets_are_evicted(self):
+        store = throttling.MemoryStore(max_keys=3)
+        for key in 'abcd':
+            store.consume(key, 1, 1e-6, 1)
+        store.consume('b', 1, 1e-6, 1)
+        store.consume('e', 1, 1e-6, 1)
+
+        self.assertEqual(list(store.buckets), ['d', 'b', 'e'])
+
+    def test_full_buckets_are_dropped(self):
+        store = throttling.MemoryStore()
+        store.consume('a', 1, 1e9, 1)
+        store.consume('b', 1, 1e-6, 1)
+
+        self.assertEqual(list(store.buckets), ['b'])
+
+
+@override_settings(THROTTLE_ENABLED=True, THROTTLE_RATES={'search': (60, 2)})
+class ThrottleDecoratorTests(SimpleTestCase):
+    def setUp(self):
+        store = throttling.MemoryStore()
+        patcher = mock.patch.object(throttling, 'get_store', return_value=store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')
+        request.user = mock.Mock(is_authenticated=False, is_staff=False)
+        return request
+
+    def test_buckets_per_client_and_per_view(self):
+        @throttling.throttle('search', json=True)
+        def first(request):
+            return HttpResponse()
+
+        @throttling.throttle('search', json=True)
+        def second(request):
+            return HttpResponse()
+
+        self.assertEqual([first(self.request()).status_code for _ in range(3)], [200, 200, 429])
+        self.assertEqual(first(self.request())['Retry-After'], '1')
+        self.assertEqual(second(self.request()).status_code, 200)
+
+
+# Pages pré-rendues
+
+class PrerenderPlanTests(TestCase):
+    def setUp(self):
+        self.roman = Category.objects.create(name='Roman')
+        self.poesie = Category.objects.create(name='Poésie')
+        self.book = make_book(title='Les Misérables', isbn='9780000000057', category=self.roman)
+        self.other = make_book(title='Les Contemplations', isbn='9780000000064', category=self.poesie)
+        self.hugo = self.book.author
+        self.zola = Author.objects.create(first_name='Émile', last_name='Zola')
+        # comme relu depuis le fichier du manifeste
+        self.manifest = json.loads(json.dumps(prerender.plan()[2]))
+
+    def plan(self):
+        render, remove, _ = prerender.plan(self.manifest)
+        return set(render), set(remove)
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.plan(), (set(), set()))
+
+    def test_changed_book(self):
+        self.book.title = 'Les Misérables (édition intégrale)'
+        self.book.save()
+
+        self.assertEqual(self.plan(), (
+            {('book', self.book.pk), ('author', self.hugo.pk), ('category', self.roman.pk)},
+            set(),
+        ))
+
+    def test_book_moved_to_another_author_and_category(self):
+        self.book.author = self.zola
+        self.book.category = self.poesie
+        self.book.save()
+
+        render, _ = self.plan()
+        self.assertEqual(render, {
+            ('book', self.book.pk),
+            ('author', self.hugo.pk), ('author', self.zola.pk),
+            ('category', self.roman.pk), ('category', self.poesie.pk),
+        })
+
+    def test_deleted_book(self):
+        pk = self.other.pk
+        self.other.delete()
+
+        self.assertEqual(self.plan(), (
+            {('author', self.hugo.pk), ('category', self.poesie.pk)},
+            {('book', pk)},
+        ))
+
+    def test_edited_author_and_category(self):
+        self.zola.biography = 'Romancier naturaliste.'
+        self.zola.save()
+        self.roman.description = 'Fiction en prose.'
+        self.roman.save()
+
+        render, _ = self.plan()
+        self.assertIn(('author', self.zola.pk), render)
+        self.assertIn(('category', self.roman.pk), render)
+        self.assertNotIn(('author', self.hugo.pk), render)
+        self.assertNotIn(('category', self.poesie.pk), render)
+
+        pk = self.zola.pk
+        self.zola.delete()
+        self.assertIn(('author', pk), self.plan()[1])
+
+    def test_manifest_without_versions_renders_authors_and_categories_once(self):
+        self.manifest['authors'] = [self.hugo.pk, self.zola.pk]
+        self.manifest['categories'] = [self.roman.pk, self.poesie.pk]
+
+        render, remove = self.plan()
+        self.assertEqual({kind for kind, _ in render}, {'author', 'category'})
+        self.assertEqual(len(render), 4)
+        self.assertEqual(remove, set())
+
+
+# Doublons d'auteurs
+
+class DedupeTests(TestCase):
+    def author(self, first_name, last_name='Hugo', **kwargs):
+        return Author.objects.create(first_name=first_name, last_name=last_name, **kwargs).pk
+
+    def book_by(self, title, isbn, author_id):
+        book = make_book(title=title, isbn=isbn)
+        book.author_id = author_id
+        book.save()
+        return book
+
+    def clusters(self, **kwargs):
+        return sorted(dedupe.find_duplicates(**kwargs).clusters)
+
+    def test_blocking_on_surname_and_initial(self):
+        self.assertEqual(dedupe.blocking_key('Jean-Marie', 'Le Clézio'), ('leclezio', 'j'))
+        self.assertEqual(dedupe.blocking_key('Victor', ''), None)
+
+        victor = self.author('Victor')
+        accents = self.author('Víctor', 'HUGO')
+        self.author('Victor', 'Hugon')        # autre nom de famille
+        self.author('Adèle')                  # autre initiale
+
+        report = dedupe.find_duplicates()
+        self.assertEqual(report.clusters, [[victor, accents]])
+        self.assertEqual((report.authors, report.blocks, report.comparisons), (4, 1, 1))
+
+    def test_trigram_threshold(self):
+        self.assertEqual(dedupe.similarity('victor', 'victor'), 1.0)
+        self.assertAlmostEqual(dedupe.similarity('victor', 'viktor'), 0.4)
+        pks = [self.author('Victor'), self.author('Viktor')]
+
+        self.assertEqual(self.clusters(), [])
+        self.assertEqual(self.clusters(threshold=0.4), [pks])
+
+    def test_bare_initial_joins_a_single_group_only(self):
+        victor = self.author('Victor')
+        initial = self.author('V.')
+        self.assertEqual(self.clusters(), [[victor, initial]])
+
+        # deux prénoms différents : l'initiale ne les relie pas
+        valentine = self.author('Valentine')
+        report = dedupe.find_duplicates()
+        self.assertEqual(report.clusters, [])
+        self.assertEqual(report.ambiguous, [initial])
+        self.assertNotIn([victor, valentine], report.clusters)
+
+    def test_oversized_blocks_are_skipped(self):
+        for first_name in ('Victor', 'Víctor', 'Vincent'):
+            self.author(first_name)
+
+        report = dedupe.find_duplicates(max_block=2)
+        self.assertEqual(report.clusters, [])
+        self.assertEqual(report.skipped_blocks, [(('hugo', 'v'), 3)])
+
+    def test_merge_repoints_books_before_deleting(self):
+        kept = make_book(isbn='9780000000002').author_id
+        make_book(title='B', isbn='9780000000019')
+        accents = self.author('Víctor', nationality='Française')
+        moved = self.book_by('C', '9780000000026', accents)
+        # le plus de livres l'emporte : les champs vides sont complétés par le doublon
+        zola = self.author('Emile', 'ZOLA')
+        empty = self.author('Émile', 'Zola', website='https://zola.example.org')
+        self.book_by('D', '9780000000033', zola)
+
+        clusters = dedupe.find_duplicates().clusters
+        self.assertEqual(len(clusters), 2)
+        # Book.author est en PROTECT : les livres doivent être déplacés avant la suppression
+        deleted, books = dedupe.merge_duplicates(clusters, batch_size=1)
+
+        self.assertEqual((deleted, books), (2, 1))
+        self.assertEqual(set(Author.objects.values_list('pk', flat=True)), {kept, zola})
+        moved.refresh_from_db()
+        self.assertEqual(moved.author_id, kept)
+        self.assertEqual(Author.objects.get(pk=kept).nationality, 'Française')
+        self.assertEqual(Author.objects.get(pk=zola).website, 'https://zola.example.org')
+        self.assertFalse(Author.objects.filter(pk=empty).exists())
+
+# Profilage des requêtes
+
+@PLAIN_STATIC
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = Path(root.name)
+        settings = override_settings(
+            PROFILING_ENABLED=True, PROFILING_TOKEN='jeton', PROFILING_SAMPLE_RATE=0, PROFILING_ROOT=self.root,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        make_book()
+
+    def profiles(self):
+        return sorted(path.name for path in self.root.glob('*'))
+
+    def test_header_token(self):
+        self.assertNotIn('X-Profile-Id', self.client.get('/books/', headers={'X-Profile': 'faux'}))
+        self.assertEqual(self.profiles(), [])
+
+        response = self.client.get('/books/', headers={'X-Profile': 'jeton'})
+        profile_id = response['X-Profile-Id']
+        self.assertEqual(self.profiles(), [f'{profile_id}.json', f'{profile_id}.prof'])
+        meta = json.loads((self.root / f'{profile_id}.json').read_text())
+        self.assertEqual((meta['view'], meta['reason'], meta['status']), ('books:book_list', 'header', 200))
+        self.assertGreater(meta['queries'], 0)
+
+        output = StringIO()
+        call_command('profile_report', view='books:book_list', stdout=output)
+        self.assertIn('books:book_list', output.getvalue())
+        self.assertIn('Temps par couche', output.getvalue())
+
+    def test_query_flag_is_for_staff_only(self):
+        self.assertNotIn('X-Profile-Id', self.client.get('/books/', {'_profile': '1'}))
+
+        staff = User.objects.create_user('bibliothecaire', password='x', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/books/', {'_profile': '1'})
+        meta = json.loads((self.root / f"{response['X-Profile-Id']}.json").read_text())
+        self.assertEqual(meta['reason'], 'staff')
+
+    def test_sampling(self):
+        with override_settings(PROFILING_SAMPLE_RATE=10):
+            with mock.patch('books.profiling.random.randrange', return_value=3) as draw:
+                self.assertNotIn('X-Profile-Id', self.client.get('/books/'))
+            draw.assert_called_once_with(10)
+            with mock.patch('books.profiling.random.randrange', return_value=0):
+                self.assertIn('X-Profile-Id', self.client.get('/books/'))
+        self.assertEqual(len(self.profiles()), 2)
+
+    def test_disabled(self):
+        with override_settings(PROFILING_ENABLED=False):
+            self.assertNotIn('X-Profile-Id', self.client.get('/books/', headers={'X-Profile': 'jeton'}))
+        self.assertEqual(self.profiles(), [])
+
+
+# Disponibilité en direct
+
+class LiveAvailabilityTests(TestCase):
+    def setUp(self):
+        self.branch = Branch.objects.create(name='Centre', code='CTR')
+        self.book = make_copies(make_book(isbn='9780000000002', copies=0), self.branch, 2)
+        self.other = make_copies(make_book(title='Autre', isbn='9780000000019', copies=0), self.branch, 1)
+        self.broker = live.LocalBroker()
+        patcher = mock.patch.object(live, '_broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def checkout(self, card='C1'):
+        # les kiosques sont prévenus à la validation (on_commit)
+        with self.captureOnCommitCallbacks(execute=True):
+            return services.checkout_books(card, 'Lecteur', 'lecteur@exemple.fr', [self.book.isbn])
+
+    def give_back(self, loans):
+        with self.captureOnCommitCallbacks(execute=True):
+            return services.return_loans(loan_ids=[loan.pk for loan in loans])
+
+    async def test_checkout_and_return_are_fanned_out(self):
+        first = self.broker.subscribe({self.book.pk})
+        second = self.broker.subscribe({self.book.pk, self.other.pk})
+        elsewhere = self.broker.subscribe({self.other.pk})
+        self.assertEqual(self.broker.connections(), 3)
+
+        result = await sync_to_async(self.checkout)()
+        for subscription in (first, second):
+            payloads = await subscription.next(1)
+            self.assertEqual(payloads[self.book.pk]['copies_available'], 1)
+            self.assertIsNotNone(payloads[self.book.pk]['available_from'])
+        self.assertEqual(await elsewhere.next(0.05), {})
+
+        await sync_to_async(self.give_back)(result.loans)
+        payloads = await first.next(1)
+        self.assertEqual(payloads[self.book.pk]['copies_available'], 2)
+        self.assertIsNone(payloads[self.book.pk]['available_from'])
+
+        for subscription in (first, second, elsewhere):
+            self.broker.unsubscribe(subscription)
+        self.assertEqual(self.broker.connections(), 0)
+        self.assertEqual(self.broker.watched({self.book.pk, self.other.pk}), set())
+
+    async def test_slow_client_only_gets_the_latest_state(self):
+        subscription = self.broker.subscribe({self.book.pk})
+        await sync_to_async(self.checkout)()
+        await sync_to_async(self.checkout)('C2')
+
+        payloads = await subscription.next(1)
+        self.assertEqual(payloads[self.book.pk]['copies_available'], 0)
+        self.assertEqual(await subscription.next(0.05), {})
+        self.broker.unsubscribe(subscription)
+
+    async def test_stream_unsubscribes_on_disconnect(self):
+        response = await self.async_client.get('/live/availability/', {'books': f'{self.book.pk}'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+
+        self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+        initial = await anext(chunks)
+        self.assertIn(b'event: availability', initial)
+        self.assertEqual(json.loads(initial.split(b'data: ')[1])['copies_available'], 2)
+        self.assertEqual(self.broker.connections(), 1)
+
+        reader = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0)
+        await sync_to_async(self.checkout)()
+        update = await asyncio.wait_for(reader, 1)
+        self.assertEqual(json.loads(update.split(b'data: ')[1])['copies_available'], 1)
+
+        # client parti : la tâche de la connexion est annulée par le serveur ASGI
+        reader = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0)
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertEqual(self.broker.connections(), 0)
+
+    async def test_stream_rejects_bad_parameters(self):
+        for books in ('', 'a,1', ','.join(str(pk) for pk in range(1, 300))):
+            response = await self.async_client.get('/live/availability/', {'books': books})
+            self.assertEqual(response.status_code, 400, books)
+
+    async def test_event_log_broker_polls_other_processes(self):
+        broker = live.EventLogBroker(poll_seconds=0.01)
+        subscription = broker.subscribe({self.book.pk})
+        await asyncio.sleep(0.05)     # position de départ lue par le poller
+
+        # emprunt validé par un autre processus : seul le journal le signale
+        @sync_to_async
+        def checkout_elsewhere():
+            copy = inventory.available_copies([self.book.pk])[self.book.pk][0]
+            loan = make_loan(self.book, copy=copy)
+            inventory.lend([loan])
+            events.record(loan, LoanEvent.KIND_CREATED)
+
+        await checkout_elsewhere()
+        payloads = await subscription.next(1)
+        self.assertEqual(payloads[self.book.pk]['copies_available'], 1)
+
+        broker.unsubscribe(subscription)
+        await asyncio.wait_for(broker.poller, 1)
+
+
+# Amendes de retard
+
+class FineTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.book = make_book()
+        category = Category.objects.create(name='Rare', fine_daily_rate=Decimal('0.35'), fine_max_amount=Decimal('2.00'))
+        self.rare = make_book(title='Rare', isbn='9780000000019', category=category)
+
+    def late_loan(self, card, days, book=None, returned_after=None):
+        loan = make_loan(book or self.book, card=card, due_in=-timedelta(days=days, hours=2))
+        if returned_after is not None:
+            returned_at = loan.due_at + returned_after
+            Loan.objects.filter(pk=loan.pk).update(status=Loan.STATUS_RETURNED, returned_at=returned_at)
+            loan.refresh_from_db()
+            events.record(loan, LoanEvent.KIND_RETURNED, at=returned_at)
+        return loan
+
+    def balances(self):
+        return dict(BorrowerBalance.objects.values_list('card_number', 'balance'))
+
+    def test_sql_matches_calculate_penalty(self):
+        loans = [
+            self.late_loan('A', 3),
+            self.late_loan('A', 40),                    # plafond
+            self.late_loan('B', 4, book=self.rare),
+            self.late_loan('B', 9, book=self.rare),     # plafond de la catégorie
+            self.late_loan('C', 9, returned_after=timedelta(days=2, hours=5)),
+            self.late_loan('C', 9, returned_after=timedelta(hours=5)),
+            make_loan(self.book, card='D'),             # pas en retard
+        ]
+        fines.compute_fines(now=self.now)
+
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            expected = {loan.pk: loan.calculate_penalty() for loan in loans}
+        amounts = dict(Fine.objects.values_list('loan_id', 'amount'))
+        self.assertEqual(amounts, {pk: amount for pk, amount in expected.items() if amount})
+        self.assertEqual(self.balances(), {'A': Decimal('11.50'), 'B': Decimal('3.40'), 'C': Decimal('1.00')})
+
+    def test_rerun_is_incremental(self):
+        self.late_loan('A', 3)
+        self.assertEqual(fines.compute_fines(now=self.now), (1, 1))
+        self.assertEqual(fines.compute_fines(now=self.now + timedelta(minutes=1)), (0, 0))
+        self.assertEqual(fines.compute_fines(now=self.now + timedelta(days=1)), (1, 1))
+
+    def test_fine_follows_corrected_card_number(self):
+        moved = self.late_loan('A', 3)
+        self.late_loan('A', 4)
+        only = self.late_loan('C', 5)
+        fines.compute_fines(now=self.now)
+
+        Loan.objects.filter(pk__in=[moved.pk, only.pk]).update(borrower_card_number='B')
+        fines.compute_fines(now=self.now)
+
+        self.assertEqual(self.balances(), {'A': Decimal('2.00'), 'B': Decimal('4.00')})
+        self.assertEqual(set(Fine.objects.values_list('borrower_card_number', flat=True)), {'A', 'B'})
+
+    def test_deleted_loan_releases_balance(self):
+        kept = self.late_loan('A', 3)
+        deleted = self.late_loan('A', 20)
+        only = self.late_loan('B', 20)
+        fines.compute_fines(now=self.now)
+        self.assertIsNotNone(fines.blocking_balance('B'))
+
+        deleted.delete()
+        only.delete()
+
+        self.assertEqual(self.balances(), {'A': kept.fine.amount})
+        self.assertIsNone(fines.blocking_balance('B'))
+
+    def test_payment_clears_balance(self):
+        loan = self.late_loan('A', 20)
+        other = self.late_loan('B', 20)
+        fines.compute_fines(now=self.now)
+        # amende d'une autre carte modifiée au même instant : son solde n'est pas touché
+        Fine.objects.filter(loan=other).update(amount=Decimal('7.00'), updated_at=self.now)
+        fines.record_payment([loan.fine.pk], now=self.now)
+
+        self.assertEqual(self.balances(), {'A': Decimal('0.00'), 'B': Decimal('10.00')})
+        self.assertIsNone(fines.blocking_balance('A'))
@@ -0,0 +1,174 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.shortcuts import render
+
+# coût maximal d'une requête, en jetons (pages profondes, recherches larges)
+MAX_COST = 20
+
+
+# Stockage des seaux
+
+class MemoryStore:
+    """
+    Seaux en mémoire du processus : le plus rapide, mais chaque worker
+    applique sa propre limite.
+
+    Les seaux sont rangés du moins au plus récemment utilisé : ceux du début
+    qui sont redevenus pleins, ou en surnombre au-delà de `max_keys`, sont
+    retirés un par un à chaque requête, en temps constant amorti.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_keys = max_keys
+
+    def consume(self, key, cost, rate, burst):
+        """Retire `cost` jetons ; retourne 0, ou le délai d'attente en secondes"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, stamp, _ = self.buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            wait = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            # (jetons, date, date à laquelle le seau sera de nouveau plein)
+            self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            self.buckets.move_to_end(key)
+            self.evict(now)
+            return wait
+
+    def evict(self, now):
+        # un seau redevenu plein équivaut à un seau absent ; en surnombre,
+        # le moins récemment utilisé est oublié
+        while self.buckets:
+            _, _, full_at = next(iter(self.buckets.values()))
+            if full_at > now and len(self.buckets) <= self.max_keys:
+                return
+            self.buckets.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheStore:
+    """
+    Seaux dans un cache Django partagé (Redis, Memcached…) : une seule limite
+    pour tous les workers. La lecture-écriture n'est pas atomique : deux
+    requêtes simultanées d'un même client peuvent dépasser d'un jeton.
+    """
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def consume(self, key, cost, rate, burst):
+        now = time.time()
+        key = f'throttle:{key}'
+        tokens, stamp = self.cache.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - stamp) * rate)
+        wait = 0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        # expire quand le seau serait de nouveau plein
+        self.cache.set(key, (tokens, now), timeout=math.ceil((burst - tokens) / rate) + 1)
+        return wait
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        if getattr(settings, 'THROTTLE_STORE', 'memory') == 'cache':
+            _store = CacheStore(getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default'))
+        else:
+            _store = MemoryStore()
+    return _store
+
+
+# Identification du client et coût des requêtes
+
+def client_key(request):
+    """Utilisateur connecté, sinon adresse IP (celle du proxy de confiance si configuré)"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    if getattr(settings, 'THROTTLE_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return f'ip:{forwarded.split(",")[0].strip()}'
+    return f'ip:{request.META.get("REMOTE_ADDR", "")}'
+
+
+def search_cost(request, text_fields=('search', 'title', 'author', 'isbn')):
+    """
+    Coût d'une page de résultats, en jetons.
+
+    Une page profonde oblige la base à parcourir toutes les précédentes
+    (OFFSET) ; un terme très court fait un LIKE '%x%' qui retient une grande
+    partie du catalogue.
+    """
+    cost = 1
+    page = request.GET.get('page', '')
+    if page.isdigit():
+        cost += (int(page) - 1) // 5
+    for field in text_fields:
+        term = request.GET.get(field, '').strip()
+        if term and len(term) < 3:
+            cost += 2
+    return min(cost, MAX_COST)
+
+
+# Décorateur
+
+def throttle(scope, cost=None, json=False):
+    """
+    Limite le débit d'une vue par client, avec un seau à jetons par portée.
+
+    THROTTLE_RATES[scope] donne (jetons par minute, réserve) ; `cost(request)`
+    indique combien de jetons consomme la requête. Chaque vue a ses propres
+    seaux : deux vues de même portée partagent le débit configuré, pas les
+    jetons. Au-delà, la vue répond 429 avec l'en-tête Retry-After. Le
+    personnel n'est pas limité.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            rates = getattr(settings, 'THROTTLE_RATES', {})
+            if scope not in rates or not getattr(settings, 'THROTTLE_ENABLED', True):
+                return view(request, *args, **kwargs)
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_staff:
+                return view(request, *args, **kwargs)
+
+            per_minute, burst = rates[scope]
+            tokens = min(cost(request) if cost else 1, burst)
+            key = f'{scope}:{view.__name__}:{client_key(request)}'
+            wait = get_store().consume(key, tokens, per_minute / 60, burst)
+            if wait:
+                return throttled(request, math.ceil(wait), json)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def throttled(request, retry_after, json=False):
+    if json:
+        response = JsonResponse({'error': 'Trop de requêtes.', 'retry_after': retry_after}, status=429)
+    else:
+        response = render(request, '429.html', {'retry_after': retry_after}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -11,6 +11,7 @@ urlpatterns = [
     path('books/', views.book_list, name='book_list'),
     path('books/<int:pk>/', views.book_detail, name='book_detail'),
     path('books/search/', views.book_search, name='book_search'),  
+    path('books/scan/<str:code>/', views.scan_isbn, name='scan_isbn'),
     path('category/<int:pk>/', views.books_by_category, name='category_books'),
     
     # Authors
@@ -21,7 +22,11 @@ urlpatterns = [
     path('loans/', views.loan_list, name='loan_list'),
     path('loans/create/', views.create_loan, name='create_loan'),  
     path('loans/<int:loan_id>/return/', views.return_book, name='return_book'),  
+    path('loans/bulk/checkout/', views.bulk_checkout, name='bulk_checkout'),
+    path('loans/bulk/return/', views.bulk_return, name='bulk_return'),
     path('loans/overdue/', views.overdue_loans, name='overdue_loans'),
+    path('loans/events/', views.loan_events, name='loan_events'),
+    path('live/availability/', views.availability_stream, name='availability_stream'),
     
     # Static
     path('about/', views.about, name='about'),
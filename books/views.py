@@ -1,11 +1,24 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.http import JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.urls import reverse
 from django.core.paginator import Paginator
-from .forms import LoanForm, BookSearchForm, ContactForm, ReturnBookForm
+from .forms import LoanForm, BookSearchForm, ContactForm, ReturnBookForm, BulkCheckoutForm, BulkReturnForm
+from django.db import transaction
 from django.db.models import Q
 from django.contrib import messages
+from django.utils import timezone
 from datetime import date
-from .models import Book, Author, Category, Loan
-from datetime import timedelta
+import json
+from asgiref.sync import sync_to_async
+from .models import Book, Author, Branch, Category, Loan, LoanEvent
+from . import events, fines, inventory, live
+from .recommendations import recommended_books
+from .popularity import SORT_CHOICES, sort_books
+from .facets import add_facet_links, facet_counts, filter_facet
+from .isbn import normalize_isbn
+from .services import LOAN_DURATION, checkout_books, return_loans
+from .throttling import search_cost, throttle
 
 # home page
 
@@ -27,12 +40,18 @@ def home(request):
 
 # Books
 
+@throttle('search', cost=search_cost)
 def book_list(request):
     """Liste paginée de tous les livres avec recherche"""
     books = Book.objects.all().select_related('author', 'category')
     
     search_query = request.GET.get('search', '')
-    if search_query:
+    isbn13 = normalize_isbn(search_query)
+    if isbn13:
+        # ISBN complet : recherche exacte sur l'index, et sur l'ISBN saisi pour
+        # les livres sans isbn13 (conflits laissés par backfill_isbn13)
+        books = books.filter(Q(isbn13=isbn13) | Q(isbn__icontains=search_query))
+    elif search_query:
         books = books.filter(
             Q(title__icontains=search_query) |
             Q(author__first_name__icontains=search_query) |
@@ -44,6 +63,14 @@ def book_list(request):
     if category_id:
         books = books.filter(category_id=category_id)
     
+    # Disponibles dans une bibliothèque
+    branch_id = request.GET.get('branch', '')
+    if branch_id.isdigit():
+        books = books.filter(pk__in=inventory.available_at(branch_id))
+    
+    sort = request.GET.get('sort', '')
+    books = sort_books(books, sort)
+    
     paginator = Paginator(books, 12)  
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
@@ -55,19 +82,60 @@ def book_list(request):
         'search_query': search_query,
         'categories': categories,
         'selected_category': category_id,
+        'branches': Branch.objects.all(),
+        'selected_branch': branch_id,
+        'sort': sort,
+        'sort_choices': SORT_CHOICES,
     }
     return render(request, 'book_list.html', context)
 
 
+@throttle('scan', json=True)
+def scan_isbn(request, code):
+    """Lecteur de codes-barres : livre et disponibilité pour un ISBN (une requête indexée)"""
+    isbn13 = normalize_isbn(code)
+    if not isbn13:
+        return JsonResponse({'error': 'ISBN invalide.'}, status=400)
+    
+    book = (
+        Book.objects.filter(isbn13=isbn13)
+        .select_related('author')
+        .only(
+            'title', 'isbn', 'isbn13', 'copies_available', 'copies_total', 'available_from',
+            'author__first_name', 'author__last_name',
+        )
+        .first()
+    )
+    if book is None:
+        return JsonResponse({'error': 'Aucun livre pour cet ISBN.', 'isbn13': isbn13}, status=404)
+    
+    return JsonResponse({
+        'id': book.pk,
+        'title': book.title,
+        'author': str(book.author),
+        'isbn': book.isbn,
+        'isbn13': book.isbn13,
+        'copies_available': book.copies_available,
+        'copies_total': book.copies_total,
+        'is_available': book.copies_available > 0,
+        'available_from': book.available_from,
+        'url': reverse('books:book_detail', args=[book.pk]),
+    })
+
+
 def book_detail(request, pk):
     """Détail d'un livre avec informations complètes"""
     book = get_object_or_404(Book.objects.select_related('author', 'category'), pk=pk)
     active_loans = book.loans.filter(status='BORROWED')
+    branch_stock = book.branch_stock.select_related('branch').order_by('branch__name')
     
     context = {
         'book': book,
         'active_loans': active_loans,
+        'branch_stock': branch_stock,
         'is_available': book.copies_available > 0,
+        'now': timezone.now(),
+        'recommended_books': recommended_books(book),
     }
     return render(request, 'book_detail.html', context)
 
@@ -76,6 +144,8 @@ def books_by_category(request, pk):
     """Liste des livres d'une catégorie"""
     category = get_object_or_404(Category, pk=pk)
     books = category.books.all().select_related('author')
+    sort = request.GET.get('sort', '')
+    books = sort_books(books, sort)
     
     paginator = Paginator(books, 12)
     page_number = request.GET.get('page')
@@ -84,6 +154,8 @@ def books_by_category(request, pk):
     context = {
         'category': category,
         'page_obj': page_obj,
+        'sort': sort,
+        'sort_choices': SORT_CHOICES,
     }
     return render(request, 'category_books.html', context)
 
@@ -149,13 +221,84 @@ def overdue_loans(request):
     loans = Loan.objects.filter(
         status__in=[Loan.STATUS_ACTIVE, Loan.STATUS_LATE],
         due_at__lt=timezone.now()
-    ).select_related('book', 'book__author').order_by('due_at')
+    ).select_related('book', 'book__author', 'book__category').order_by('due_at')
     
-    context = {'loans': loans}
+    context = {
+        'loans': loans,
+        'fine_daily_rate': fines.default_rate(),
+        'fine_max_amount': fines.default_cap(),
+    }
     return render(request, 'overdue_loans.html', context)
 
 # Static
 
+def loan_events(request):
+    """Flux des changements d'emprunts : ?after=<curseur>&limit=<n>, en JSON"""
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = min(max(int(request.GET.get('limit', 500)), 1), 5000)
+    except ValueError:
+        return JsonResponse({'error': 'Paramètres after et limit entiers attendus.'}, status=400)
+    
+    page, cursor = events.changes(after, limit)
+    return JsonResponse({
+        'events': [
+            {
+                'sequence': event.pk,
+                'kind': event.kind,
+                'loan': event.loan_id,
+                'book': event.book_id,
+                'at': event.at,
+                'due_at': event.due_at,
+            }
+            for event in page
+        ],
+        'cursor': cursor,
+        'has_more': len(page) == limit,
+    })
+
+
+async def availability_stream(request):
+    """
+    Disponibilité en direct des livres ?books=1,2,3, en Server-Sent Events.
+
+    L'état courant est envoyé à la connexion, puis à chaque emprunt ou
+    retour. La connexion attend dans la boucle d'événements, sans thread :
+    à servir en ASGI (core/asgi.py).
+    """
+    raw = [value for value in request.GET.get('books', '').split(',') if value]
+    max_books = getattr(settings, 'LIVE_MAX_BOOKS', 200)
+    if not raw or len(raw) > max_books or not all(value.isdigit() for value in raw):
+        return JsonResponse({'error': f'Paramètre books attendu : 1 à {max_books} identifiants.'}, status=400)
+    book_ids = {int(value) for value in raw}
+    keepalive = getattr(settings, 'LIVE_KEEPALIVE_SECONDS', 15)
+
+    def message(payload):
+        return f'event: availability\ndata: {json.dumps(payload)}\n\n'
+
+    async def stream():
+        broker = live.get_broker()
+        # abonnement avant l'état initial : aucun changement ne peut passer entre les deux
+        subscription = broker.subscribe(book_ids)
+        try:
+            yield 'retry: 5000\n\n'
+            for payload in (await sync_to_async(live.availability)(book_ids)).values():
+                yield message(payload)
+            while True:
+                payloads = await subscription.next(keepalive)
+                if not payloads:
+                    yield ': keepalive\n\n'
+                for payload in payloads.values():
+                    yield message(payload)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'    # pas de mise en tampon par nginx
+    return response
+
+
 def about(request):
     """Page À propos"""
     return render(request, 'about.html')
@@ -171,18 +314,33 @@ def create_loan(request):
     if request.method == 'POST':
         form = LoanForm(request.POST)
         if form.is_valid():
-            loan = form.save(commit=False)
-            # Définir la date limite à 14 jours
-            loan.due_at = timezone.now() + timedelta(days=14)
-            loan.status = Loan.STATUS_ACTIVE
-            loan.save()
-            
-            # Décrémenter les exemplaires disponibles
-            loan.book.copies_available -= 1
-            loan.book.save()
+            with transaction.atomic():
+                loan = form.save(commit=False)
+                # Exemplaire en rayon, dans la bibliothèque choisie le cas échéant
+                branch = form.cleaned_data.get('branch')
+                copies = inventory.available_copies([loan.book_id], branch)
+                # Livre sans exemplaire enregistré : prêt sur ses compteurs
+                copyless = (
+                    branch is None
+                    and inventory.without_copies([loan.book_id])
+                    and Book.objects.select_for_update().filter(pk=loan.book_id, copies_available__gt=0).exists()
+                )
+                if copies[loan.book_id] or copyless:
+                    loan.copy = copies[loan.book_id][0] if copies[loan.book_id] else None
+                    # Définir la date limite à 14 jours
+                    loan.due_at = timezone.now() + LOAN_DURATION
+                    loan.status = Loan.STATUS_ACTIVE
+                    loan.save()
+                    
+                    # Décrémenter les exemplaires disponibles
+                    inventory.lend([loan])
+                    events.record(loan, LoanEvent.KIND_CREATED, at=loan.borrowed_at)
             
-            messages.success(request, f'Emprunt créé avec succès pour "{loan.book.title}".')
-            return redirect('books:loan_list')
+            if loan.pk:
+                copy = f' (exemplaire {loan.copy.barcode})' if loan.copy else ''
+                messages.success(request, f'Emprunt créé avec succès pour "{loan.book.title}"{copy}.')
+                return redirect('books:loan_list')
+            form.add_error(None, f'Aucun exemplaire de "{loan.book.title}" n\'est en rayon.')
     else:
         form = LoanForm()
     
@@ -201,16 +359,17 @@ def return_book(request, loan_id):
     if request.method == 'POST':
         form = ReturnBookForm(request.POST)
         if form.is_valid():
-            # Marquer comme retourné
-            loan.returned_at = timezone.now()
-            loan.status = Loan.STATUS_RETURNED
-            if form.cleaned_data.get('comments'):
-                loan.comments = form.cleaned_data['comments']
-            loan.save()
-            
-            # Libérer un exemplaire
-            loan.book.copies_available += 1
-            loan.book.save()
+            with transaction.atomic():
+                # Marquer comme retourné
+                loan.returned_at = timezone.now()
+                loan.status = Loan.STATUS_RETURNED
+                if form.cleaned_data.get('comments'):
+                    loan.comments = form.cleaned_data['comments']
+                loan.save()
+                
+                # Libérer un exemplaire
+                inventory.give_back([loan])
+                events.record(loan, LoanEvent.KIND_RETURNED, at=loan.returned_at)
             
             messages.success(request, f'Le livre "{loan.book.title}" a été retourné.')
             return redirect('books:loan_list')
@@ -224,6 +383,63 @@ def return_book(request, loan_id):
     return render(request, 'return_book.html', context)
 
 
+def bulk_checkout(request):
+    """Emprunt de plusieurs livres en une seule opération"""
+    result = None
+    if request.method == 'POST':
+        form = BulkCheckoutForm(request.POST)
+        if form.is_valid():
+            data = form.cleaned_data
+            result = checkout_books(
+                data['borrower_card_number'],
+                data['borrower_name'],
+                data['borrower_email'],
+                data['isbns'],
+                comments=data['comments'],
+                branch=data['branch'],
+            )
+            if result.ok:
+                count = len(result.loans)
+                messages.success(request, f'{count} emprunt{"s" if count > 1 else ""} créé{"s" if count > 1 else ""} avec succès.')
+                return redirect('books:loan_list')
+    else:
+        form = BulkCheckoutForm()
+    
+    context = {
+        'form': form,
+        'result': result,
+    }
+    return render(request, 'bulk_checkout.html', context)
+
+
+def bulk_return(request):
+    """Retour de plusieurs livres en une seule opération"""
+    result = None
+    if request.method == 'POST':
+        form = BulkReturnForm(request.POST)
+        if form.is_valid():
+            data = form.cleaned_data
+            result = return_loans(
+                loan_ids=data['loan_ids'],
+                card_number=data['borrower_card_number'],
+                isbns=data['isbns'],
+                comments=data['comments'],
+            )
+            if result.ok:
+                count = len(result.loans)
+                messages.success(request, f'{count} livre{"s" if count > 1 else ""} retourné{"s" if count > 1 else ""}.')
+                return redirect('books:loan_list')
+    else:
+        form = BulkReturnForm()
+    
+    context = {
+        'form': form,
+        'result': result,
+    }
+    return render(request, 'bulk_return.html', context)
+
+
+@throttle('search', cost=search_cost)
 def book_search(request):
     """Recherche avancée de livres"""
     form = BookSearchForm(request.GET or None)
@@ -241,24 +457,59 @@ def book_search(request):
                 Q(author__last_name__icontains=form.cleaned_data['author'])
             )
         
+        # Filtrage par ISBN
+        if form.cleaned_data.get('isbn'):
+            isbn13 = normalize_isbn(form.cleaned_data['isbn'])
+            if isbn13:
+                books = books.filter(Q(isbn13=isbn13) | Q(isbn__icontains=form.cleaned_data['isbn']))
+            else:
+                books = books.filter(isbn__icontains=form.cleaned_data['isbn'])
+        
+        # Livres retenus par la recherche textuelle, pour les comptes des facettes
+        facet_books = None
+        if any(form.cleaned_data.get(field) for field in ('title', 'author', 'isbn')):
+            facet_books = books
+        
         # Filtrage par catégorie
         if form.cleaned_data.get('category'):
             books = books.filter(category=form.cleaned_data['category'])
         
-        # Filtrage par ISBN
-        if form.cleaned_data.get('isbn'):
-            books = books.filter(isbn__icontains=form.cleaned_data['isbn'])
-        
         # Filtrage par disponibilité
         if form.cleaned_data.get('available_only'):
             books = books.filter(copies_available__gt=0)
         
+        if form.cleaned_data.get('branch'):
+            branch_books = inventory.available_at(form.cleaned_data['branch'])
+            books = books.filter(pk__in=branch_books)
+            # les facettes ne comptent que les livres disponibles dans la bibliothèque
+            if facet_books is None:
+                facet_books = Book.objects.all()
+            facet_books = facet_books.filter(pk__in=branch_books)
+        
+        # Filtrage par facettes
+        if form.cleaned_data.get('language'):
+            books = filter_facet(books, 'language', form.cleaned_data['language'])
+        
+        if form.cleaned_data.get('decade') is not None:
+            decade = form.cleaned_data['decade']
+            books = books.filter(publication_year__gte=decade, publication_year__lt=decade + 10)
+        
+        if form.cleaned_data.get('publisher'):
+            books = filter_facet(books, 'publisher', form.cleaned_data['publisher'])
+        
         # Filtrage par année
         if form.cleaned_data.get('year_min'):
             books = books.filter(publication_year__gte=form.cleaned_data['year_min'])
         
         if form.cleaned_data.get('year_max'):
             books = books.filter(publication_year__lte=form.cleaned_data['year_max'])
+        
+        # Tri
+        books = sort_books(books, form.cleaned_data.get('sort'))
+        facets = facet_counts(form.cleaned_data, facet_books)
+    else:
+        books = sort_books(books, None)
+        facets = facet_counts({})
     
     # Pagination
     paginator = Paginator(books, 12)
@@ -268,6 +519,7 @@ def book_search(request):
     context = {
         'form': form,
         'page_obj': page_obj,
+        'facets': add_facet_links(facets, request.GET),
     }
     return render(request, 'book_search.html', context)
 
@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
+# Le flux de disponibilité des bornes (books:availability_stream) garde ses
+# connexions ouvertes dans la boucle d'événements : le servir par ce point
+# d'entrée, par exemple `uvicorn core.asgi:application`, et LIVE_BROKER =
+# 'events' s'il y a plusieurs processus.
 application = get_asgi_application()
@@ -42,10 +42,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # sert les fichiers statiques (versions .br/.gz négociées) sans proxy devant
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # profils cProfile à la demande ou échantillonnés (PROFILING_*)
+    'books.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,13 +60,20 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / "templates"],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # templates compilés une seule fois par processus
+            # (le serveur de dév vide ce cache quand un template change)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -77,10 +88,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # les workers (run_workers) écrivent en parallèle des requêtes web
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Durée de vie des cartes de livres rendues (templatetag book_cards)
+BOOK_CARD_CACHE_TIMEOUT = 60 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -119,5 +148,98 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# collectstatic produit des noms hashés (manifest) ainsi que des copies
+# compressées gzip et brotli de chaque fichier. Les fichiers hashés sont
+# servis avec "Cache-Control: max-age=315360000, immutable".
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
+
 MEDIA_URL = "media/"
-MEDIA_ROOT = BASE_DIR / "media"
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / "media"
+
+# Email
+# En développement, les messages sont affichés dans la console. Pour tester
+# contre un serveur SMTP local : EMAIL_BACKEND = smtp + `python -m aiosmtpd -n -l localhost:1025`.
+
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+EMAIL_HOST = 'localhost'
+EMAIL_PORT = 1025
+DEFAULT_FROM_EMAIL = 'bibliotheque@exemple.fr'
+
+# Rappels d'emprunts (commande send_loan_notifications)
+LOAN_REMINDER_DAYS_BEFORE = 2
+
+# Nombre de livres conservés par livre dans « les lecteurs ont aussi emprunté »
+RECOMMENDATIONS_TOP_K = 8
+
+# Demi-vie du score de popularité des livres (tri « les plus populaires »)
+POPULARITY_HALF_LIFE_DAYS = 30
+
+# Instantané en mémoire du catalogue pour les facettes de la recherche :
+# relecture des livres modifiés au plus toutes les 5 s, reconstruction complète toutes les heures
+FACET_SNAPSHOT_MAX_AGE = 5
+FACET_SNAPSHOT_REBUILD_SECONDS = 60 * 60
+# recherche textuelle : au-delà de ce nombre de livres retenus, les facettes sont comptées en SQL
+FACET_MAX_IDS = 5000
+
+# Tâches de fond (books/jobs.py). Par défaut (JOBS_EAGER = True), elles s'exécutent
+# dès la validation de la transaction, dans le processus qui les crée : rien à lancer.
+# Avec JOBS_EAGER = False, elles sont mises en file et AU MOINS UN worker
+# `manage.py run_workers` doit tourner en permanence ; sinon l'invalidation des cartes
+# et des pages pré-rendues, les recommandations et la popularité ne sont plus mises à jour.
+JOBS_EAGER = True
+JOBS_RETRY_BASE_SECONDS = 10
+
+# Limitation du débit des recherches, par client et par vue : (jetons par minute, réserve).
+# Une page profonde ou un terme très court coûte plusieurs jetons (books/throttling.py).
+THROTTLE_ENABLED = True
+THROTTLE_RATES = {
+    'search': (60, 30),
+    'scan': (120, 60),
+}
+# 'memory' : seaux propres à chaque processus ; 'cache' : partagés via CACHES[THROTTLE_CACHE_ALIAS]
+THROTTLE_STORE = 'memory'
+THROTTLE_CACHE_ALIAS = 'default'
+# à activer seulement derrière un proxy qui réécrit cet en-tête
+THROTTLE_TRUST_X_FORWARDED_FOR = False
+
+# Pages du catalogue pré-rendues en HTML statique (`manage.py prerender`),
+# à servir directement par le serveur web frontal
+PRERENDER_ROOT = BASE_DIR / "prerendered"
+
+# Profilage des requêtes (books/profiling.py, rapport : `manage.py profile_report`).
+# Déclenché par l'en-tête X-Profile égal à PROFILING_TOKEN (vide : désactivé),
+# par ?_profile=1 pour le personnel, ou pour 1 requête sur PROFILING_SAMPLE_RATE (0 : jamais).
+PROFILING_ENABLED = False
+PROFILING_TOKEN = ''
+PROFILING_SAMPLE_RATE = 0
+PROFILING_ROOT = BASE_DIR / "profiles"
+
+# Journal des emprunts (books/events.py) : un numéro manquant n'est sauté par les
+# lecteurs du flux qu'après ce délai (transaction encore en cours, ou annulée).
+# Doit dépasser la durée de la plus longue transaction qui écrit des événements.
+LOAN_EVENTS_SETTLE_SECONDS = 60
+
+# Disponibilité en direct pour les bornes (Server-Sent Events, servi en ASGI).
+# 'local' : diffusion dans le processus ; 'events' : chaque processus lit le
+# journal des emprunts toutes les LIVE_POLL_SECONDS (plusieurs processus).
+LIVE_AVAILABILITY_ENABLED = False
+LIVE_BROKER = 'local'
+LIVE_POLL_SECONDS = 1.0
+LIVE_KEEPALIVE_SECONDS = 15
+LIVE_MAX_BOOKS = 200
+
+# Amendes de retard (books/fines.py, calcul par `manage.py compute_fines`) :
+# tarif par jour et plafond par emprunt, modifiables par catégorie dans l'admin.
+# Un usager dont le solde impayé atteint FINE_BLOCK_THRESHOLD ne peut plus emprunter.
+# Après avoir changé ces valeurs ou le barème d'une catégorie, lancer `compute_fines --full` :
+# sinon les emprunts déjà retournés gardent leur ancienne amende.
+FINE_DAILY_RATE = '0.50'
+FINE_MAX_AMOUNT = '10.00'
+FINE_BLOCK_THRESHOLD = '5.00'
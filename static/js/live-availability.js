@@ -0,0 +1,65 @@
+// Disponibilité en direct (bornes) : met à jour les éléments [data-live-book]
+// à partir du flux SSE books:availability_stream.
+(function () {
+    var script = document.currentScript;
+    var elements = document.querySelectorAll('[data-live-book]');
+    if (!elements.length || !window.EventSource) {
+        return;
+    }
+    var ids = Array.from(new Set(Array.from(elements, function (el) { return el.dataset.liveBook; })));
+    var source = new EventSource(script.dataset.url + '?books=' + ids.join(','));
+
+    function badge(className, icon, text) {
+        var span = document.createElement('span');
+        span.className = className;
+        if (icon) {
+            var i = document.createElement('i');
+            i.className = 'bi ' + icon;
+            span.appendChild(i);
+            span.appendChild(document.createTextNode(' '));
+        }
+        span.appendChild(document.createTextNode(text));
+        return span;
+    }
+
+    function returnNote(state, detail) {
+        if (!state.available_from) {
+            return null;
+        }
+        var date = new Date(state.available_from);
+        var day = date.toLocaleDateString('fr-FR');
+        var note = document.createElement(detail ? 'p' : 'span');
+        note.className = detail ? 'text-muted mt-2 mb-0' : 'd-block text-muted mt-1';
+        if (!detail) {
+            note.textContent = 'Retour prévu le ' + day;
+        } else if (date < new Date()) {
+            note.textContent = 'Retour attendu (emprunt en retard depuis le ' + day + ')';
+        } else {
+            note.textContent = 'Disponible à partir du ' + day;
+        }
+        return note;
+    }
+
+    function render(el, state) {
+        var detail = el.dataset.liveFormat === 'detail';
+        var nodes;
+        if (state.copies_available > 0) {
+            nodes = [detail
+                ? badge('badge bg-success fs-6', 'bi-check-circle',
+                    'Disponible (' + state.copies_available + '/' + state.copies_total + ' exemplaires)')
+                : badge('badge bg-success', null, 'Disponible')];
+        } else {
+            nodes = [detail
+                ? badge('badge bg-danger fs-6', 'bi-x-circle', 'Actuellement indisponible')
+                : badge('badge bg-danger', null, 'Indisponible'), returnNote(state, detail)];
+        }
+        el.replaceChildren.apply(el, nodes.filter(Boolean));
+    }
+
+    source.addEventListener('availability', function (event) {
+        var state = JSON.parse(event.data);
+        document.querySelectorAll('[data-live-book="' + state.book + '"]').forEach(function (el) {
+            render(el, state);
+        });
+    });
+})();